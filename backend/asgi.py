@@ -0,0 +1,614 @@
+"""
+Asyncio-native serving mode for the Truth Quest API.
+
+/api/analyze and /api/verify-facts run on the event loop with the async OpenAI
+client and httpx, so a single process can keep hundreds of analyses waiting on
+providers at once. Blocking work (transcript tiers / yt-dlp, SQLite caches,
+Firebase) is offloaded to a thread pool, and every other route is served by the
+Flask app from server.py on the same pool.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 3001
+"""
+import asyncio
+import contextvars
+import fnmatch
+import io
+import uuid
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, unquote
+
+import httpx
+
+import server
+
+log = server.log.getChild('asgi')
+
+# Threads for blocking work (yt-dlp, SQLite, Firebase) and Flask fallback routes
+ASGI_BLOCKING_WORKERS = int(os.getenv('ASGI_BLOCKING_WORKERS', 32))
+# Concurrent provider calls per analysis when verifying sampled facts
+ASGI_VERIFY_CONCURRENCY = int(os.getenv('ASGI_VERIFY_CONCURRENCY', 8))
+
+blocking_pool = ThreadPoolExecutor(max_workers=ASGI_BLOCKING_WORKERS, thread_name_prefix='asgi-blocking')
+
+async_openai_client = None  # Created on first use, like the provider clients in server.py
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0),
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=50)
+)
+
+
+async def run_blocking(func, *args):
+    """Run a blocking function on the shared thread pool (keeping the request ID for its log lines)"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(blocking_pool, context.run, func, *args)
+
+
+def get_async_openai_client():
+    global async_openai_client
+    if async_openai_client is None and server.OPENAI_API_KEY:
+        from openai import AsyncOpenAI
+        async_openai_client = AsyncOpenAI(api_key=server.OPENAI_API_KEY)
+    return async_openai_client
+
+
+async def chat(operation, request_kwargs, deadline=None):
+    with server.metrics.timer('truthquest_provider_request_seconds', {'provider': 'openai', 'operation': operation},
+                              errors='truthquest_provider_errors_total'):
+        if deadline:
+            request_kwargs['timeout'] = deadline.timeout(120)
+        return await get_async_openai_client().chat.completions.create(**request_kwargs)
+
+
+async def search_brave_async(query, count=3, deadline=None):
+    """Non-blocking search_brave: same evidence index, same response shape"""
+    query, headers, params = server.prepare_brave_search(query, count)
+
+    local_results = await run_blocking(server.local_evidence_results, query, count)
+    if local_results:
+        return local_results
+
+    log.debug(f'Brave Search query: {query[:100]}...')
+
+    try:
+        with server.metrics.timer('truthquest_provider_request_seconds', {'provider': 'brave', 'operation': 'search'},
+                                  errors='truthquest_provider_errors_total'):
+            response = await http_client.get(server.BRAVE_SEARCH_URL, headers=headers, params=params,
+                                             timeout=server.request_timeout(deadline, 10))
+            response.raise_for_status()
+            results = response.json()
+        await run_blocking(server.evidence_index.add_results, query, results.get('web', {}).get('results', []))
+        return results
+    except httpx.HTTPStatusError as e:
+        log.warning(f'Brave API HTTP Error: {e.response.status_code} - {e.response.text}')
+        raise Exception(f'Brave Search API error: {e.response.status_code}')
+    except Exception as e:
+        log.warning(f'Brave API Error: {str(e)}')
+        raise
+
+
+async def chat_unless_cached(cached, operation, request_kwargs, deadline=None):
+    """chat(), skipped (None) when the result it would produce is already cached"""
+    if cached is not None:
+        return None
+    return await chat(operation, request_kwargs, deadline)
+
+
+async def cascaded_verdict_async(endpoint, request_kwargs, deadline=None):
+    """Non-blocking server.cascaded_verdict: same routes, same escalation rules"""
+    fast = server.MODEL_ROUTES[endpoint][0]
+    result = server.parse_verdict(await chat('verdict', {**request_kwargs, 'model': fast}, deadline))
+    strong = server.cascade_step(endpoint, result)
+    if strong:
+        try:
+            return server.parse_verdict(await chat('verdict_escalated', {**request_kwargs, 'model': strong}, deadline))
+        except Exception as e:
+            log.warning(f'Escalated verdict failed, keeping the {fast} verdict: {str(e)}')
+    return result
+
+
+async def verify_sampled_fact_async(fact, index, total, semaphore, deadline=None):
+    claim = server.checkable_claim(fact, index)
+    if not claim:
+        return None
+
+    async with semaphore:
+        try:
+            log.debug(f'Verifying fact {index}/{total}: {claim[:60]}...')
+            search_results = await search_brave_async(server.fact_search_query(fact),
+                                                      count=server.EVIDENCE_SEARCH_COUNT, deadline=deadline)
+            sources = server.select_evidence(claim, search_results)
+            result = await cascaded_verdict_async('analyze', server.verdict_request(claim, sources), deadline)
+            log.debug(f'Verdict: {result["verdict"]}')
+            return server.verified_fact_entry(fact, result, sources)
+        except Exception as e:
+            log.warning(f'Error verifying fact {index}: {str(e)}')
+            return server.failed_fact_entry(fact, e)
+
+
+async def verify_thesis_async(central_thesis, deadline=None):
+    log.debug('Verifying central thesis...')
+    thesis_search_results = await search_brave_async(f'{central_thesis[:200]}', count=server.EVIDENCE_SEARCH_COUNT,
+                                                     deadline=deadline)
+    thesis_sources = server.select_evidence(central_thesis, thesis_search_results)
+    thesis_result = await cascaded_verdict_async('analyze', server.verdict_request(central_thesis, thesis_sources),
+                                                 deadline)
+    log.info(f'Thesis verdict: {thesis_result["verdict"]}')
+    return server.thesis_entry(central_thesis, thesis_result, thesis_sources)
+
+
+async def run_analysis_async(video_id, check_mode, deadline=None):
+    """Async counterpart of server.run_analysis; fact extraction, thesis and verifications overlap"""
+    with server.metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'total'}):
+        deadline = deadline or server.Deadline(server.ANALYSIS_DEADLINE_SECONDS)
+        return await _run_analysis_stages(video_id, check_mode, deadline)
+
+
+async def _run_analysis_stages(video_id, check_mode, deadline):
+    log.info(f'Analyzing video: {video_id} (Mode: {check_mode}, async)')
+    degraded = []
+
+    with server.metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'transcript'}):
+        transcript, transcript_method = await run_blocking(server.fetch_transcript_for_analysis, video_id,
+                                                           deadline, degraded)
+    transcript_text = transcript.get('full', '')
+
+    thesis_only = deadline.remaining() < server.THESIS_ONLY_BELOW_SECONDS
+    if thesis_only:
+        log.warning(f'Only {deadline.remaining():.0f}s left after the transcript, checking the thesis only')
+        degraded.append('thesis_only')
+
+    all_facts, facts_request = [], None
+    if not thesis_only:
+        facts_request = server.facts_extraction_request(transcript_text)
+        facts_key = server.facts_cache_key(facts_request)
+        all_facts = await run_blocking(server.get_cached_facts, facts_key)
+
+    # A thesis verdict from an earlier run on this transcript skips both thesis calls
+    thesis_item = server.thesis_cache_item(transcript_text)
+    cached_thesis, = await run_blocking(server.get_cached_verdicts, video_id, [thesis_item])
+
+    log.info(f'[2/5] Extracting facts and central thesis... (Method: {transcript_method})')
+    with server.metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'fact_extraction'}):
+        thesis_response, facts_response = await asyncio.gather(
+            chat_unless_cached(cached_thesis, 'thesis', server.thesis_extraction_request(transcript_text), deadline),
+            chat_unless_cached(all_facts, 'extract_facts', facts_request, deadline),
+            return_exceptions=True
+        )
+    if isinstance(facts_response, BaseException):
+        raise facts_response
+    # As in server.verify_thesis, a thesis cut short by the deadline is reported unverified rather than failing
+    thesis_failed = isinstance(thesis_response, BaseException)
+    if thesis_failed:
+        if not isinstance(thesis_response, Exception) or not deadline.expired():
+            raise thesis_response
+        log.warning(f'Thesis not verified before the deadline: {thesis_response}')
+        degraded.append('thesis_unverified')
+    if facts_response:
+        all_facts = server.parse_extracted_facts(facts_response)
+        await run_blocking(server.facts_cache.set, facts_key, all_facts)
+
+    if len(all_facts) == 0 and not thesis_only:
+        # Thesis verification only feeds the grade, which there isn't one of without facts
+        return server.no_facts_payload(check_mode)
+
+    # Facts verified by an earlier run (e.g. the sample run before a full one) are not checked again
+    sampled_facts = server.sample_facts(all_facts, check_mode)
+    reused = await run_blocking(server.get_cached_verdicts, video_id, sampled_facts)
+    if any(reused):
+        log.info(f'Reusing {sum(1 for entry in reused if entry)} verdicts from earlier runs')
+
+    log.info('[5/5] Verifying central thesis and sampled facts...')
+    semaphore = asyncio.Semaphore(ASGI_VERIFY_CONCURRENCY)
+    thesis_task = None
+    if cached_thesis is None and not thesis_failed:
+        central_thesis = server.parse_thesis(thesis_response)
+        thesis_task = asyncio.ensure_future(verify_thesis_async(central_thesis, deadline))
+    fact_tasks = {i: asyncio.ensure_future(verify_sampled_fact_async(fact, i, len(sampled_facts), semaphore, deadline))
+                  for i, fact in enumerate(sampled_facts) if reused[i] is None}
+    pending = set()
+    tasks = [task for task in (thesis_task, *fact_tasks.values()) if task is not None]
+    if tasks:
+        with server.metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'verification'}):
+            # Whatever hasn't finished when the margin is reached is dropped rather than overrunning
+            budget = max(0, deadline.remaining() - server.DEADLINE_MARGIN_SECONDS)
+            try:
+                _, pending = await asyncio.wait(tasks, timeout=budget)
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+
+    if cached_thesis is not None:
+        thesis_verification = cached_thesis
+    elif thesis_failed:
+        thesis_verification = server.unverified_thesis_entry('', 'Not verified before the request deadline')
+    elif thesis_task in pending or thesis_task.exception() is not None:
+        if thesis_task not in pending:
+            log.warning(f'Thesis verification failed: {thesis_task.exception()}')
+            if not deadline.expired():
+                raise thesis_task.exception()
+        degraded.append('thesis_unverified')
+        thesis_verification = server.unverified_thesis_entry(central_thesis, 'Not verified before the request deadline')
+    else:
+        thesis_verification = thesis_task.result()
+        await run_blocking(server.store_verdict, video_id, thesis_item, thesis_verification)
+
+    finished = [fact_tasks.get(i) not in pending for i in range(len(sampled_facts))]
+    if not all(finished):
+        log.warning(f'Deadline reached after {sum(finished)} of {len(sampled_facts)} facts')
+        degraded.append('sample_reduced')
+
+    verified_facts = []
+    for i, done in enumerate(finished):
+        entry = reused[i] or (fact_tasks[i].result() if done else None)
+        if entry is not None:
+            verified_facts.append(entry)
+            if reused[i] is None:
+                await run_blocking(server.store_verdict, video_id, sampled_facts[i], entry)
+    sampled_facts = [fact for fact, done in zip(sampled_facts, finished) if done]
+
+    if all_facts and not sampled_facts and not thesis_only:
+        degraded.append('thesis_only')
+
+    return server.analysis_payload(video_id, check_mode, transcript, transcript_method, all_facts, sampled_facts,
+                                   verified_facts, thesis_verification, degraded)
+
+
+async def verify_fact_with_search_async(fact, semaphore):
+    async with semaphore:
+        try:
+            claim, search_query = server.claim_search_query(fact)
+            search_results = await search_brave_async(search_query, count=server.EVIDENCE_SEARCH_COUNT)
+            sources = server.select_evidence(claim, search_results)
+            verification_request = server.detailed_verdict_request(claim, sources)
+            verification_result = await cascaded_verdict_async('verify_facts', verification_request)
+            return server.detailed_verified_fact(fact, verification_result, sources, search_query)
+        except Exception as e:
+            return server.detailed_failed_fact(fact, e)
+
+# HTTP plumbing
+
+
+class HTTPRequest:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.body = body
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+def cors_headers(request):
+    """CORS headers for natively served routes, mirroring the Flask-CORS configuration"""
+    origin = request.headers.get('origin')
+    if not origin or not any(fnmatch.fnmatchcase(origin, allowed) for allowed in server.CORS_ORIGINS):
+        return []
+    return [
+        (b'access-control-allow-origin', origin.encode('latin-1')),
+        (b'access-control-allow-credentials', b'true'),
+        (b'vary', b'Origin')
+    ]
+
+
+async def send_json(send, request, payload, status=200, extra_headers=None):
+    """Send a JSON response, projected by ?fields= on success and compressed like Flask responses"""
+    if status < 400:
+        payload = server.project_fields(payload, request.query.get('fields'))
+    body = server.json_bytes(payload)
+    headers = [(b'content-type', b'application/json'), (b'vary', b'Accept-Encoding'),
+               *((name.lower().encode('latin-1'), value.encode('latin-1'))
+                 for name, value in (extra_headers or {}).items())]
+    encoding = server.negotiate_encoding(request.headers.get('accept-encoding', ''))
+    if encoding and len(body) >= server.COMPRESS_MIN_BYTES:
+        body = await run_blocking(server.compress_body, body, encoding)
+        headers.append((b'content-encoding', encoding.encode('latin-1')))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            *headers,
+            (b'content-length', str(len(body)).encode('latin-1')),
+            (b'x-request-id', server.request_id_var.get().encode('latin-1')),
+            *cors_headers(request)
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def authenticate(request):
+    """Async counterpart of server.verify_token; returns (user, error_response)"""
+    auth_header = request.headers.get('authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None, ({'error': 'Missing or invalid authorization header'}, 401)
+
+    try:
+        decoded_token = await run_blocking(server.verify_id_token_cached, auth_header.split('Bearer ')[1])
+    except Exception as e:
+        log.warning(f"Token verification error: {type(e).__name__}: {e}")
+        return None, ({'error': 'Invalid or expired token', 'details': str(e)}, 401)
+
+    return {
+        'uid': decoded_token['uid'],
+        'email': decoded_token.get('email'),
+        'email_verified': decoded_token.get('email_verified', False)
+    }, None
+
+
+async def analyze(request):
+    user, error = await authenticate(request)
+    if error:
+        return error
+
+    allowed, error_message, reservation = await run_blocking(server.reserve_usage, user['uid'])
+    if not allowed:
+        log.warning(f"Usage limit exceeded for user: {user['uid']}")
+        return {'error': error_message, 'limit_exceeded': True}, 429
+
+    try:
+        payload, status, *headers = await analyze_reserved(request, user['uid'])
+    except asyncio.CancelledError:
+        # The client disconnected (see app) before getting a result, so it isn't charged for one
+        await run_blocking(server.refund_usage, user['uid'], reservation)
+        raise
+    if status >= 400:
+        await run_blocking(server.refund_usage, user['uid'], reservation)
+    return (payload, status, *headers)
+
+
+@asynccontextmanager
+async def admitted_analysis(user_uid, priority, timeout):
+    """Async server.admitted_analysis: the event loop is woken when a slot frees up, not a thread"""
+    loop = asyncio.get_running_loop()
+    ticket = server.admission.enter(user_uid, server.ADMISSION_PRIORITIES[priority])
+    decided = loop.create_future()
+    server.admission.on_decided(ticket, lambda: loop.call_soon_threadsafe(
+        lambda: decided.done() or decided.set_result(None)
+    ))
+    try:
+        await asyncio.wait_for(decided, timeout)
+    except asyncio.TimeoutError:
+        pass
+    except asyncio.CancelledError:
+        # Client went away: leave the queue, or give back the slot if it was just granted
+        try:
+            server.admission.settle(ticket)
+            server.admission.release(ticket)  # settle() only returns if the slot was granted meanwhile
+        except server.AdmissionRejected:
+            pass
+        raise
+    server.admission.settle(ticket)
+    server.admission.started(ticket)
+    try:
+        yield
+    finally:
+        server.admission.release(ticket)
+
+
+async def analyze_reserved(request, user_uid):
+    deadline = server.Deadline(server.ANALYSIS_DEADLINE_SECONDS)
+    try:
+        data = request.json()
+        youtube_url = data.get('youtubeUrl')
+        check_mode = data.get('checkMode', 'sample')  # 'sample' or 'full'
+        force_refresh = bool(data.get('forceRefresh', False))  # Bypass the analysis cache
+
+        if not youtube_url:
+            return {'error': 'YouTube URL is required'}, 400
+
+        video_id = server.extract_video_id(youtube_url)
+        if not video_id:
+            return {'error': 'Invalid YouTube URL'}, 400
+
+        try:
+            backend = server.requested_transcription_backend(data)
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        result = None if force_refresh else await run_blocking(server.get_cached_analysis, video_id, check_mode)
+
+        run_mode = check_mode
+        if result is None:
+            run_mode = server.admission_check_mode(check_mode)
+            if run_mode != check_mode and not force_refresh:
+                result = await run_blocking(server.get_cached_analysis, video_id, run_mode)
+
+        if result is None:
+            try:
+                async with admitted_analysis(user_uid, run_mode, server.admission_timeout(deadline)):
+                    with server.transcription_backend_override(backend):
+                        result = await run_analysis_async(video_id, run_mode, deadline)
+            except server.AdmissionRejected as e:
+                return e.response()
+            except server.AnalysisError as e:
+                return e.payload, e.status_code
+            result = await run_blocking(server.store_analysis, video_id, run_mode, result)
+
+        return server.downgraded(result, check_mode), 200
+
+    except Exception as e:
+        log.exception(f'Analysis failed: {str(e)}')
+        return {'error': 'Failed to analyze video', 'details': str(e)}, 500
+
+
+async def verify_facts(request):
+    try:
+        if not get_async_openai_client():
+            return {'error': 'OpenAI API key not configured'}, 500
+
+        if not server.BRAVE_API_KEY:
+            return {'error': 'Brave Search API key not configured'}, 500
+
+        try:
+            data = request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return {'error': 'Request body must be a JSON object'}, 400
+
+        facts = data.get('facts', [])
+        if not facts:
+            return {'error': 'No facts provided for verification'}, 400
+
+        # Limit to first 10 facts to avoid response size issues
+        max_facts = 10
+        if len(facts) > max_facts:
+            log.info(f'Limiting verification to first {max_facts} facts (received {len(facts)})')
+            facts = facts[:max_facts]
+
+        log.info(f'Verifying {len(facts)} facts...')
+        semaphore = asyncio.Semaphore(ASGI_VERIFY_CONCURRENCY)
+        verified_facts = await asyncio.gather(*[verify_fact_with_search_async(fact, semaphore) for fact in facts])
+
+        return {
+            'success': True,
+            'verifiedFacts': verified_facts,
+            'summary': server.verification_summary(verified_facts)
+        }, 200
+
+    except Exception as e:
+        log.exception(f'Error verifying facts: {str(e)}')
+        return {'error': 'Failed to verify facts', 'details': str(e)}, 500
+
+
+async def health(request):
+    return {'status': 'ok', 'message': 'Truth Quest Python API is running (async)'}, 200
+
+ROUTES = {
+    ('POST', '/api/analyze'): analyze,
+    ('POST', '/api/verify-facts'): verify_facts,
+    ('GET', '/api/health'): health,
+}
+
+# Flask fallback for every route not served natively
+
+
+def wsgi_environ(scope, body):
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': unquote(scope['path'], encoding='latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+async def call_flask(scope, body, send):
+    """Serve a request with the Flask app on the blocking pool, streaming its response"""
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start['status'] = int(status.split(' ', 1)[0])
+        response_start['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    iterable = await run_blocking(server.app, wsgi_environ(scope, body), start_response)
+    iterator = iter(iterable)
+    started = False
+    try:
+        while True:
+            chunk = await run_blocking(next, iterator, None)
+            if chunk is None:
+                break
+            if not started:
+                await send({'type': 'http.response.start', **response_start})
+                started = True
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        if hasattr(iterable, 'close'):
+            await run_blocking(iterable.close)
+
+    if not started:
+        await send({'type': 'http.response.start', **response_start})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await run_blocking(server.warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await http_client.aclose()
+                blocking_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    # Flask's before_request hook picks the same ID up from the header on fallback routes
+    request_id = next((v.decode('latin-1') for k, v in scope.get('headers', []) if k.lower() == b'x-request-id'), None)
+    if request_id is None:
+        request_id = uuid.uuid4().hex[:16]
+        scope = {**scope, 'headers': [*scope.get('headers', []), (b'x-request-id', request_id.encode('latin-1'))]}
+    server.request_id_var.set(request_id)
+
+    body = await read_body(receive)
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        # Preflight requests and all remaining routes go through Flask (and Flask-CORS)
+        await call_flask(scope, body, send)
+        return
+
+    request = HTTPRequest(scope, body)
+    handling = asyncio.ensure_future(handler(request))
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({handling, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+        if not handling.done():
+            # The client went away (or the server is stopping): cancel the work so its quota is refunded
+            handling.cancel()
+            await asyncio.gather(handling, return_exceptions=True)
+    if handling.cancelled():
+        log.info(f"Client disconnected from {scope['path']}, request cancelled")
+        return
+    payload, status, *headers = handling.result()
+    await send_json(send, request, payload, status, *headers)
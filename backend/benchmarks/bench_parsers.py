@@ -0,0 +1,212 @@
+"""
+Microbenchmarks for the CPU-bound transcript parsers and text hot paths.
+
+Each case runs against generated fixtures that mimic real inputs: caption
+documents for a 2-minute clip, a 30-minute video and a 4-hour stream, and a
+2 MB watch page with captionTracks near the end. For every case it reports
+the median and best wall time per call and the peak memory allocated during
+one call (tracemalloc).
+
+Results can be saved as a baseline; --compare fails (exit 1) when a case's
+median time or peak allocation grows past --time-threshold or
+--alloc-threshold times the baseline.
+
+Usage:
+    python benchmarks/bench_parsers.py [--repeat 7] [--filter timedtext]
+    python benchmarks/bench_parsers.py --save benchmarks/baselines/parsers.json
+    python benchmarks/bench_parsers.py --compare benchmarks/baselines/parsers.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from xml.sax.saxutils import escape
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import media_jobs  # noqa: E402
+import server  # noqa: E402
+
+# Caption segments of ~4 seconds each
+TRANSCRIPT_SIZES = {'2min': 30, '30min': 450, '4h': 3600}
+WATCH_PAGE_BYTES = 2 * 1024 * 1024
+
+WORDS = ('the of and to in is that it was for on are with as he they be at one have this from '
+         'percent million study government report inflation vaccine climate energy growth').split()
+
+
+def caption_lines(count, seed=7):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14))) for _ in range(count)]
+
+
+def srt_timestamp(seconds):
+    hours, minutes = int(seconds // 3600), int(seconds % 3600 // 60)
+    return f'{hours:02d}:{minutes:02d}:{int(seconds % 60):02d},{int(seconds % 1 * 1000):03d}'
+
+
+def timedtext_fixture(lines):
+    body = ''.join(f'<text start="{i * 4.0}" dur="3.9">{escape(line)}</text>' for i, line in enumerate(lines))
+    return f'<?xml version="1.0" encoding="utf-8" ?><transcript>{body}</transcript>'
+
+
+def json3_fixture(lines):
+    events = []
+    for i, line in enumerate(lines):
+        words = line.split(' ')
+        events.append({'tStartMs': i * 4000, 'dDurationMs': 3900,
+                       'segs': [{'utf8': words[0]}] + [{'utf8': f' {word}', 'tOffsetMs': n * 250}
+                                                       for n, word in enumerate(words[1:], 1)]})
+        events.append({'tStartMs': i * 4000 + 3900, 'aAppend': 1, 'segs': [{'utf8': '\n'}]})
+    return {'wireMagic': 'pb3', 'events': events}
+
+
+def srt_fixture(lines):
+    return ''.join(f'{i + 1}\n{srt_timestamp(i * 4)} --> {srt_timestamp(i * 4 + 3.9)}\n{line}\n\n'
+                   for i, line in enumerate(lines))
+
+
+def watch_page_fixture(size=WATCH_PAGE_BYTES):
+    """A watch page padded with player JSON, with captionTracks near the end like the real thing"""
+    rng = random.Random(11)
+    base_url = 'https://www.youtube.com/api/timedtext?v=abcdefghijk'
+    tracks = [{'baseUrl': f'{base_url}&lang={lang}&sig={rng.getrandbits(64):x}',
+               'name': {'simpleText': name}, 'vssId': f'.{lang}', 'languageCode': lang, 'isTranslatable': True}
+              for lang, name in (('en', 'English'), ('es', 'Spanish'), ('de', 'German'), ('fr', 'French'))]
+    filler = json.dumps({'responseContext': {'serviceTrackingParams': [
+        {'service': 'CSI', 'params': [{'key': f'k{i}', 'value': f'{rng.getrandbits(128):x}'} for i in range(40)]}
+    ]}, 'playabilityStatus': {'status': 'OK', 'miniplayer': {'renderer': {'playbackMode': 'PLAYBACK_MODE_ALLOW'}}}})
+    head = '<!DOCTYPE html><html><head><script>var ytcfg = {};</script></head><body><script>'
+    captions = json.dumps({'captions': {'playerCaptionsTracklistRenderer': {'captionTracks': tracks}}})
+    padding = []
+    remaining = size - len(head) - len(captions) - 2048
+    while remaining > 0:
+        padding.append(filler)
+        remaining -= len(filler)
+    player = f'{{"filler": [{",".join(padding)}], {captions[1:-1]}}}'
+    return f'{head}var ytInitialPlayerResponse = {player};</script></body></html>'
+
+
+def video_urls(count=1000):
+    shapes = ['https://www.youtube.com/watch?v={id}&t=42s', 'https://youtu.be/{id}?si=abc',
+              'https://www.youtube.com/shorts/{id}', 'https://www.youtube.com/embed/{id}?start=3',
+              'https://m.youtube.com/watch?v={id}', 'https://example.com/not-a-video']
+    rng = random.Random(3)
+    return [shapes[i % len(shapes)].format(id=''.join(rng.choice('abcdefghijkLMNOP0123_-') for _ in range(11)))
+            for i in range(count)]
+
+
+def build_cases():
+    """{name: zero-argument callable}"""
+    cases = {}
+    for size, count in TRANSCRIPT_SIZES.items():
+        lines = caption_lines(count)
+        timedtext, json3, srt = timedtext_fixture(lines), json3_fixture(lines), srt_fixture(lines)
+        transcript = ' '.join(lines)
+        cases[f'timedtext_xml[{size}]'] = lambda doc=timedtext: server.parse_timedtext_xml(doc)
+        cases[f'json3_events[{size}]'] = lambda doc=json3: media_jobs.parse_json3_events(doc)
+        cases[f'srt_to_text[{size}]'] = lambda doc=srt: server.srt_to_text(doc)
+        cases[f'facts_extraction_request[{size}]'] = lambda text=transcript: server.facts_extraction_request(text)
+
+    page = watch_page_fixture()
+    cases['find_caption_tracks[2MB page]'] = lambda: server.find_caption_tracks(page)
+
+    urls = video_urls()
+    cases['extract_video_id[1000 urls]'] = lambda: [server.extract_video_id(url) for url in urls]
+
+    sources = [{'title': line[:150], 'url': f'https://example.org/{i}', 'description': line * 3}
+               for i, line in enumerate(caption_lines(5, seed=5))]
+    claim = 'Global inflation reached 9.1 percent in June 2022, the highest rate in four decades'
+    cases['verdict_request[5 sources]'] = lambda: server.verdict_request(claim, sources)
+    cases['detailed_verdict_request[5 sources]'] = lambda: server.detailed_verdict_request(claim, sources)
+    results = {'web': {'results': [{**source, 'extra_snippets': [line] * 2} for source, line
+                                   in zip(sources, caption_lines(5, seed=9))]}}
+    cases['select_evidence[5 results]'] = lambda: server.select_evidence(claim, results)
+    return cases
+
+
+def measure(func, repeat, min_time=0.05):
+    """(median seconds per call, best seconds per call, peak bytes allocated by one call)"""
+    func()  # Warm caches (regex compilation, imports)
+    loops, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(timings), min(timings), peak
+
+
+def compare(results, baseline, time_threshold, alloc_threshold):
+    regressions = []
+    print(f'\n{"case":<40} {"time x":>8} {"alloc x":>8}')
+    for name, current in results.items():
+        previous = baseline.get('cases', {}).get(name)
+        if not previous:
+            continue
+        time_ratio = current['median_ms'] / previous['median_ms'] if previous['median_ms'] else 1.0
+        alloc_ratio = current['peak_kb'] / previous['peak_kb'] if previous['peak_kb'] else 1.0
+        regressed = time_ratio > time_threshold or alloc_ratio > alloc_threshold
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<40} {time_ratio:>8.2f} {alloc_ratio:>8.2f}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7, help='timing rounds per case')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this text')
+    parser.add_argument('--save', help='write results as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--time-threshold', type=float, default=1.5, help='allowed median time ratio')
+    parser.add_argument('--alloc-threshold', type=float, default=1.25, help='allowed peak allocation ratio')
+    args = parser.parse_args()
+
+    results = {}
+    print(f'{"case":<40} {"median ms":>10} {"best ms":>10} {"peak KB":>10}')
+    for name, func in build_cases().items():
+        if args.filter not in name:
+            continue
+        median, best, peak = measure(func, args.repeat)
+        results[name] = {'median_ms': round(median * 1000, 4), 'best_ms': round(best * 1000, 4),
+                         'peak_kb': round(peak / 1024, 1)}
+        print(f'{name:<40} {median * 1000:>10.3f} {best * 1000:>10.3f} {peak / 1024:>10.1f}')
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({'python': sys.version.split()[0], 'cases': results}, baseline_file, indent=2)
+        print(f'\nBaseline written to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.time_threshold, args.alloc_threshold)
+        if regressions:
+            print(f'\nRegressed past threshold: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Worker startup benchmark.
+
+Times `import server` in fresh interpreters (what every gunicorn/uvicorn worker
+pays on boot or recycle) against an eager import of the provider SDKs that
+server.py used to load at module level, plus the cost of server.warm_up().
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 10] [--warm-up]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'lazy import (server)': 'import server',
+    'eager import (server + provider SDKs)': (
+        'import server, yt_dlp, openai, firebase_admin, youtube_transcript_api; '
+        'from firebase_admin import auth, firestore; '
+        'from googleapiclient.discovery import build'
+    ),
+}
+
+WARM_UP_SCENARIO = ('import + warm_up()', 'import server; server.warm_up()')
+
+
+def time_snippet(snippet):
+    """Wall-clock seconds to run a snippet in a fresh interpreter"""
+    code = (
+        'import time; _start = time.perf_counter(); '
+        f'{snippet}; '
+        'print(time.perf_counter() - _start)'
+    )
+    # Keep provider credentials out of the child so nothing reaches the network
+    env = {k: v for k, v in os.environ.items() if not k.endswith('_API_KEY')}
+    env['GOOGLE_APPLICATION_CREDENTIALS'] = os.devnull + '.missing'
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10, help='fresh interpreters per scenario')
+    parser.add_argument('--warm-up', action='store_true', help='also time server.warm_up()')
+    args = parser.parse_args()
+
+    scenarios = dict(SCENARIOS)
+    if args.warm_up:
+        scenarios[WARM_UP_SCENARIO[0]] = WARM_UP_SCENARIO[1]
+
+    print(f'{"scenario":<42} {"median ms":>10} {"p90 ms":>10} {"min ms":>10}')
+    for name, snippet in scenarios.items():
+        timings = sorted(time_snippet(snippet) * 1000 for _ in range(args.runs))
+        p90 = timings[min(len(timings) - 1, int(len(timings) * 0.9))]
+        print(f'{name:<42} {statistics.median(timings):>10.1f} {p90:>10.1f} {timings[0]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
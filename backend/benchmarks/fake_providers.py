@@ -0,0 +1,294 @@
+"""
+Local stand-ins for the providers behind /api/analyze.
+
+One threaded HTTP server answers for OpenAI (chat completions and audio
+transcriptions), Brave Search, RapidAPI transcripts, YouTube watch pages and
+timedtext captions. Firebase ID tokens are verified locally in auth-emulator
+mode, so `make_emulator_id_token` is all the load generator needs for auth.
+
+Each provider has its own latency, jitter and error rate, and payload sizes
+(transcript length, facts per video, search results) are configurable, so the
+same harness can model a slow OpenAI day or a flaky transcript provider.
+Responses are derived from a hash of the request, so different videos get
+different transcripts, claims and search results.
+
+Point server.py at a running instance with provider_env(base_url).
+
+Usage:
+    python benchmarks/fake_providers.py --port 9100 --latency openai=0.8,brave=0.2 --error-rate rapidapi=0.1
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PROVIDERS = ('openai', 'brave', 'rapidapi', 'youtube')
+
+# Seconds per call, roughly what each provider takes in production
+DEFAULT_LATENCY = {'openai': 1.0, 'brave': 0.3, 'rapidapi': 0.8, 'youtube': 0.4}
+
+# Claims are built from a large pseudo-vocabulary so that, as with real videos, only
+# repeated claims are answered from the evidence index
+SYLLABLES = 'ka lo mi ne ru sa ti vo ze ba de fi go hu ja ke li mo nu pa qui re so tu va we xi yo zu'.split()
+WORDS = sorted({a + b + c for a in SYLLABLES[:12] for b in SYLLABLES for c in ('', 'n', 'r', 's')})
+
+
+class FakeProviderConfig:
+    """Latency (seconds), jitter (fraction), error rate (0-1) per provider, plus payload sizes"""
+
+    def __init__(self, latency=None, error_rate=None, jitter=0.2, transcript_words=3000,
+                 facts_per_video=12, search_results=5, description_chars=300):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.error_rate = {provider: 0.0 for provider in PROVIDERS}
+        self.error_rate.update(error_rate or {})
+        self.jitter = jitter
+        self.transcript_words = transcript_words
+        self.facts_per_video = facts_per_video
+        self.search_results = search_results
+        self.description_chars = description_chars
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def seeded_random(*parts):
+    """Deterministic RNG for a request, so repeated videos and claims get identical answers"""
+    digest = hashlib.sha256('|'.join(str(p) for p in parts).encode('utf-8')).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def transcript_segments(video_id, config):
+    rng = seeded_random('transcript', video_id)
+    segments, remaining, start = [], config.transcript_words, 0.0
+    while remaining > 0:
+        words = min(12, remaining)
+        segments.append({'text': f'{video_id} {sentence(rng, words)}', 'start': round(start, 2), 'duration': 4.0})
+        remaining -= words
+        start += 4.0
+    return segments
+
+
+def make_emulator_id_token(uid, project_id='truth-quest', lifetime=3600):
+    """Unsigned Firebase ID token accepted by firebase_admin when FIREBASE_AUTH_EMULATOR_HOST is set"""
+    def encode(part):
+        return base64.urlsafe_b64encode(json.dumps(part).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+    now = int(time.time())
+    claims = {
+        'iss': f'https://securetoken.google.com/{project_id}', 'aud': project_id,
+        'sub': uid, 'user_id': uid, 'auth_time': now, 'iat': now, 'exp': now + lifetime,
+        'email': f'{uid}@loadtest.local', 'firebase': {'sign_in_provider': 'custom'}
+    }
+    return f'{encode({"alg": "none", "typ": "JWT"})}.{encode(claims)}.'
+
+
+def provider_env(base_url, project_id='truth-quest'):
+    """Environment that points server.py (and asgi.py) at a fake provider server"""
+    host = urlparse(base_url).netloc
+    return {
+        'OPENAI_API_KEY': 'fake-openai-key',
+        'OPENAI_BASE_URL': f'{base_url}/v1',
+        'BRAVE_API_KEY': 'fake-brave-key',
+        'BRAVE_SEARCH_URL': f'{base_url}/res/v1/web/search',
+        'RAPIDAPI_KEY': 'fake-rapidapi-key',
+        'RAPIDAPI_TRANSCRIPT_URL': f'{base_url}/youtube/transcript',
+        'YOUTUBE_API_KEY': 'fake-youtube-key',
+        'YOUTUBE_BASE_URL': base_url,
+        'FIREBASE_AUTH_EMULATOR_HOST': host,
+        'GOOGLE_CLOUD_PROJECT': project_id,
+        'GOOGLE_APPLICATION_CREDENTIALS': '/nonexistent/serviceAccountKey.json',
+    }
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = FakeProviderConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def simulate(self, provider):
+        """Sleep for the provider's latency; returns False (after sending a 500) for injected errors"""
+        latency = self.config.latency[provider]
+        time.sleep(max(0.0, latency * random.uniform(1 - self.config.jitter, 1 + self.config.jitter)))
+        if random.random() < self.config.error_rate[provider]:
+            self.send_body(500, {'error': f'injected {provider} failure'})
+            return False
+        return True
+
+    def send_body(self, status, payload, content_type='application/json'):
+        body = payload if isinstance(payload, bytes) else (
+            payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+        )
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/res/v1/web/search':
+            if self.simulate('brave'):
+                self.send_body(200, self.brave_results(query.get('q', '')))
+        elif url.path == '/youtube/transcript':
+            if self.simulate('rapidapi'):
+                self.send_body(200, transcript_segments(query.get('videoId', ''), self.config))
+        elif url.path == '/watch':
+            if self.simulate('youtube'):
+                self.send_body(200, self.watch_page(query.get('v', '')), 'text/html')
+        elif url.path == '/api/timedtext':
+            if self.simulate('youtube'):
+                self.send_body(200, self.timedtext(query.get('v', '')), 'text/xml')
+        else:
+            self.send_body(404, {'error': 'not found'})
+
+    def do_POST(self):
+        body = self.read_body()
+        path = urlparse(self.path).path
+        if path == '/v1/chat/completions':
+            if self.simulate('openai'):
+                self.send_body(200, self.chat_completion(json.loads(body or b'{}')))
+        elif path == '/v1/audio/transcriptions':
+            if self.simulate('openai'):
+                segments = transcript_segments(hashlib.sha256(body[:4096]).hexdigest()[:11], self.config)
+                self.send_body(200, {
+                    'task': 'transcribe', 'language': 'english', 'duration': segments[-1]['start'] + 4.0,
+                    'text': ' '.join(s['text'] for s in segments),
+                    'segments': [{'id': i, 'start': s['start'], 'end': s['start'] + s['duration'], 'text': s['text']}
+                                 for i, s in enumerate(segments)]
+                })
+        else:
+            self.send_body(404, {'error': 'not found'})
+
+    def chat_completion(self, request_body):
+        messages = request_body.get('messages', [])
+        prompt = messages[-1].get('content', '') if messages else ''
+        response_format = request_body.get('response_format') or {}
+        schema_name = response_format.get('json_schema', {}).get('name')
+        rng = seeded_random('chat', prompt)
+
+        if schema_name == 'facts_extraction' or (schema_name is None and 'facts' in prompt.lower()[:200]):
+            content = {'facts': [
+                {'claim': sentence(rng), 'category': rng.choice(['statistic', 'historical', 'scientific']),
+                 'entities': rng.sample(WORDS, 3), 'context': '', 'verifiable': True}
+                for _ in range(self.config.facts_per_video)
+            ]}
+        elif schema_name == 'thesis_extraction':
+            content = {'thesis': sentence(rng, 16), 'importance': 'central'}
+        else:
+            content = {
+                'verdict': rng.choice(['supported', 'supported', 'partially_true', 'refuted']),
+                'confidence': rng.randint(50, 95),
+                'reasoning': sentence(rng, 20),
+                'relevant_sources': [0]
+            }
+
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in messages) // 4
+        return {
+            'id': f'chatcmpl-{rng.getrandbits(48):x}', 'object': 'chat.completion', 'created': int(time.time()),
+            'model': request_body.get('model', 'gpt-5-mini'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': json.dumps(content)}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': 200, 'total_tokens': prompt_tokens + 200}
+        }
+
+    def brave_results(self, query):
+        rng = seeded_random('brave', query)
+        return {'web': {'results': [
+            {'title': sentence(rng, 8), 'url': f'https://example.org/{rng.getrandbits(32):x}',
+             'description': (sentence(rng, 40) * 4)[:self.config.description_chars]}
+            for _ in range(self.config.search_results)
+        ]}}
+
+    def watch_page(self, video_id):
+        host = self.headers.get('Host', 'localhost')
+        tracks = [{'baseUrl': f'http://{host}/api/timedtext?v={video_id}&lang=en',
+                   'name': {'simpleText': 'English'}, 'languageCode': 'en'}]
+        details = {'videoId': video_id, 'title': f'Fake video {video_id}', 'author': 'Fake channel',
+                   'lengthSeconds': str(self.config.transcript_words // 3), 'viewCount': '1000'}
+        player = json.dumps({'playabilityStatus': {'status': 'OK'}, 'videoDetails': details,
+                             'captions': {'playerCaptionsTracklistRenderer': {'captionTracks': tracks}}})
+        return f'<html><head></head><body><script>var ytInitialPlayerResponse = {player};</script></body></html>'
+
+    def timedtext(self, video_id):
+        from xml.sax.saxutils import escape
+        lines = [f'<text start="{s["start"]}" dur="{s["duration"]}">{escape(s["text"])}</text>'
+                 for s in transcript_segments(video_id, self.config)]
+        return '<?xml version="1.0" encoding="utf-8" ?><transcript>' + ''.join(lines) + '</transcript>'
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512  # Load tests open many connections at once
+
+
+def start_fake_providers(config=None, host='127.0.0.1', port=0):
+    """Serve the fake providers on a background thread; returns (server, base_url)"""
+    handler = type('ConfiguredFakeProviderHandler', (FakeProviderHandler,), {'config': config or FakeProviderConfig()})
+    httpd = FakeProviderServer((host, port), handler)
+    threading.Thread(target=httpd.serve_forever, name='fake-providers', daemon=True).start()
+    return httpd, f'http://{host}:{httpd.server_address[1]}'
+
+
+def parse_provider_values(text):
+    """'openai=0.8,brave=0.2' -> {'openai': 0.8, 'brave': 0.2}"""
+    values = {}
+    for item in filter(None, (text or '').split(',')):
+        provider, _, value = item.partition('=')
+        if provider not in PROVIDERS:
+            raise argparse.ArgumentTypeError(f'unknown provider {provider!r} (expected one of {", ".join(PROVIDERS)})')
+        values[provider] = float(value)
+    return values
+
+
+def add_config_arguments(parser):
+    parser.add_argument('--latency', type=parse_provider_values, default={},
+                        help='per-provider latency in seconds, e.g. openai=0.8,brave=0.2')
+    parser.add_argument('--error-rate', type=parse_provider_values, default={},
+                        help='per-provider error rate 0-1, e.g. rapidapi=0.1')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency jitter as a fraction of latency')
+    parser.add_argument('--transcript-words', type=int, default=3000)
+    parser.add_argument('--facts-per-video', type=int, default=12)
+    parser.add_argument('--search-results', type=int, default=5)
+
+
+def config_from_args(args):
+    return FakeProviderConfig(latency=args.latency, error_rate=args.error_rate, jitter=args.jitter,
+                              transcript_words=args.transcript_words, facts_per_video=args.facts_per_video,
+                              search_results=args.search_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    httpd, base_url = start_fake_providers(config_from_args(args), args.host, args.port)
+    print(f'Fake providers on {base_url}; point the server at them with:')
+    for name, value in provider_env(base_url).items():
+        print(f'  export {name}={value}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
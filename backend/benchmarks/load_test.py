@@ -0,0 +1,341 @@
+"""
+End-to-end load test for /api/analyze against local fake providers.
+
+Starts the fake providers (benchmarks/fake_providers.py) in this process,
+launches the API in a subprocess pointed at them (gunicorn + Flask, or
+uvicorn + asgi.py), then drives concurrent analyses with fresh emulator ID
+tokens. Reports:
+
+- requests/sec and client-side p50/p95/p99 latency, with errors by status
+- per-stage and per-provider p50/p95/p99, estimated from the /api/metrics
+  histograms scraped before and after the run
+- server RSS (peak and at the end, summed over the server's process tree)
+
+Caches and the quota database live in a temporary directory, so every run
+starts cold; use --repeat-ratio to send some requests for videos analysed
+earlier in the run. Each request uses its own user, so quotas never throttle
+the run. With several workers, gunicorn gives them a shared METRICS_DIR, so
+the stage metrics cover all of them (with uvicorn, keep --workers 1).
+
+Results can be saved as a baseline and later runs compared against it; the
+comparison exits non-zero when throughput or a p95 regresses by more than
+--tolerance.
+
+Usage:
+    python benchmarks/load_test.py --server asgi --concurrency 32 --requests 300
+    python benchmarks/load_test.py --server flask --save benchmarks/baselines/flask.json
+    python benchmarks/load_test.py --server flask --compare benchmarks/baselines/flask.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from fake_providers import (add_config_arguments, config_from_args, make_emulator_id_token, provider_env,
+                            start_fake_providers)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+METRIC_LINE = re.compile(r'^(?P<name>[a-z_]+)\{(?P<labels>[^}]*)\} (?P<value>\S+)$')
+# Workers write their metrics snapshot every METRICS_WRITE_SECONDS (5 by default)
+METRICS_SETTLE_SECONDS = 6
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(kind, port, workers, threads):
+    if kind == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--no-access-log', '--log-level', 'warning']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'server:app', '-b', f'127.0.0.1:{port}',
+            '-w', str(workers), '--threads', str(threads), '--log-level', 'warning']
+
+
+def wait_until_healthy(base_url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        try:
+            if requests.get(f'{base_url}/api/health', timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server did not become healthy in time')
+
+
+def process_tree_rss_mb(pid):
+    """RSS of a process and its descendants from /proc (None where /proc is unavailable)"""
+    try:
+        total, pending = 0, [pid]
+        while pending:
+            current = pending.pop()
+            with open(f'/proc/{current}/status') as status:
+                total += next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as children:
+                    pending.extend(int(child) for child in children.read().split())
+        return total / 1024
+    except (OSError, StopIteration):
+        return None
+
+
+class MemorySampler(threading.Thread):
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss = process_tree_rss_mb(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+
+def scrape_histograms(base_url, token):
+    """{(metric, labels-without-le): {le: cumulative count}} from /api/metrics"""
+    histograms = defaultdict(dict)
+    response = requests.get(f'{base_url}/api/metrics', headers={'Authorization': f'Bearer {token}'}, timeout=5)
+    response.raise_for_status()
+    text = response.text
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match or not match['name'].endswith('_bucket'):
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', match['labels']))
+        le = labels.pop('le')
+        key = (match['name'][:-len('_bucket')], tuple(sorted(labels.items())))
+        histograms[key][float('inf') if le == '+Inf' else float(le)] = float(match['value'])
+    return histograms
+
+
+def histogram_quantile(quantile, buckets):
+    """Prometheus-style quantile estimate from cumulative bucket counts (linear within a bucket)"""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]]
+    if total <= 0:
+        return None
+    rank = quantile * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound in bounds:
+        count = buckets[bound]
+        if count >= rank:
+            if bound == float('inf'):
+                return previous_bound
+            if count == previous_count:
+                return bound
+            return previous_bound + (bound - previous_bound) * (rank - previous_count) / (count - previous_count)
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def histogram_summary(before, after, metric, label_names):
+    summary = {}
+    for (name, labels), buckets in after.items():
+        if name != metric:
+            continue
+        earlier = before.get((name, labels), {})
+        delta = {bound: count - earlier.get(bound, 0) for bound, count in buckets.items()}
+        count = delta.get(float('inf'), 0)
+        if count <= 0:
+            continue
+        key = '/'.join(dict(labels)[label] for label in label_names)
+        summary[key] = {'count': int(count), **{f'p{q}': round(histogram_quantile(q / 100, delta), 3)
+                                                for q in (50, 95, 99)}}
+    return summary
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * len(sorted_values))) - 1))
+    return round(sorted_values[index], 3)
+
+
+def pick_video_ids(count, repeat_ratio, seed):
+    rng = random.Random(seed)
+    video_ids = []
+    for index in range(count):
+        if video_ids and rng.random() < repeat_ratio:
+            video_ids.append(rng.choice(video_ids))
+        else:
+            video_ids.append(f'lt{seed % 1000:03d}{index:06d}')
+    return video_ids
+
+
+def run_load(base_url, video_ids, concurrency, check_mode):
+    session_local = threading.local()
+
+    def analyze(index, video_id):
+        session = getattr(session_local, 'session', None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        headers = {'Authorization': f'Bearer {make_emulator_id_token(f"load-user-{index}")}'}
+        payload = {'youtubeUrl': f'https://www.youtube.com/watch?v={video_id}', 'checkMode': check_mode}
+        start = time.perf_counter()
+        try:
+            status = session.post(f'{base_url}/api/analyze', json=payload, headers=headers, timeout=300).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        return time.perf_counter() - start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(analyze, range(len(video_ids)), video_ids))
+    return time.perf_counter() - start, results
+
+
+def compare(current, baseline, tolerance):
+    """Print current vs baseline; returns the list of regressions"""
+    rows = [('throughput_rps', baseline['throughput_rps'], current['throughput_rps'], 'higher')]
+    rows += [(f'latency {q}', baseline['latency'].get(q), current['latency'].get(q), 'lower') for q in ('p50', 'p95')]
+    for stage, values in sorted(baseline.get('stages', {}).items()):
+        current_p95 = current.get('stages', {}).get(stage, {}).get('p95')
+        rows.append((f'stage {stage} p95', values.get('p95'), current_p95, 'lower'))
+    rows.append(('peak rss mb', baseline['memory_mb'].get('peak'), current['memory_mb'].get('peak'), 'lower'))
+
+    differing = sorted(key for key in ('server', 'workers', 'threads', 'concurrency', 'requests', 'check_mode')
+                       if baseline['config'].get(key) != current['config'].get(key))
+    if baseline.get('fake_providers') != current.get('fake_providers'):
+        differing.append('fake providers')
+    if differing:
+        print(f'\nNote: baseline was recorded with different settings ({", ".join(differing)})')
+
+    regressions = []
+    print(f'\n{"metric":<32} {"baseline":>10} {"current":>10} {"change":>8}')
+    for name, old, new, better in rows:
+        if old in (None, 0) or new is None:
+            continue
+        change = (new - old) / old
+        regressed = change < -tolerance if better == 'higher' else change > tolerance
+        if regressed:
+            regressions.append(name)
+        print(f'{name:<32} {old:>10.3f} {new:>10.3f} {change:>+7.0%}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def print_report(report):
+    print(f'\n{report["requests"]} requests, concurrency {report["config"]["concurrency"]}, '
+          f'server {report["config"]["server"]}: {report["throughput_rps"]:.2f} req/s')
+    print(f'latency s: p50 {report["latency"]["p50"]}  p95 {report["latency"]["p95"]}  p99 {report["latency"]["p99"]}')
+    print(f'status counts: {report["status_counts"]}')
+    for title, section in (('stage', report['stages']), ('provider', report['providers'])):
+        for name, values in sorted(section.items()):
+            print(f'  {title} {name:<28} n={values["count"]:<6} '
+                  f'p50 {values["p50"]:<8} p95 {values["p95"]:<8} p99 {values["p99"]}')
+    print(f'server rss mb: peak {report["memory_mb"]["peak"]}  end {report["memory_mb"]["end"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=32, help='gunicorn threads per worker (flask)')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--check-mode', choices=['sample', 'full'], default='sample')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0, help='share of requests for already-seen videos')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the report as a JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    fake_config = config_from_args(args)
+    fakes, fake_url = start_fake_providers(fake_config)
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    metrics_token = os.urandom(16).hex()
+    with tempfile.TemporaryDirectory(prefix='truthquest-load-') as state_dir:
+        env = {
+            **os.environ,
+            **provider_env(fake_url),
+            'ANALYSIS_CACHE_PATH': os.path.join(state_dir, 'analysis_cache.db'),
+            'EVIDENCE_INDEX_PATH': os.path.join(state_dir, 'evidence_index.db'),
+            'QUOTA_DB_PATH': os.path.join(state_dir, 'quota.db'),
+            'USAGE_ACCOUNTING': 'local',
+            'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+            'METRICS_TOKEN': metrics_token,
+        }
+        command = server_command(args.server, port, args.workers, args.threads)
+        server = subprocess.Popen(command, cwd=BACKEND_DIR, env=env)
+        try:
+            wait_until_healthy(base_url, server)
+            sampler = MemorySampler(server.pid)
+            sampler.start()
+
+            before = scrape_histograms(base_url, metrics_token)
+            video_ids = pick_video_ids(args.requests, args.repeat_ratio, args.seed)
+            elapsed, results = run_load(base_url, video_ids, args.concurrency, args.check_mode)
+            if args.workers > 1:
+                time.sleep(METRICS_SETTLE_SECONDS)  # let every worker write its last snapshot
+            after = scrape_histograms(base_url, metrics_token)
+
+            sampler.stopped.set()
+            end_rss = process_tree_rss_mb(server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+            fakes.shutdown()
+
+    latencies = sorted(latency for latency, status in results if status == 200)
+    status_counts = defaultdict(int)
+    for _, status in results:
+        status_counts[str(status)] += 1
+
+    report = {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')},
+        'fake_providers': fake_config.as_dict(),
+        'requests': len(results),
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 3),
+        'status_counts': dict(status_counts),
+        'latency': {f'p{q}': percentile(latencies, q) for q in (50, 95, 99)},
+        'stages': histogram_summary(before, after, 'truthquest_pipeline_stage_seconds', ['stage']),
+        'providers': histogram_summary(before, after, 'truthquest_provider_request_seconds', ['provider', 'operation']),
+        'memory_mb': {
+            'peak': round(max(filter(None, [sampler.peak, end_rss])), 1) if (sampler.peak or end_rss) else None,
+            'end': round(end_rss, 1) if end_rss else None
+        },
+    }
+    print_report(report)
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f'\nBaseline written to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f'\nRegressed beyond {args.tolerance:.0%}: {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+# Gunicorn settings for serving server:app (gunicorn -c gunicorn.conf.py server:app)
+import os
+import shutil
+import tempfile
+
+created_metrics_dir = None
+
+
+def on_starting(server):
+    """Give the workers a fresh shared metrics directory, so /api/metrics sums all of them"""
+    global created_metrics_dir
+    if not os.getenv('METRICS_DIR'):
+        os.environ['METRICS_DIR'] = created_metrics_dir = tempfile.mkdtemp(prefix='truthquest-metrics-')
+    directory = os.environ['METRICS_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics-'):
+            os.remove(os.path.join(directory, filename))
+
+
+def post_worker_init(worker):
+    """Size admission, create provider clients and start background jobs before the worker takes traffic"""
+    import server
+    server.size_admission(worker.cfg.threads)
+    server.warm_up()
+
+
+def on_exit(server):
+    """Remove the metrics directory if on_starting created it"""
+    if created_metrics_dir:
+        shutil.rmtree(created_metrics_dir, ignore_errors=True)
@@ -0,0 +1,257 @@
+"""
+yt-dlp, ffmpeg and local speech-to-text jobs for the media process pool (see server.run_media_job).
+
+Player-JSON extraction, caption parsing, audio transcoding and local transcription
+run here, in pool processes with a memory cap and a wall-clock limit, so a bad video
+can't stall or bloat a web worker. Jobs return only small, normalized results. Pool
+processes import this module on start, so it avoids importing server (Flask, stores,
+clients). Spawned processes also re-import the main script, which is why the Flask
+server is started from the small serve.py rather than server.py.
+"""
+import json
+import logging
+import os
+import resource
+import signal
+import urllib.request
+
+log = logging.getLogger('truthquest.media')
+
+# Tried in order until one yields English (or any) captions
+CAPTION_STRATEGIES = [
+    ('Android client', 'android'),  # Most reliable
+    ('iOS client', 'ios'),
+    ('TV embedded', 'tv_embedded'),
+]
+
+
+class MediaJobTimeout(Exception):
+    pass
+
+
+def init_worker(memory_limit_mb):
+    """Pool initializer: cap the address space of this process (and the ffmpeg it starts)"""
+    if memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _raise_timeout(signum, frame):
+    raise MediaJobTimeout('Media job exceeded its time limit')
+
+
+def run_job(func, args, timeout):
+    """Run func(*args), interrupting it with MediaJobTimeout after `timeout` seconds"""
+    previous = signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return func(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def parse_json3_events(subtitle_json):
+    """Segments and joined text from a json3 subtitle document (yt-dlp captions)"""
+    full_text_parts = []
+    segments = []
+
+    for event in subtitle_json.get('events', []):
+        if 'segs' in event:
+            text = ''.join([seg.get('utf8', '') for seg in event['segs']])
+            if text.strip():
+                full_text_parts.append(text.strip())
+                segments.append({
+                    'text': text.strip(),
+                    'start': event.get('tStartMs', 0) / 1000,
+                    'duration': event.get('dDurationMs', 0) / 1000
+                })
+
+    return segments, ' '.join(full_text_parts)
+
+
+def _cookie_opts(cookies_path):
+    return {'cookiefile': cookies_path} if cookies_path and os.path.exists(cookies_path) else {}
+
+
+def _player_opts(player_client):
+    return {'extractor_args': {'youtube': {'player_client': [player_client], 'skip': ['dash', 'hls']}}}
+
+
+def _json3_tracks(tracks, generated):
+    """Caption tracks with a json3 format, as probe_video reports them"""
+    found = []
+    for language_code, formats in tracks.items():
+        url = next((fmt.get('url') for fmt in formats or [] if fmt.get('ext') == 'json3'), None)
+        if url:
+            found.append({'languageCode': language_code, 'generated': generated, 'url': url, 'format': 'json3'})
+    return found
+
+
+def probe_video(video_id, socket_timeout, cookies_path):
+    """
+    One yt-dlp extraction (Android client) reduced to the video metadata and caption inventory:
+    {'title', 'uploader', 'duration', 'view_count', 'captionTracks'}.
+    """
+    import yt_dlp
+
+    ydl_opts = {
+        'skip_download': True,
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': socket_timeout,
+        **_player_opts('android'),
+        **_cookie_opts(cookies_path)
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
+
+    # Automatic captions are offered in every translation language; keep English and the original track
+    automatic = {code: formats for code, formats in (info.get('automatic_captions') or {}).items()
+                 if code == 'en' or code.startswith('en-') or code.endswith('-orig')}
+    return {
+        'title': info.get('title'),
+        'uploader': info.get('uploader'),
+        'duration': info.get('duration'),
+        'view_count': info.get('view_count'),
+        'captionTracks': (_json3_tracks(info.get('subtitles') or {}, False)
+                          + _json3_tracks(automatic, True))
+    }
+
+
+def caption_transcript(video_id, socket_timeout, cookies_path):
+    """Captions via yt-dlp (trying each player client) as {'full', 'segments', 'method'}"""
+    import yt_dlp
+
+    for name, player_client in CAPTION_STRATEGIES:
+        try:
+            log.debug(f'Trying yt-dlp with {name}...')
+            ydl_opts = {
+                'skip_download': True,
+                'writesubtitles': True,
+                'writeautomaticsub': True,
+                'subtitleslangs': ['en'],
+                'quiet': True,
+                'no_warnings': True,
+                'socket_timeout': socket_timeout,
+                **_player_opts(player_client),
+                **_cookie_opts(cookies_path)
+            }
+
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
+
+            # Manual English subtitles first, then automatic, then any language
+            subtitles = info.get('subtitles') or {}
+            automatic_captions = info.get('automatic_captions') or {}
+            transcript_data = subtitles.get('en') or automatic_captions.get('en')
+            if not transcript_data and (subtitles or automatic_captions):
+                tracks = subtitles or automatic_captions
+                transcript_data = tracks[next(iter(tracks))]
+
+            # The json3 format carries the text with timings
+            json_url = next((fmt.get('url') for fmt in transcript_data or [] if fmt.get('ext') == 'json3'), None)
+            if not json_url:
+                continue
+
+            with urllib.request.urlopen(json_url, timeout=socket_timeout) as response:
+                subtitle_json = json.loads(response.read().decode('utf-8'))
+
+            segments, full_text = parse_json3_events(subtitle_json)
+            if full_text:
+                return {'full': full_text, 'segments': segments, 'method': f'yt-dlp ({name})'}
+
+        except MediaJobTimeout:
+            raise
+        except Exception as e:
+            log.debug(f'{name} failed: {str(e)}')
+
+    raise Exception('All yt-dlp strategies failed. YouTube may be blocking automated access.')
+
+
+def download_audio(video_id, output_dir, socket_timeout, cookies_path, ffmpeg_path):
+    """
+    Download the audio track as mp3 into output_dir (yt-dlp + ffmpeg), extracting the video
+    once. Returns the file path and the video metadata the analysis shows, not yt-dlp's full
+    info dict.
+    """
+    import yt_dlp
+
+    ydl_opts = {
+        'format': 'bestaudio/best',
+        'postprocessors': [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }],
+        'outtmpl': os.path.join(output_dir, 'audio.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'ffmpeg_location': ffmpeg_path,
+        'socket_timeout': socket_timeout,
+        **_player_opts('android'),  # Better bot bypass
+        **_cookie_opts(cookies_path)
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=True)
+
+    return {
+        'path': os.path.join(output_dir, 'audio.mp3'),
+        'title': info.get('title', 'Unknown Title'),
+        'uploader': info.get('uploader', 'Unknown Uploader'),
+        'duration': info.get('duration', 0),
+        'view_count': info.get('view_count', 0)
+    }
+
+
+_local_models = {}  # Loaded faster-whisper models, kept for the life of the pool process
+
+
+def transcribe_local(audio_path, model_size, compute_type, threads):
+    """Transcribe with a (quantized) faster-whisper model on CPU as {'full', 'segments', 'language'}"""
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError:
+        raise Exception('Local transcription needs faster-whisper (pip install faster-whisper)')
+
+    key = (model_size, compute_type, threads)
+    if key not in _local_models:
+        _local_models[key] = WhisperModel(model_size, device='cpu', compute_type=compute_type, cpu_threads=threads)
+
+    # Segments are decoded lazily while iterating; the VAD filter skips silent stretches
+    segment_iter, info = _local_models[key].transcribe(audio_path, vad_filter=True)
+    segments = []
+    for segment in segment_iter:
+        text = segment.text.strip()
+        if text:
+            segments.append({'text': text, 'start': segment.start, 'duration': segment.end - segment.start})
+
+    return {
+        'full': ' '.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'method': f'whisper-local ({model_size})',
+        'language': info.language
+    }
+
+
+def list_videos(url, limit, socket_timeout, cookies_path):
+    """The first `limit` videos of a playlist or channel tab as [{'videoId', 'title'}] (one flat listing)"""
+    import yt_dlp
+
+    ydl_opts = {
+        'extract_flat': 'in_playlist',  # Entries only, no per-video player requests
+        'playlistend': limit,
+        'quiet': True,
+        'no_warnings': True,
+        'socket_timeout': socket_timeout,
+        **_cookie_opts(cookies_path)
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+
+    videos = [{'videoId': entry['id'], 'title': entry.get('title')}
+              for entry in info.get('entries') or [] if entry and len(entry.get('id') or '') == 11]
+    return videos[:limit]
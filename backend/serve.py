@@ -0,0 +1,12 @@
+"""
+Run the API with Flask's own server: python serve.py
+
+Media pool processes are started with spawn, which re-imports the main script in
+every pool process. Keeping the main script this small means they load only
+media_jobs, not server (Flask, the stores, logging) as they would under
+`python server.py`.
+"""
+
+if __name__ == '__main__':
+    import server
+    server.main()
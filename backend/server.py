@@ -1,79 +1,422 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from openai import OpenAI
-import yt_dlp
 import requests
 import re
 import os
+import json
+import atexit
+import fcntl
+import hashlib
+import bisect
+import time
+import sqlite3
 import tempfile
+import threading
+import copy
+import queue
+import random
+import itertools
+import math
+import uuid
+import logging
+import logging.handlers
+import gzip
+import contextvars
+import multiprocessing
+import importlib.util
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
-from functools import wraps
-from datetime import datetime, timedelta
-from youtube_transcript_api import YouTubeTranscriptApi, TranscriptsDisabled, NoTranscriptFound
+from functools import partial, wraps
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+try:
+    import orjson  # Optional: faster JSON encoding
+except ImportError:
+    orjson = None
+try:
+    import brotli  # Optional: br content encoding
+except ImportError:
+    brotli = None
+import media_jobs
 
 load_dotenv()
 
+# Logging: records are queued on the request thread and written by a background listener.
+# LOG_LEVEL=DEBUG restores the full per-step output; LOG_DEBUG_SAMPLE_RATE thins it out.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))
+
+request_id_var = contextvars.ContextVar('request_id', default='-')
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the current request ID and drop a share of DEBUG records"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        if record.levelno <= logging.DEBUG and LOG_DEBUG_SAMPLE_RATE < 1.0:
+            return random.random() < LOG_DEBUG_SAMPLE_RATE
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields are included as-is"""
+
+    RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'request_id'}
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class PreparedQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that keeps fields intact so the listener can format them as JSON"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging():
+    """Route the `truthquest` logger through a background queue listener (idempotent)"""
+    logger = logging.getLogger('truthquest')
+    if logger.handlers:
+        return logger
+
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'text':
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(request_id)s] %(message)s'))
+    else:
+        stream_handler.setFormatter(JSONFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = PreparedQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+
+log = configure_logging()
+
 app = Flask(__name__)
 
+
+@app.before_request
+def assign_request_id():
+    request_id_var.set(request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16])
+
+
+@app.after_request
+def add_request_id_header(response):
+    response.headers['X-Request-ID'] = request_id_var.get()
+    return response
+
+
+# Response bodies at least this large are compressed when the client accepts gzip or br
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain')
+
+
+def json_bytes(obj, default=DefaultJSONProvider.default):
+    """Compact UTF-8 JSON, encoded with orjson when it is installed"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() through json_bytes, skipping Flask's key sorting and indentation"""
+
+    def dumps(self, obj, **kwargs):
+        return json_bytes(obj, self.default).decode('utf-8')
+
+    def response(self, *args, **kwargs):
+        return self._app.response_class(json_bytes(self._prepare_response_obj(args, kwargs), self.default),
+                                        mimetype=self.mimetype)
+
+
+app.json = FastJSONProvider(app)
+
+
+def negotiate_encoding(accept_encoding):
+    """'br', 'gzip' or None for an Accept-Encoding header (codings with q=0 are refused)"""
+    accepted = set()
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(coding.strip())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+@app.after_request
+def compress_response(response):
+    """Compress buffered JSON and text responses; streamed (NDJSON) responses are left alone"""
+    if (response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding', ''))
+    body = response.get_data()
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _field_tree(paths):
+    """{'a': {'b': None}} for ['a.b']; None marks a whole field"""
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for i, part in enumerate(parts):
+            if part in node and node[part] is None:
+                break  # The whole field is already selected
+            if i == len(parts) - 1:
+                node[part] = None
+            else:
+                node = node.setdefault(part, {})
+    return tree
+
+
+def _keep_fields(value, tree):
+    if isinstance(value, list):
+        return [_keep_fields(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: value[key] if sub is None else _keep_fields(value[key], sub)
+            for key, sub in tree.items() if key in value}
+
+
+def _drop_fields(value, tree):
+    if isinstance(value, list):
+        return [_drop_fields(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: item if key not in tree else _drop_fields(item, tree[key])
+            for key, item in value.items() if key not in tree or tree[key] is not None}
+
+
+def project_fields(payload, fields):
+    """
+    Apply a `fields=` projection to a response payload: comma-separated dotted paths to keep
+    (`videoId,grade,verifiedFacts.claim`) and/or to drop when prefixed with '-'
+    (`-transcript.segments,-verifiedFacts.verification.reasoning`). Lists are projected per item.
+    """
+    if not fields:
+        return payload
+    paths = [path.strip() for path in fields.split(',') if path.strip()]
+    keep = [path for path in paths if not path.startswith('-')]
+    drop = [path[1:] for path in paths if path.startswith('-')]
+    if keep:
+        payload = _keep_fields(payload, _field_tree(keep))
+    if drop:
+        payload = _drop_fields(payload, _field_tree(drop))
+    return payload
+
+
 # Configure CORS for multiple origins
+CORS_ORIGINS = [
+    "http://localhost:5173",  # Local Vite dev server
+    "http://localhost:3000",  # Alternative local dev
+    "https://truth-quest.web.app",  # Firebase Hosting
+    "https://truth-quest.firebaseapp.com",  # Firebase Hosting alternate
+    "https://*.web.app",  # Any Firebase preview channels
+    "https://*.firebaseapp.com",  # Any Firebase preview channels
+    "https://api.oasis-pet.com"  # Production API domain
+]
+
 CORS(app, resources={
     r"/api/*": {
-        "origins": [
-            "http://localhost:5173",  # Local Vite dev server
-            "http://localhost:3000",  # Alternative local dev
-            "https://truth-quest.web.app",  # Firebase Hosting
-            "https://truth-quest.firebaseapp.com",  # Firebase Hosting alternate
-            "https://*.web.app",  # Any Firebase preview channels
-            "https://*.firebaseapp.com",  # Any Firebase preview channels
-            "https://api.oasis-pet.com"  # Production API domain
-        ],
+        "origins": CORS_ORIGINS,
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Request-ID"],
+        "expose_headers": ["X-Request-ID"],
         "supports_credentials": True
     }
 })
 
-# Initialize Firebase Admin SDK
-try:
-    # Check for service account key file
-    cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', './serviceAccountKey.json')
-    print(f"🔑 Loading Firebase credentials from: {cred_path}")
-    
-    if not os.path.exists(cred_path):
-        print(f"❌ ERROR: Firebase service account key not found at: {cred_path}")
-        print("Please upload serviceAccountKey.json to the backend directory")
-        cred = None
-        db = None
-    else:
-        # Initialize with credentials
-        cred = credentials.Certificate(cred_path)
-        firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        print("✅ Firebase Admin SDK initialized successfully")
-        print(f"✅ Project ID: {cred.project_id}")
-except Exception as e:
-    print(f"❌ Firebase Admin SDK initialization error: {e}")
-    import traceback
-    traceback.print_exc()
-    db = None
+# Provider clients (Firebase, OpenAI, YouTube) are created on first use or by warm_up(),
+# so importing this module stays fast and never touches the network
+_provider_lock = threading.RLock()
+_firebase_initialized = False
+firebase_app = None
+db = None
+openai_client = None
+youtube_api = None
+_youtube_discovery_client = None
+
+
+def init_firebase():
+    """Initialize the Firebase Admin SDK once per process"""
+    global firebase_app, db, _firebase_initialized
+    with _provider_lock:
+        if _firebase_initialized:
+            return
+        _firebase_initialized = True
+
+        try:
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
+            # Check for service account key file
+            cred_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', './serviceAccountKey.json')
+
+            if os.getenv('FIREBASE_AUTH_EMULATOR_HOST') and not os.path.exists(cred_path):
+                # Auth emulator (local development / load tests): tokens are unsigned, so no
+                # service account or signing certificates are needed. Firestore is only used
+                # when its emulator is configured too.
+                project_id = os.getenv('GOOGLE_CLOUD_PROJECT', 'truth-quest')
+                firebase_app = firebase_admin.initialize_app(options={'projectId': project_id})
+                db = firestore.client() if os.getenv('FIRESTORE_EMULATOR_HOST') else None
+                log.info(f"Firebase Admin SDK using the auth emulator at {os.getenv('FIREBASE_AUTH_EMULATOR_HOST')}")
+                return
+
+            log.info(f"Loading Firebase credentials from: {cred_path}")
+
+            if not os.path.exists(cred_path):
+                log.error(f"Firebase service account key not found at: {cred_path}; "
+                          "upload serviceAccountKey.json to the backend directory")
+                return
+
+            # Initialize with credentials
+            cred = credentials.Certificate(cred_path)
+            firebase_app = firebase_admin.initialize_app(cred)
+            db = firestore.client()
+            log.info("Firebase Admin SDK initialized successfully")
+            log.info(f"Project ID: {cred.project_id}")
+        except Exception as e:
+            log.exception(f"Firebase Admin SDK initialization error: {e}")
+            firebase_app = None
+            db = None
+            return
+
+    start_cert_refresher()
+
+
+def get_db():
+    if not _firebase_initialized:
+        init_firebase()
+    return db
+
+
+def get_firebase_app():
+    if not _firebase_initialized:
+        init_firebase()
+    return firebase_app
+
+
+def get_openai_client():
+    global openai_client
+    if openai_client is None and OPENAI_API_KEY:
+        with _provider_lock:
+            if openai_client is None:
+                from openai import OpenAI
+                openai_client = OpenAI(api_key=OPENAI_API_KEY)
+    return openai_client
+
+
+def get_youtube_api():
+    """YouTube Data API client authenticated with YOUTUBE_API_KEY"""
+    global youtube_api
+    if youtube_api is None and YOUTUBE_API_KEY:
+        with _provider_lock:
+            if youtube_api is None:
+                from googleapiclient.discovery import build
+                # static_discovery reads the discovery document shipped with the client library
+                youtube_api = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY, static_discovery=True)
+    return youtube_api
+
+
+def get_youtube_discovery_client():
+    """
+    Credential-less YouTube Data API client, built once and shared by every OAuth request.
+    Per-user credentials are supplied at execute() time via authorized_http().
+    """
+    global _youtube_discovery_client
+    if _youtube_discovery_client is None:
+        with _provider_lock:
+            if _youtube_discovery_client is None:
+                import httplib2
+                from googleapiclient.discovery import build
+                _youtube_discovery_client = build('youtube', 'v3', http=httplib2.Http(), static_discovery=True)
+    return _youtube_discovery_client
+
+
+def authorized_http(oauth_token):
+    import google_auth_httplib2
+    from google.oauth2.credentials import Credentials
+    return google_auth_httplib2.AuthorizedHttp(Credentials(token=oauth_token))
+
+
+def warm_up():
+    """Create provider clients and start background jobs ahead of the first request"""
+    init_firebase()
+    get_openai_client()
+    get_youtube_api()
+    if USAGE_ACCOUNTING == 'local':
+        start_quota_flusher()
+    if METRICS_DIR:
+        start_metrics_writer()
+
 
 # YouTube API configuration
 YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
-youtube_api = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY) if YOUTUBE_API_KEY else None
+# Watch pages for the timedtext scraper (overridable to point at local stand-ins)
+YOUTUBE_BASE_URL = os.getenv('YOUTUBE_BASE_URL', 'https://www.youtube.com')
 
 # YouTube cookies path for yt-dlp (to bypass bot detection)
 YOUTUBE_COOKIES_PATH = os.getenv('YOUTUBE_COOKIES_PATH', './youtube_cookies.txt')
 
 # RapidAPI configuration for YouTube transcripts
 RAPIDAPI_KEY = os.getenv('RAPIDAPI_KEY')
+RAPIDAPI_TRANSCRIPT_URL = os.getenv(
+    'RAPIDAPI_TRANSCRIPT_URL', 'https://youtube-transcripts.p.rapidapi.com/youtube/transcript'
+)
 
-# OpenAI configuration
+# OpenAI configuration (the SDK also honours OPENAI_BASE_URL)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 
 # Brave Search API configuration
 BRAVE_API_KEY = os.getenv('BRAVE_API_KEY')
@@ -81,1230 +424,3415 @@ BRAVE_API_KEY = os.getenv('BRAVE_API_KEY')
 # FFmpeg path
 FFMPEG_PATH = '/opt/homebrew/bin/ffmpeg'
 
+# Process pool for yt-dlp extraction and ffmpeg transcoding (0 workers runs jobs inline)
+MEDIA_POOL_WORKERS = int(os.getenv('MEDIA_POOL_WORKERS', 2))
+MEDIA_JOB_MEMORY_MB = int(os.getenv('MEDIA_JOB_MEMORY_MB', 1536))  # Address-space cap per pool process
+MEDIA_JOB_TIMEOUT_SECONDS = int(os.getenv('MEDIA_JOB_TIMEOUT_SECONDS', 240))
+# Pool processes are replaced after this many jobs
+MEDIA_JOBS_PER_PROCESS = int(os.getenv('MEDIA_JOBS_PER_PROCESS', 20))
+
+# Speech-to-text for the last transcript tier: 'api' (OpenAI Whisper), 'local' (faster-whisper
+# on CPU, in its own process pool) or 'auto' (API, local for audio over the API limit or on API errors).
+# Requests can pick one with transcriptionBackend.
+TRANSCRIPTION_BACKENDS = ('api', 'local', 'auto')
+TRANSCRIPTION_BACKEND = os.getenv('TRANSCRIPTION_BACKEND', 'api')
+WHISPER_API_MAX_MB = 25
+WHISPER_AUDIO_MB_PER_SECOND = 192 / 8 / 1024  # The 192 kbps mp3 download_audio produces
+LOCAL_WHISPER_MODEL = os.getenv('LOCAL_WHISPER_MODEL', 'small')  # tiny/base/small/medium/large-v3 or a model dir
+LOCAL_WHISPER_COMPUTE_TYPE = os.getenv('LOCAL_WHISPER_COMPUTE_TYPE', 'int8')
+# Address-space cap for the local transcription pool (0: none). CTranslate2 reserves far more address
+# space than it uses, so MEDIA_JOB_MEMORY_MB would stop the larger models from loading
+LOCAL_WHISPER_MEMORY_MB = int(os.getenv('LOCAL_WHISPER_MEMORY_MB', 0))
+# Local transcription has its own pool so long transcriptions never hold up yt-dlp and ffmpeg jobs
+LOCAL_WHISPER_WORKERS = int(os.getenv('LOCAL_WHISPER_WORKERS', 1))
+LOCAL_WHISPER_THREADS = int(os.getenv('LOCAL_WHISPER_THREADS',  # Per pool process; the pool shares the cores
+                                      max(1, (os.cpu_count() or 2) // max(LOCAL_WHISPER_WORKERS, 1))))
+LOCAL_WHISPER_TIMEOUT_SECONDS = int(os.getenv('LOCAL_WHISPER_TIMEOUT_SECONDS', 3600))  # Also bounded by the deadline
+transcription_backend_var = contextvars.ContextVar('transcription_backend', default=None)
+
+# Analysis result cache (stale-while-revalidate)
+ANALYSIS_CACHE_PATH = os.getenv('ANALYSIS_CACHE_PATH', './analysis_cache.db')
+ANALYSIS_CACHE_FRESH_SECONDS = int(os.getenv('ANALYSIS_CACHE_FRESH_SECONDS', 6 * 3600))  # Served as-is
+ANALYSIS_CACHE_MAX_AGE_SECONDS = int(os.getenv('ANALYSIS_CACHE_MAX_AGE_SECONDS', 7 * 24 * 3600))  # Stale + refreshed
+ANALYSIS_REFRESH_WORKERS = int(os.getenv('ANALYSIS_REFRESH_WORKERS', 2))  # Stale analyses recomputed at once
+ANALYSIS_REFRESH_MAX_PENDING = int(os.getenv('ANALYSIS_REFRESH_MAX_PENDING', 16))  # Beyond this, stale hits don't queue
+# Transcripts and extracted facts are cached in the same file and reused across check modes and refreshes
+TRANSCRIPT_CACHE_MAX_AGE_SECONDS = int(os.getenv('TRANSCRIPT_CACHE_MAX_AGE_SECONDS', 30 * 24 * 3600))
+# Per-fact and thesis verdicts, reused by later runs on the same video (e.g. a sample run upgraded to full).
+# Kept no longer than analyses stay fresh, so background refreshes re-verify.
+VERDICT_CACHE_MAX_AGE_SECONDS = int(os.getenv('VERDICT_CACHE_MAX_AGE_SECONDS', ANALYSIS_CACHE_FRESH_SECONDS))
+# Video metadata probe (title, duration, caption tracks); caption URLs are signed, so it is kept briefly
+VIDEO_METADATA_MAX_AGE_SECONDS = int(os.getenv('VIDEO_METADATA_MAX_AGE_SECONDS', 3600))
+VIDEO_PROBE_TIMEOUT_SECONDS = int(os.getenv('VIDEO_PROBE_TIMEOUT_SECONDS', 30))  # Limit for the yt-dlp probe job
+VIDEO_PROBE_WORKERS = int(os.getenv('VIDEO_PROBE_WORKERS', 8))  # Probes running alongside the RapidAPI tier
+# How long a RapidAPI transcript waits for an unfinished probe's metadata before going without it
+VIDEO_PROBE_GRACE_SECONDS = float(os.getenv('VIDEO_PROBE_GRACE_SECONDS', 0.25))
+
+# Local evidence index built from accumulated Brave results
+EVIDENCE_INDEX_PATH = os.getenv('EVIDENCE_INDEX_PATH', './evidence_index.db')
+EVIDENCE_MAX_AGE_SECONDS = int(os.getenv('EVIDENCE_MAX_AGE_SECONDS', 14 * 24 * 3600))
+EVIDENCE_MIN_RESULTS = int(os.getenv('EVIDENCE_MIN_RESULTS', 3))  # Local hits needed to skip Brave
+# Share of the claim's terms a snippet must contain
+EVIDENCE_MIN_TERM_OVERLAP = float(os.getenv('EVIDENCE_MIN_TERM_OVERLAP', 0.6))
+# Verdict prompts carry the search passages that best match the claim, not every result verbatim
+EVIDENCE_SEARCH_COUNT = int(os.getenv('EVIDENCE_SEARCH_COUNT', 5))  # Results fetched per claim before ranking
+EVIDENCE_MAX_PASSAGES = int(os.getenv('EVIDENCE_MAX_PASSAGES', 4))  # Passages (titles included) per prompt
+EVIDENCE_TOKEN_BUDGET = int(os.getenv('EVIDENCE_TOKEN_BUDGET', 200))  # Estimated evidence tokens per prompt
+
+# Concurrent verifications and facts accepted per /api/verify-facts/stream request
+VERIFY_STREAM_CONCURRENCY = int(os.getenv('VERIFY_STREAM_CONCURRENCY', 4))
+VERIFY_STREAM_MAX_FACTS = int(os.getenv('VERIFY_STREAM_MAX_FACTS', 200))
+
+# /api/analyze-batch: videos per batch and videos analyzed at once
+BATCH_MAX_VIDEOS = int(os.getenv('BATCH_MAX_VIDEOS', 50))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 3))
+
+# Verified ID-token cache and Google signing-certificate refresh
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 10000))
+CERT_REFRESH_SECONDS = int(os.getenv('CERT_REFRESH_SECONDS', 600))
+
+# Time budget for one /api/analyze request; kept below the proxy's 300s cutoff so a
+# degraded result can still be returned
+ANALYSIS_DEADLINE_SECONDS = int(os.getenv('ANALYSIS_DEADLINE_SECONDS', 270))
+WHISPER_MIN_SECONDS = 120  # Whisper (download + transcode + transcribe) is skipped with less budget left
+THESIS_ONLY_BELOW_SECONDS = 45  # Below this after the transcript, only the thesis is checked
+FACT_VERIFY_ESTIMATE_SECONDS = 6  # Per-fact cost assumed until the first facts have been timed
+DEADLINE_MARGIN_SECONDS = 5  # Kept free for grading and writing the response
+
+# Admission control in front of the analysis pipeline (per worker process; cached results skip it).
+# Waiting analyses run sample before full before batch, then the user with the fewest running first.
+# Running analyses per process. An analysis mostly waits on providers, so unset (0) it follows the worker's
+# request threads under gunicorn (see size_admission) and is ADMISSION_DEFAULT_MAX_ACTIVE otherwise.
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', 0))
+ADMISSION_DEFAULT_MAX_ACTIVE = 32
+ADMISSION_MAX_ACTIVE_PER_USER = int(os.getenv('ADMISSION_MAX_ACTIVE_PER_USER', 2))
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', 16))  # Beyond this, requests get a 503 + Retry-After
+ADMISSION_DOWNGRADE_QUEUE = int(os.getenv('ADMISSION_DOWNGRADE_QUEUE', 4))  # From this depth, full runs as sample
+ADMISSION_QUEUE_TIMEOUT_SECONDS = int(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', 30))
+ADMISSION_PRIORITIES = {'sample': 0, 'full': 1, 'batch': 2}
+
+# Model cascade: verdicts are asked of an endpoint's fast model first and re-asked of its strong model
+# when the answer is unsure. MODEL_ROUTE_<ENDPOINT>='fast,strong' overrides; one model turns escalation off.
+MODEL_ROUTES = {
+    endpoint: tuple(model.strip() for model in os.getenv(f'MODEL_ROUTE_{endpoint.upper()}', default).split(','))
+    for endpoint, default in (
+        ('analyze', 'gpt-5-nano,gpt-5-mini'),  # /api/analyze fact and thesis verdicts
+        ('verify_facts', 'gpt-5-nano,gpt-5-mini'),  # /api/verify-facts and /api/verify-facts/stream
+        ('verify_fact', 'gpt-5-nano,gpt-5-mini'),  # /api/verify-fact
+    )
+}
+CASCADE_MIN_CONFIDENCE = int(os.getenv('CASCADE_MIN_CONFIDENCE', 50))  # Below 50 the model doubts its own verdict
+CASCADE_ESCALATION_WORKERS = int(os.getenv('CASCADE_ESCALATION_WORKERS', 16))  # Escalations running at once
+# Fact extraction uses the small model up to EXTRACTION_LONG_TRANSCRIPT_CHARS and the large one beyond
+EXTRACTION_MODEL_SHORT = os.getenv('EXTRACTION_MODEL_SHORT', 'gpt-4o-mini')
+EXTRACTION_MODEL_LONG = os.getenv('EXTRACTION_MODEL_LONG', 'gpt-4o')
+EXTRACTION_LONG_TRANSCRIPT_CHARS = int(os.getenv('EXTRACTION_LONG_TRANSCRIPT_CHARS', 15000))
+
+# Bearer token required to read /api/metrics (the endpoint is off without one)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Directory shared by a server's worker processes: each writes its metrics there every METRICS_WRITE_SECONDS
+# and /api/metrics sums them all, whichever worker serves the scrape. Unset, a scrape sees one process.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_WRITE_SECONDS = int(os.getenv('METRICS_WRITE_SECONDS', 5))
+
 # Usage limits
 DAILY_LIMIT = 5  # 5 analyses per day for free users
 MONTHLY_LIMIT = 100  # 100 analyses per month for free users
 
-def check_usage_limits(user_uid):
-    """Check if user has exceeded their usage limits"""
-    if not db:
-        return True, "Database not available"
-    
-    try:
-        # Get user's usage document
-        user_ref = db.collection('usage').document(user_uid)
-        user_doc = user_ref.get()
-        
-        now = datetime.utcnow()
-        today = now.date()
-        current_month = f"{now.year}-{now.month:02d}"
-        
-        if user_doc.exists:
-            data = user_doc.to_dict()
-            
-            # Check daily limit
-            last_used_date = data.get('last_used_date', '')
-            daily_count = data.get('daily_count', 0)
-            
-            if last_used_date == str(today):
-                if daily_count >= DAILY_LIMIT:
-                    return False, f"Daily limit of {DAILY_LIMIT} analyses reached. Try again tomorrow."
-            
-            # Check monthly limit
-            current_month_data = data.get('current_month', '')
-            monthly_count = data.get('monthly_count', 0)
-            
-            if current_month_data == current_month:
-                if monthly_count >= MONTHLY_LIMIT:
-                    return False, f"Monthly limit of {MONTHLY_LIMIT} analyses reached. Limit resets next month."
-        
-        return True, None
-    except Exception as e:
-        print(f"Usage check error: {e}")
-        return True, None  # Allow on error
+# Usage accounting: 'local' (quota engine, written behind to Firestore) or 'firestore' (transaction per request)
+USAGE_ACCOUNTING = os.getenv('USAGE_ACCOUNTING', 'local')
+QUOTA_DB_PATH = os.getenv('QUOTA_DB_PATH', './quota.db')
+QUOTA_FLUSH_SECONDS = int(os.getenv('QUOTA_FLUSH_SECONDS', 30))
+QUOTA_FLUSH_BATCH_SIZE = 400  # Firestore batches allow at most 500 writes
 
-def increment_usage(user_uid):
-    """Increment user's usage count"""
-    if not db:
-        return
-    
-    try:
-        user_ref = db.collection('usage').document(user_uid)
-        user_doc = user_ref.get()
-        
-        now = datetime.utcnow()
-        today = str(now.date())
-        current_month = f"{now.year}-{now.month:02d}"
-        
-        if user_doc.exists:
-            data = user_doc.to_dict()
-            
-            # Update daily count
-            if data.get('last_used_date') == today:
-                daily_count = data.get('daily_count', 0) + 1
-            else:
-                daily_count = 1
-            
-            # Update monthly count
-            if data.get('current_month') == current_month:
-                monthly_count = data.get('monthly_count', 0) + 1
-            else:
-                monthly_count = 1
-            
-            user_ref.update({
-                'last_used_date': today,
-                'daily_count': daily_count,
-                'current_month': current_month,
-                'monthly_count': monthly_count,
-                'last_used_at': firestore.SERVER_TIMESTAMP
-            })
-        else:
-            # Create new usage document
-            user_ref.set({
-                'last_used_date': today,
-                'daily_count': 1,
-                'current_month': current_month,
-                'monthly_count': 1,
-                'created_at': firestore.SERVER_TIMESTAMP,
-                'last_used_at': firestore.SERVER_TIMESTAMP
-            })
-    except Exception as e:
-        print(f"Usage increment error: {e}")
+# Per-process /api/usage cache. With local accounting, entries are validated by the quota store's
+# version, which every worker's writes bump. With Firestore accounting, this process drops entries
+# when it reserves or refunds, and they expire after USAGE_CACHE_SECONDS so other workers' analyses show up
+USAGE_CACHE_SECONDS = int(os.getenv('USAGE_CACHE_SECONDS', 60))
+USAGE_CACHE_MAX_ENTRIES = int(os.getenv('USAGE_CACHE_MAX_ENTRIES', 10000))
 
-def verify_token(f):
-    """Decorator to verify Firebase ID token and check usage limits"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        # Get token from Authorization header
-        auth_header = request.headers.get('Authorization', '')
-        print(f"🔑 Auth header received: {auth_header[:50]}..." if auth_header else "🔑 No auth header")
-        
-        if not auth_header.startswith('Bearer '):
-            print("❌ Missing or invalid authorization header format")
-            return jsonify({'error': 'Missing or invalid authorization header'}), 401
-        
-        id_token = auth_header.split('Bearer ')[1]
-        print(f"🎫 Token extracted (length: {len(id_token)})")
-        
-        try:
-            # Verify the token
-            print("🔍 Verifying token with Firebase Admin SDK...")
-            decoded_token = auth.verify_id_token(id_token)
-            user_uid = decoded_token['uid']
-            print(f"✅ Token verified successfully for user: {user_uid}")
-            
-            # Check usage limits
-            allowed, error_message = check_usage_limits(user_uid)
-            if not allowed:
-                print(f"⚠️ Usage limit exceeded for user: {user_uid}")
-                return jsonify({'error': error_message, 'limit_exceeded': True}), 429
-            
-            # Add user info to request
-            request.user = {
-                'uid': user_uid,
-                'email': decoded_token.get('email'),
-                'email_verified': decoded_token.get('email_verified', False)
-            }
-            print(f"👤 Request authenticated for: {request.user.get('email')}")
-            
-            return f(*args, **kwargs)
-        except Exception as e:
-            print(f"❌ Token verification error: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': 'Invalid or expired token', 'details': str(e)}), 401
-    
-    return decorated_function
 
-def fetch_transcript_youtube_oauth(video_id, oauth_token):
+class MetricsRegistry:
     """
-    METHOD 1: Fetch transcript using user's YouTube OAuth token
-    This allows access to captions that require authentication
+    In-process counters and histograms rendered in Prometheus text format.
+    Each worker process keeps its own registry; recording is one lock + dict update.
+    Snapshots written to a shared directory let any worker render the sum of all of them.
     """
-    print(f'\n🎬 === YouTube OAuth Method ===')
-    
-    if not oauth_token:
-        print(f'  ❌ No OAuth token provided, skipping...')
-        return None
     
-    if oauth_token == 'null' or oauth_token == 'undefined':
-        print(f'  ❌ Invalid OAuth token value: {oauth_token}')
-        return None
-        
-    try:
-        from google.oauth2.credentials import Credentials
-        
-        print(f'  🔑 Token available, attempting OAuth...')
-        print(f'  📹 Video ID: {video_id}')
-        
-        # Create credentials from OAuth token
-        credentials = Credentials(token=oauth_token)
-        print(f'  ✅ Credentials object created')
-        
-        # Build YouTube API client with user credentials
-        youtube_oauth = build('youtube', 'v3', credentials=credentials)
-        print(f'  ✅ YouTube API client built with OAuth')
-        
-        # List available captions
-        print(f'  📋 Fetching caption list...')
-        captions_response = youtube_oauth.captions().list(
-            part='snippet',
-            videoId=video_id
-        ).execute()
-        
-        if not captions_response.get('items'):
-            print('  ⚠️ No captions available via OAuth')
-            return None
-        
-        print(f'  ✅ Found {len(captions_response["items"])} caption tracks')
-        
-        # Find English caption or first available
-        caption_track = None
-        for item in captions_response['items']:
-            if item['snippet']['language'] == 'en':
-                caption_track = item
-                break
-        if not caption_track:
-            caption_track = captions_response['items'][0]
-        
-        caption_id = caption_track['id']
-        print(f'  📝 Found caption track: {caption_track["snippet"]["language"]}')
-        
-        # Download caption content
-        caption_content = youtube_oauth.captions().download(
-            id=caption_id,
-            tfmt='srt'
-        ).execute()
-        
-        # Parse SRT format
-        import re
-        # Remove timing lines and sequence numbers
-        text = re.sub(r'\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n', '', caption_content.decode('utf-8'))
-        text = re.sub(r'\d+\n', '', text)
-        text = ' '.join(text.split('\n'))
-        
-        # Get video metadata
-        video_response = youtube_oauth.videos().list(
-            part='snippet,contentDetails,statistics',
-            id=video_id
-        ).execute()
-        
-        if video_response.get('items'):
-            video_info = video_response['items'][0]
-            metadata = {
-                'title': video_info['snippet']['title'],
-                'uploader': video_info['snippet']['channelTitle'],
-                'duration': parse_duration(video_info['contentDetails']['duration']),
-                'view_count': int(video_info['statistics'].get('viewCount', 0))
-            }
-        else:
-            metadata = {}
-        
-        print(f'  ✅ YouTube OAuth transcript fetched: {len(text)} chars')
-        return {'text': text, **metadata}
-        
-    except Exception as e:
-        print(f'  ❌ YouTube OAuth failed: {str(e)}')
-        return None
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 4, 5, 7.5, 10, 15, 20, 30, 60, 120, 300)
 
-def parse_duration(duration_str):
-    """Parse ISO 8601 duration to seconds"""
-    import re
-    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', duration_str)
-    if match:
-        hours = int(match.group(1) or 0)
-        minutes = int(match.group(2) or 0)
-        seconds = int(match.group(3) or 0)
-        return hours * 3600 + minutes * 60 + seconds
-    return 0
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}  # name -> (type, help, buckets)
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket_counts, sum, count]
+        self._snapshot_name = None  # (pid, file name) of this process's snapshot
 
-def extract_video_id(url):
-    """Extract video ID from various YouTube URL formats"""
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=)([^&\s]+)',
-        r'(?:youtube\.com\/embed\/)([^?\s]+)',
-        r'(?:youtube\.com\/v\/)([^?\s]+)',
-        r'(?:youtu\.be\/)([^?\s]+)',
-        r'(?:youtube\.com\/shorts\/)([^?\s]+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    
-    return None
+    def counter(self, name, help_text):
+        self._meta[name] = ('counter', help_text, None)
 
-def fetch_transcript_whisper(video_id):
-    """Fetch transcript using OpenAI Whisper API"""
-    if not openai_client:
-        raise Exception('OpenAI API key not configured')
-    
-    print(f'DEBUG: Downloading audio for video: {video_id}')
-    
-    # Create temporary directory for audio file
-    temp_dir = tempfile.mkdtemp()
-    audio_file_path = os.path.join(temp_dir, 'audio.mp3')
-    
-    try:
-        # Download audio using yt-dlp with cookies support
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': os.path.join(temp_dir, 'audio.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-            'ffmpeg_location': FFMPEG_PATH,
-            # Use Android client for better bot bypass
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['dash', 'hls']
-                }
-            }
-        }
-        
-        # Add cookies if file exists
-        if os.path.exists(YOUTUBE_COOKIES_PATH):
-            ydl_opts['cookiefile'] = YOUTUBE_COOKIES_PATH
-            print(f'DEBUG: Using cookies from: {YOUTUBE_COOKIES_PATH}')
-        else:
-            print(f'DEBUG: No cookies file found at: {YOUTUBE_COOKIES_PATH}')
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
-            ydl.download([f'https://www.youtube.com/watch?v={video_id}'])
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._meta[name] = ('histogram', help_text, tuple(buckets))
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted((labels or {}).items())))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                entry = self._histograms[key] = [[0] * len(buckets), 0.0, 0]
+            if index < len(buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def total(self, name, **labels):
+        """A counter's sum, or a histogram's observation count, over the series matching `labels`"""
+        wanted = set(labels.items())
+        with self._lock:
+            counters = [value for (n, key), value in self._counters.items() if n == name and wanted <= set(key)]
+            observed = [entry[2] for (n, key), entry in self._histograms.items() if n == name and wanted <= set(key)]
+        return sum(counters) + sum(observed)
+
+    @contextmanager
+    def timer(self, name, labels=None, errors=None):
+        """Observe the duration of a block; optionally count exceptions in the `errors` counter"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors:
+                self.inc(errors, labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = [
+            (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in pairs
+        ]
+        return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+    def _series(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: [list(v[0]), v[1], v[2]] for key, v in self._histograms.items()}
+        return counters, histograms
+
+    def write_snapshot(self, directory):
+        """
+        Replace this process's snapshot in `directory`. Snapshots of exited processes are kept,
+        so totals don't drop when a worker is recycled; clear the directory when the server starts.
+        """
+        if self._snapshot_name is None or self._snapshot_name[0] != os.getpid():
+            # A new file per process, so a recycled pid never overwrites a dead worker's counts
+            self._snapshot_name = (os.getpid(), f'metrics-{os.getpid()}-{uuid.uuid4().hex[:8]}.json')
+        counters, histograms = self._series()
+        snapshot = {
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'histograms': [[name, labels, *entry] for (name, labels), entry in histograms.items()]
+        }
+        path = os.path.join(directory, self._snapshot_name[1])
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _merged_snapshots(directory):
+        """Counters and histograms summed over every snapshot in `directory`"""
+        counters, histograms = {}, {}
+        for filename in os.listdir(directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning(f'Skipping metrics snapshot {filename}: {e}')
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, bucket_counts, total, count in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                entry = histograms.setdefault(key, [[0] * len(bucket_counts), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], bucket_counts)]
+                entry[1] += total
+                entry[2] += count
+        return counters, histograms
+
+    def render(self, directory=None):
+        """
+        All metrics in Prometheus text exposition format: this process's, or with a `directory`,
+        the sum of every process's snapshot there (this one's written first)
+        """
+        if directory:
+            self.write_snapshot(directory)
+            counters, histograms = self._merged_snapshots(directory)
+        else:
+            counters, histograms = self._series()
+
+        lines = []
+        for name, (metric_type, help_text, buckets) in sorted(self._meta.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{self._format_labels(labels)} {value}')
+            else:
+                for (metric, labels), (bucket_counts, total, count) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, bucket_counts):
+                        cumulative += bucket_count
+                        lines.append(f'{name}_bucket{self._format_labels(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{self._format_labels(labels, [("le", "+Inf")])} {count}')
+                    lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{self._format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.histogram('truthquest_pipeline_stage_seconds', 'Duration of each /api/analyze pipeline stage')
+metrics.counter('truthquest_transcript_attempts_total', 'Transcript fetch attempts by method and outcome')
+metrics.histogram('truthquest_provider_request_seconds', 'Latency of external provider calls')
+metrics.counter('truthquest_provider_errors_total', 'Failed external provider calls')
+metrics.counter('truthquest_cache_requests_total', 'Cache lookups by cache and result (hit/stale/miss)')
+metrics.counter('truthquest_admission_total', 'Analysis admission decisions (admitted/shed/timeout/downgraded)')
+metrics.histogram('truthquest_admission_wait_seconds', 'Time analyses waited for pipeline capacity')
+metrics.histogram('truthquest_evidence_tokens', 'Estimated evidence tokens in each verdict prompt',
+                  buckets=(25, 50, 100, 150, 200, 300, 400, 600))
+metrics.counter('truthquest_model_cascade_total', 'Fast-model verdicts by endpoint, accepted or escalated (and why)')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """Time budget for one request, shared by every provider call made on its behalf"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap):
+        """A provider timeout of at most `cap` seconds that ends with the deadline"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded('Request deadline exceeded')
+        return max(0.5, min(cap, remaining))
+
+
+def request_timeout(deadline, cap):
+    return deadline.timeout(cap) if deadline else cap
+
+
+def chat_completion(operation, deadline=None, **request_kwargs):
+    """OpenAI chat completion with latency and error metrics, bounded by the request deadline"""
+    with metrics.timer('truthquest_provider_request_seconds', {'provider': 'openai', 'operation': operation},
+                       errors='truthquest_provider_errors_total'):
+        if deadline:
+            request_kwargs['timeout'] = deadline.timeout(120)
+        return get_openai_client().chat.completions.create(**request_kwargs)
+
+
+def record_transcript_attempt(method, outcome):
+    metrics.inc('truthquest_transcript_attempts_total', {'method': method, 'outcome': outcome})
+
+
+class LocalSQLiteStore:
+    """Base for local SQLite stores shared by every worker on the host"""
+
+    def __init__(self, path):
+        # The file is opened (and created) on first use, so importing the server doesn't create it
+        self.path = path
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _create_schema(self, conn):
+        raise NotImplementedError
+
+    def _ensure_schema(self, conn):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            try:
+                with conn:
+                    self._create_schema(conn)
+                self._schema_ready = True
+            except sqlite3.Error as e:
+                log.warning(f'{type(self).__name__} unavailable at {self.path}: {e}')
+
+    def _connect(self):
+        # SQLite connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        if not self._schema_ready:
+            self._ensure_schema(conn)
+        return conn
+
+    @contextmanager
+    def _write_transaction(self):
+        """Serialize read-modify-write sequences across threads and worker processes"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+class SQLiteCache(LocalSQLiteStore):
+    """JSON key/value cache on a local SQLite file"""
+
+    def __init__(self, path, table):
+        self.table = table
+        super().__init__(path)
+
+    def _create_schema(self, conn):
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        """Return (value, created_at) or None if missing"""
+        try:
+            row = self._connect().execute(
+                f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            log.warning(f'Cache {self.table} read error: {e}')
+            return None
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, created_at=None):
+        created_at = time.time() if created_at is None else created_at
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    f'INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), created_at)
+                )
+        except sqlite3.Error as e:
+            log.warning(f'Cache {self.table} write error: {e}')
+        return created_at
+
+    def delete(self, key):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            log.warning(f'Cache {self.table} delete error: {e}')
+
+
+def _current_periods():
+    """Return (today, current_month) strings used as usage period keys"""
+    now = datetime.utcnow()
+    return str(now.date()), f"{now.year}-{now.month:02d}"
+
+
+def apply_usage_reservation(data, today, current_month):
+    """
+    Check limits against a usage document and compute its counts after one more analysis.
+    Returns (allowed, error_message, new_counts).
+    """
+    daily_count, monthly_count = _current_counts(data, today, current_month)
+
+    if daily_count >= DAILY_LIMIT:
+        return False, f"Daily limit of {DAILY_LIMIT} analyses reached. Try again tomorrow.", None
+    if monthly_count >= MONTHLY_LIMIT:
+        return False, f"Monthly limit of {MONTHLY_LIMIT} analyses reached. Limit resets next month.", None
+
+    return True, None, {
+        'last_used_date': today,
+        'daily_count': daily_count + 1,
+        'current_month': current_month,
+        'monthly_count': monthly_count + 1
+    }
+
+
+def _reserve_usage_transaction(transaction, user_ref, today, current_month):
+    from firebase_admin import firestore
+    user_doc = user_ref.get(transaction=transaction)
+    allowed, error_message, counts = apply_usage_reservation(
+        user_doc.to_dict() if user_doc.exists else None, today, current_month
+    )
+    if allowed:
+        update = {**counts, 'last_used_at': firestore.SERVER_TIMESTAMP}
+        if not user_doc.exists:
+            update['created_at'] = firestore.SERVER_TIMESTAMP
+        transaction.set(user_ref, update, merge=True)
+    return allowed, error_message
+
+
+def _refund_usage_transaction(transaction, user_ref, reservation):
+    user_doc = user_ref.get(transaction=transaction)
+    if not user_doc.exists:
+        return
+    data = user_doc.to_dict()
+    update = {}
+    # Only refund counters that are still in the period the reservation was made in
+    if data.get('last_used_date') == reservation['date']:
+        update['daily_count'] = max(data.get('daily_count', 0) - 1, 0)
+    if data.get('current_month') == reservation['month']:
+        update['monthly_count'] = max(data.get('monthly_count', 0) - 1, 0)
+    if update:
+        transaction.update(user_ref, update)
+
+
+def _usage_from_row(row):
+    """Convert a quota_usage row into the Firestore usage-document shape"""
+    if not row:
+        return None
+    return {'last_used_date': row[0], 'daily_count': row[1], 'current_month': row[2], 'monthly_count': row[3]}
+
+
+def _current_counts(data, today, current_month):
+    """(daily_count, monthly_count) of a usage document for the current periods"""
+    data = data or {}
+    daily_count = data.get('daily_count', 0) if data.get('last_used_date') == today else 0
+    monthly_count = data.get('monthly_count', 0) if data.get('current_month') == current_month else 0
+    return daily_count, monthly_count
+
+
+class QuotaEngine(LocalSQLiteStore):
+    """
+    Per-user daily/monthly counters kept in a local SQLite file shared by all workers.
+    Limits are enforced locally; changed counters are written behind to Firestore in batches.
+    """
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS quota_usage ('
+            'uid TEXT PRIMARY KEY, day TEXT NOT NULL, daily_count INTEGER NOT NULL, '
+            'month TEXT NOT NULL, monthly_count INTEGER NOT NULL, '
+            'version INTEGER NOT NULL DEFAULT 0, flushed_version INTEGER NOT NULL DEFAULT 0, '
+            'seeded INTEGER NOT NULL DEFAULT 0)'
+        )
+
+    def _select(self, conn, user_uid):
+        return conn.execute(
+            'SELECT day, daily_count, month, monthly_count, seeded FROM quota_usage WHERE uid = ?', (user_uid,)
+        ).fetchone()
+
+    def _write(self, conn, user_uid, data, dirty=True, seeded=None):
+        conn.execute(
+            'INSERT INTO quota_usage (uid, day, daily_count, month, monthly_count, version, seeded) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(uid) DO UPDATE SET day = excluded.day, daily_count = excluded.daily_count, '
+            'month = excluded.month, monthly_count = excluded.monthly_count, '
+            'version = version + ?, seeded = COALESCE(?, seeded)',
+            (user_uid, data['last_used_date'], data['daily_count'], data['current_month'], data['monthly_count'],
+             1 if dirty else 0, seeded or 0, 1 if dirty else 0, seeded)
+        )
+
+    def _ensure_seeded(self, user_uid):
+        """Load a user's counters from Firestore the first time this host sees them"""
+        row = self._select(self._connect(), user_uid)
+        if row and row[4]:
+            return
+
+        remote = None
+        if get_db():
+            try:
+                user_doc = get_db().collection('usage').document(user_uid).get()
+                remote = user_doc.to_dict() if user_doc.exists else {}
+            except Exception as e:
+                log.warning(f"Quota seed from Firestore failed for {user_uid}: {e}")
+                return  # Enforce with local counters for now, retry the seed next request
+
+        today, current_month = _current_periods()
+        with self._write_transaction() as conn:
+            row = self._select(conn, user_uid)
+            if row and row[4]:
+                return
+            local_counts = _current_counts(_usage_from_row(row), today, current_month)
+            remote_counts = _current_counts(remote, today, current_month)
+            # Reservations and refunds not flushed yet are newer than Firestore; otherwise Firestore is
+            # (it also has other hosts' usage). Taking the higher of the two would undo unflushed refunds.
+            unflushed = conn.execute(
+                'SELECT version > flushed_version FROM quota_usage WHERE uid = ?', (user_uid,)
+            ).fetchone()
+            counts = local_counts if unflushed and unflushed[0] else remote_counts
+            self._write(conn, user_uid, {
+                'last_used_date': today, 'daily_count': counts[0],
+                'current_month': current_month, 'monthly_count': counts[1]
+            }, dirty=counts != remote_counts, seeded=1)
+
+    def reserve(self, user_uid):
+        """Check limits and reserve one analysis. Returns (allowed, error_message, reservation)."""
+        self._ensure_seeded(user_uid)
+        today, current_month = _current_periods()
+        with self._write_transaction() as conn:
+            data = _usage_from_row(self._select(conn, user_uid))
+            allowed, error_message, counts = apply_usage_reservation(data, today, current_month)
+            if not allowed:
+                return False, error_message, None
+            self._write(conn, user_uid, counts)
+        return True, None, {'date': today, 'month': current_month}
+
+    def refund(self, user_uid, reservation):
+        with self._write_transaction() as conn:
+            data = _usage_from_row(self._select(conn, user_uid))
+            if not data:
+                return
+            if data['last_used_date'] == reservation['date']:
+                data['daily_count'] = max(data['daily_count'] - 1, 0)
+            if data['current_month'] == reservation['month']:
+                data['monthly_count'] = max(data['monthly_count'] - 1, 0)
+            self._write(conn, user_uid, data)
+
+    def version(self, user_uid):
+        """A user's counter version: every reservation, refund or seed that changes the counts bumps it"""
+        self._ensure_seeded(user_uid)
+        row = self._connect().execute('SELECT version FROM quota_usage WHERE uid = ?', (user_uid,)).fetchone()
+        return row[0] if row else 0
+
+    def get_counts(self, user_uid):
+        """(daily_count, monthly_count) for the current day and month"""
+        self._ensure_seeded(user_uid)
+        today, current_month = _current_periods()
+        return _current_counts(_usage_from_row(self._select(self._connect(), user_uid)), today, current_month)
+
+    def flush(self):
+        """Write changed counters to the Firestore usage collection in batches"""
+        if not get_db():
+            return 0
+        from firebase_admin import firestore
+
+        rows = self._connect().execute(
+            'SELECT uid, day, daily_count, month, monthly_count, version '
+            'FROM quota_usage WHERE version > flushed_version'
+        ).fetchall()
+
+        for i in range(0, len(rows), QUOTA_FLUSH_BATCH_SIZE):
+            chunk = rows[i:i + QUOTA_FLUSH_BATCH_SIZE]
+            batch = get_db().batch()
+            for user_uid, day, daily_count, month, monthly_count, _ in chunk:
+                batch.set(get_db().collection('usage').document(user_uid), {
+                    'last_used_date': day,
+                    'daily_count': daily_count,
+                    'current_month': month,
+                    'monthly_count': monthly_count,
+                    'last_used_at': firestore.SERVER_TIMESTAMP
+                }, merge=True)
+            batch.commit()
+            
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    'UPDATE quota_usage SET flushed_version = ? WHERE uid = ? AND flushed_version < ?',
+                    [(version, user_uid, version) for user_uid, _, _, _, _, version in chunk]
+                )
+        
+        return len(rows)
+
+    def reconcile(self):
+        """
+        Flush counters left over from a previous run, then re-seed every user from Firestore on next use.
+        Only the first worker on the host does this; it holds a lock file for as long as it runs, so workers
+        started alongside or after it skip reconciliation. Returns whether this process reconciled.
+        """
+        lock = open(f'{self.path}.reconcile.lock', 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            log.debug('Quota engine already reconciled by another worker')
+            return False
+        self._reconcile_lock = lock  # Released when this process exits
+
+        flushed = self.flush()
+        if get_db():
+            conn = self._connect()
+            with conn:
+                conn.execute('UPDATE quota_usage SET seeded = 0')
+        log.info(f"Quota engine reconciled ({flushed} pending counters flushed)")
+        return True
+
+
+quota_engine = QuotaEngine(QUOTA_DB_PATH)
+
+_quota_flusher_started = False
+
+
+def start_quota_flusher():
+    """Reconcile local counters with Firestore, then flush changes periodically and on exit (once per process)"""
+    global _quota_flusher_started
+    with _provider_lock:
+        if _quota_flusher_started:
+            return
+        _quota_flusher_started = True
+
+    def flush_loop():
+        try:
+            quota_engine.reconcile()
+        except Exception as e:
+            log.warning(f"Quota reconciliation failed: {e}")
+        while True:
+            time.sleep(QUOTA_FLUSH_SECONDS)
+            try:
+                quota_engine.flush()
+            except Exception as e:
+                log.warning(f"Quota flush failed: {e}")
+
+    def flush_on_exit():
+        try:
+            quota_engine.flush()
+        except Exception as e:
+            log.warning(f"Final quota flush failed: {e}")
+
+    threading.Thread(target=flush_loop, name='quota-flusher', daemon=True).start()
+    atexit.register(flush_on_exit)
+
+
+_metrics_writer_started = False
+
+
+def start_metrics_writer():
+    """Write this process's metrics snapshot to METRICS_DIR periodically and on exit (once per process)"""
+    global _metrics_writer_started
+    with _provider_lock:
+        if _metrics_writer_started:
+            return
+        _metrics_writer_started = True
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+    def write_snapshot():
+        try:
+            metrics.write_snapshot(METRICS_DIR)
+        except Exception as e:
+            log.warning(f"Metrics snapshot failed: {e}")
+
+    def write_loop():
+        while True:
+            write_snapshot()
+            time.sleep(METRICS_WRITE_SECONDS)
+
+    threading.Thread(target=write_loop, name='metrics-writer', daemon=True).start()
+    atexit.register(write_snapshot)
+
+
+def reserve_usage(user_uid):
+    """
+    Atomically check the user's limits and reserve one analysis, either in the local
+    quota engine or in a single Firestore transaction (USAGE_ACCOUNTING=firestore).
+    Returns (allowed, error_message, reservation); pass the reservation to refund_usage on failure.
+    """
+    try:
+        return _reserve_usage(user_uid)
+    finally:
+        invalidate_usage_cache(user_uid)
+
+
+def _reserve_usage(user_uid):
+    if USAGE_ACCOUNTING == 'local':
+        start_quota_flusher()
+        try:
+            return quota_engine.reserve(user_uid)
+        except Exception as e:
+            log.warning(f"Usage reservation error: {e}")
+            return True, None, None  # Allow on error
+
+    if not get_db():
+        return True, "Database not available", None
+
+    today, current_month = _current_periods()
+    try:
+        from firebase_admin import firestore
+        user_ref = get_db().collection('usage').document(user_uid)
+        allowed, error_message = firestore.transactional(_reserve_usage_transaction)(
+            get_db().transaction(), user_ref, today, current_month
+        )
+        if not allowed:
+            return False, error_message, None
+        return True, None, {'date': today, 'month': current_month}
+    except Exception as e:
+        log.warning(f"Usage reservation error: {e}")
+        return True, None, None  # Allow on error
+
+
+def refund_usage(user_uid, reservation):
+    """Give back a reserved analysis that didn't produce a result"""
+    if not reservation:
+        return
+    
+    try:
+        if USAGE_ACCOUNTING == 'local':
+            quota_engine.refund(user_uid, reservation)
+            log.info(f"Refunded usage reservation for user: {user_uid}")
+            return
+        if not get_db():
+            return
+        from firebase_admin import firestore
+        user_ref = get_db().collection('usage').document(user_uid)
+        firestore.transactional(_refund_usage_transaction)(get_db().transaction(), user_ref, reservation)
+        log.info(f"Refunded usage reservation for user: {user_uid}")
+    except Exception as e:
+        log.warning(f"Usage refund error: {e}")
+    finally:
+        invalidate_usage_cache(user_uid)
+
+
+def reserve_usage_quota(f):
+    """Decorator that reserves one analysis up front and refunds it if the request fails"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user_uid = request.user['uid']
+        allowed, error_message, reservation = reserve_usage(user_uid)
+        if not allowed:
+            log.warning(f"Usage limit exceeded for user: {user_uid}")
+            return jsonify({'error': error_message, 'limit_exceeded': True}), 429
+
+        try:
+            response = app.make_response(f(*args, **kwargs))
+        except Exception:
+            refund_usage(user_uid, reservation)
+            raise
+
+        if response.status_code >= 400:
+            refund_usage(user_uid, reservation)
+        return response
+
+    return decorated_function
+
+
+_token_cache = OrderedDict()  # sha256(token) -> (decoded_token, exp)
+_token_cache_lock = threading.Lock()
+
+
+def _verify_id_token_uncached(id_token):
+    from firebase_admin import auth
+    get_firebase_app()
+    return auth.verify_id_token(id_token)
+
+
+def verify_id_token_cached(id_token):
+    """Verify a Firebase ID token, reusing earlier verifications until the token expires"""
+    key = hashlib.sha256(id_token.encode('utf-8')).hexdigest()
+    now = time.time()
+
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry and entry[1] > now:
+            _token_cache.move_to_end(key)
+            metrics.inc('truthquest_cache_requests_total', {'cache': 'token', 'result': 'hit'})
+            return entry[0]
+        if entry:
+            del _token_cache[key]
+
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'token', 'result': 'miss'})
+    decoded_token = _verify_id_token_uncached(id_token)
+
+    with _token_cache_lock:
+        _token_cache[key] = (decoded_token, decoded_token.get('exp', 0))
+        while len(_token_cache) > TOKEN_CACHE_MAX_ENTRIES:
+            _token_cache.popitem(last=False)
+
+    return decoded_token
+
+
+def refresh_signing_certs():
+    """Re-fetch Google's ID-token signing certificates into firebase_admin's HTTP cache"""
+    from firebase_admin import auth, _token_gen
+    verifier = auth._get_client(get_firebase_app())._token_verifier
+    # no-cache forces a fetch; the fresh response replaces the cached certificates
+    response = verifier.request(_token_gen.ID_TOKEN_CERT_URI, headers={'Cache-Control': 'no-cache'})
+    if response.status != 200:
+        raise Exception(f'Certificate fetch returned status {response.status}')
+
+
+def start_cert_refresher():
+    """Prefetch signing certificates and keep them warm so token checks never wait on the network"""
+    def refresh_loop():
+        while True:
+            try:
+                refresh_signing_certs()
+            except Exception as e:
+                log.warning(f"Signing certificate refresh failed: {e}")
+            time.sleep(CERT_REFRESH_SECONDS)
+
+    threading.Thread(target=refresh_loop, name='cert-refresher', daemon=True).start()
+
+def verify_token(f):
+    """Decorator to verify Firebase ID token"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Get token from Authorization header
+        auth_header = request.headers.get('Authorization', '')
+        
+        if not auth_header.startswith('Bearer '):
+            log.warning("Missing or invalid authorization header format")
+            return jsonify({'error': 'Missing or invalid authorization header'}), 401
+        
+        id_token = auth_header.split('Bearer ')[1]
+        log.debug(f"Token extracted (length: {len(id_token)})")
+        
+        try:
+            # Verify the token
+            log.debug("Verifying token with Firebase Admin SDK...")
+            decoded_token = verify_id_token_cached(id_token)
+            user_uid = decoded_token['uid']
+            log.debug(f"Token verified successfully for user: {user_uid}")
+            
+            # Add user info to request
+            request.user = {
+                'uid': user_uid,
+                'email': decoded_token.get('email'),
+                'email_verified': decoded_token.get('email_verified', False)
+            }
+            
+            return f(*args, **kwargs)
+        except Exception as e:
+            log.exception(f"Token verification error: {type(e).__name__}: {e}")
+            return jsonify({'error': 'Invalid or expired token', 'details': str(e)}), 401
+    
+    return decorated_function
+
+def fetch_transcript_youtube_oauth(video_id, oauth_token):
+    """
+    METHOD 1: Fetch transcript using user's YouTube OAuth token
+    This allows access to captions that require authentication
+    """
+    log.debug('YouTube OAuth Method')
+    
+    if not oauth_token:
+        log.debug('No OAuth token provided, skipping...')
+        return None
+    
+    if oauth_token == 'null' or oauth_token == 'undefined':
+        log.debug('Invalid OAuth token value, skipping...')
+        return None
+        
+    try:
+        log.debug('Token available, attempting OAuth...')
+        log.debug(f'Video ID: {video_id}')
+        
+        # Reuse the shared YouTube API client; the user's credentials ride on the HTTP transport
+        youtube_oauth = get_youtube_discovery_client()
+        http = authorized_http(oauth_token)
+        log.debug('Authorized YouTube API transport created')
+        
+        # List available captions
+        log.debug('Fetching caption list...')
+        captions_response = youtube_oauth.captions().list(
+            part='snippet',
+            videoId=video_id
+        ).execute(http=http)
+        
+        if not captions_response.get('items'):
+            log.info('No captions available via OAuth')
+            return None
+        
+        log.debug(f'Found {len(captions_response["items"])} caption tracks')
+        
+        # Find English caption or first available
+        caption_track = None
+        for item in captions_response['items']:
+            if item['snippet']['language'] == 'en':
+                caption_track = item
+                break
+        if not caption_track:
+            caption_track = captions_response['items'][0]
+        
+        caption_id = caption_track['id']
+        log.debug(f'Found caption track: {caption_track["snippet"]["language"]}')
+        
+        # Download caption content
+        caption_content = youtube_oauth.captions().download(
+            id=caption_id,
+            tfmt='srt'
+        ).execute(http=http)
+        
+        text = srt_to_text(caption_content.decode('utf-8'))
+        
+        # Get video metadata
+        video_response = youtube_oauth.videos().list(
+            part='snippet,contentDetails,statistics',
+            id=video_id
+        ).execute(http=http)
+        
+        if video_response.get('items'):
+            video_info = video_response['items'][0]
+            metadata = {
+                'title': video_info['snippet']['title'],
+                'uploader': video_info['snippet']['channelTitle'],
+                'duration': parse_duration(video_info['contentDetails']['duration']),
+                'view_count': int(video_info['statistics'].get('viewCount', 0))
+            }
+        else:
+            metadata = {}
+        
+        log.info(f'YouTube OAuth transcript fetched: {len(text)} chars')
+        return {'text': text, **metadata}
+        
+    except Exception as e:
+        log.info(f'YouTube OAuth failed: {str(e)}')
+        return None
+
+def parse_duration(duration_str):
+    """Parse ISO 8601 duration to seconds"""
+    import re
+    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', duration_str)
+    if match:
+        hours = int(match.group(1) or 0)
+        minutes = int(match.group(2) or 0)
+        seconds = int(match.group(3) or 0)
+        return hours * 3600 + minutes * 60 + seconds
+    return 0
+
+def extract_video_id(url):
+    """Extract video ID from various YouTube URL formats"""
+    patterns = [
+        r'(?:youtube\.com\/watch\?v=)([^&\s]+)',
+        r'(?:youtube\.com\/embed\/)([^?\s]+)',
+        r'(?:youtube\.com\/v\/)([^?\s]+)',
+        r'(?:youtu\.be\/)([^?\s]+)',
+        r'(?:youtube\.com\/shorts\/)([^?\s]+)',
+    ]
+    
+    for pattern in patterns:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    
+    return None
+
+
+media_pools = {}  # 'media' (yt-dlp, ffmpeg) and 'stt' (local transcription) -> ProcessPoolExecutor
+_media_pool_lock = threading.Lock()
+
+
+class MediaJobError(Exception):
+    pass
+
+
+def get_media_pool(kind='media'):
+    """A media process pool ('media' or 'stt'), started on first use (after gunicorn has forked the worker)"""
+    with _media_pool_lock:
+        if kind not in media_pools:
+            media_pools[kind] = ProcessPoolExecutor(
+                max_workers=LOCAL_WHISPER_WORKERS if kind == 'stt' else MEDIA_POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=media_jobs.init_worker,
+                initargs=(LOCAL_WHISPER_MEMORY_MB if kind == 'stt' else MEDIA_JOB_MEMORY_MB,),
+                max_tasks_per_child=MEDIA_JOBS_PER_PROCESS
+            )
+            atexit.register(media_pools[kind].shutdown, wait=False, cancel_futures=True)
+        return media_pools[kind]
+
+
+def _discard_media_pool(kind, pool):
+    with _media_pool_lock:
+        if media_pools.get(kind) is pool:
+            del media_pools[kind]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_media_job(func, *args, deadline=None, timeout=None, pool_kind='media'):
+    """
+    Run a media_jobs function in a media process pool ('stt' for local transcription) and
+    return its result. The job is interrupted after `timeout` (default MEDIA_JOB_TIMEOUT_SECONDS)
+    or when the deadline runs out; a job that kills its process, e.g. by hitting the memory
+    cap, fails alone and the pool is replaced.
+    """
+    timeout = request_timeout(deadline, timeout or MEDIA_JOB_TIMEOUT_SECONDS)
+    if MEDIA_POOL_WORKERS <= 0:
+        return func(*args)
+
+    pool = get_media_pool(pool_kind)
+    future = pool.submit(media_jobs.run_job, func, args, timeout)
+    try:
+        # The job times itself out; the grace covers process start-up and a job deaf to signals
+        return future.result(timeout=timeout + 10)
+    except FutureTimeoutError:
+        future.cancel()
+        raise MediaJobError(f'{func.__name__} did not finish within {timeout:.0f}s')
+    except BrokenProcessPool:
+        log.warning(f'Media pool process died during {func.__name__}, replacing the pool')
+        _discard_media_pool(pool_kind, pool)
+        raise MediaJobError(f'{func.__name__} was killed (memory limit exceeded?)')
+
+
+def local_transcription_available():
+    return importlib.util.find_spec('faster_whisper') is not None
+
+
+@contextmanager
+def transcription_backend_override(backend):
+    """Use `backend` (if given) for the Whisper tier of transcripts fetched in this block"""
+    token = transcription_backend_var.set(backend)
+    try:
+        yield
+    finally:
+        transcription_backend_var.reset(token)
+
+
+def requested_transcription_backend(data):
+    """The transcriptionBackend a request asked for (None for the default); ValueError if unknown"""
+    backend = data.get('transcriptionBackend')
+    if backend is not None and backend not in TRANSCRIPTION_BACKENDS:
+        raise ValueError(f'transcriptionBackend must be one of: {", ".join(TRANSCRIPTION_BACKENDS)}')
+    return backend
+
+
+def transcription_available():
+    """Whether the Whisper tier can run with the current backend"""
+    backend = transcription_backend_var.get() or TRANSCRIPTION_BACKEND
+    if backend == 'local':
+        return local_transcription_available()
+    return bool(get_openai_client()) or (backend == 'auto' and local_transcription_available())
+
+
+def transcribe_whisper_api(audio_file_path, deadline=None):
+    """Transcribe an audio file with the OpenAI Whisper API as {'full', 'segments', 'language'}"""
+    log.debug('Sending to Whisper API for transcription...')
+    with open(audio_file_path, 'rb') as audio_file:
+        with metrics.timer('truthquest_provider_request_seconds',
+                           {'provider': 'openai', 'operation': 'transcription'},
+                           errors='truthquest_provider_errors_total'):
+            transcript_response = get_openai_client().audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                response_format="verbose_json",
+                timestamp_granularities=["segment"],
+                timeout=request_timeout(deadline, 600)
+            )
+
+    log.debug(f'Whisper transcription complete. Language detected: {transcript_response.language}')
+
+    # Extract segments
+    segments = []
+    full_text_parts = []
+
+    for segment in transcript_response.segments:
+        # Segment is an object, not a dict - access attributes directly
+        text = segment.text.strip() if hasattr(segment, 'text') else ''
+        if text:
+            start_time = segment.start if hasattr(segment, 'start') else 0
+            end_time = segment.end if hasattr(segment, 'end') else 0
+
+            segments.append({
+                'text': text,
+                'start': start_time,
+                'duration': end_time - start_time
+            })
+            full_text_parts.append(text)
+
+    return {
+        'full': ' '.join(full_text_parts),
+        'segments': segments,
+        'method': 'whisper',
+        'language': transcript_response.language
+    }
+
+
+def fetch_transcript_whisper(video_id, deadline=None, metadata=None):
+    """
+    Transcribe the audio track with the OpenAI Whisper API or a local faster-whisper model.
+    The backend is the request's override or TRANSCRIPTION_BACKEND; 'auto' uses the API and
+    transcribes locally when the audio is over the API limit or the API call fails.
+    """
+    backend = transcription_backend_var.get() or TRANSCRIPTION_BACKEND
+    use_api = backend != 'local' and get_openai_client() is not None
+    local_allowed = backend == 'local' or (backend == 'auto' and local_transcription_available())
+    if not use_api and not local_allowed:
+        raise Exception('OpenAI API key not configured')
+    
+    # With the probed duration, audio the API can't take is known before downloading it
+    metadata = metadata or probe_video(video_id, deadline)
+    estimated_mb = ((metadata or {}).get('duration') or 0) * WHISPER_AUDIO_MB_PER_SECOND
+    if use_api and estimated_mb > WHISPER_API_MAX_MB * 1.1:
+        if not local_allowed:
+            raise Exception(f'Audio too large (~{estimated_mb:.0f} MB for {metadata["duration"]}s). '
+                            f'Whisper API limit is {WHISPER_API_MAX_MB} MB.')
+        log.info(f'Audio will be ~{estimated_mb:.0f} MB, over the Whisper API limit; transcribing locally')
+        use_api = False
+
+    log.debug(f'Downloading audio for video: {video_id}')
+    
+    # Create temporary directory for audio file
+    temp_dir = tempfile.mkdtemp()
+    audio_file_path = os.path.join(temp_dir, 'audio.mp3')
+    
+    try:
+        # Download and transcode in the media pool; cookies (if present) help against bot detection
+        info = run_media_job(media_jobs.download_audio, video_id, temp_dir, request_timeout(deadline, 30),
+                             YOUTUBE_COOKIES_PATH, FFMPEG_PATH, deadline=deadline)
+        
+        # Check file size (Whisper API has a 25MB limit)
+        file_size = os.path.getsize(audio_file_path)
+        file_size_mb = file_size / (1024 * 1024)
+        log.debug(f'Audio file size: {file_size_mb:.2f} MB')
+        
+        if use_api and file_size_mb > WHISPER_API_MAX_MB:
+            if not local_allowed:
+                raise Exception(f'Audio file too large ({file_size_mb:.2f} MB). '
+                                f'Whisper API limit is {WHISPER_API_MAX_MB} MB.')
+            log.info(f'Audio is {file_size_mb:.2f} MB, over the Whisper API limit; transcribing locally')
+            use_api = False
+        
+        transcript = None
+        if use_api:
+            try:
+                transcript = transcribe_whisper_api(audio_file_path, deadline)
+            except Exception as e:
+                if not local_allowed or (deadline is not None and deadline.expired()):
+                    raise
+                log.warning(f'Whisper API failed ({str(e)}); transcribing locally')
+
+        if transcript is None:
+            log.debug(f'Transcribing locally with faster-whisper '
+                      f'({LOCAL_WHISPER_MODEL}, {LOCAL_WHISPER_COMPUTE_TYPE})...')
+            with metrics.timer('truthquest_provider_request_seconds',
+                               {'provider': 'local', 'operation': 'transcription'},
+                               errors='truthquest_provider_errors_total'):
+                transcript = run_media_job(media_jobs.transcribe_local, audio_file_path, LOCAL_WHISPER_MODEL,
+                                           LOCAL_WHISPER_COMPUTE_TYPE, LOCAL_WHISPER_THREADS,
+                                           deadline=deadline, timeout=LOCAL_WHISPER_TIMEOUT_SECONDS, pool_kind='stt')
+        
+        return {
+            **transcript,
+            'title': info.get('title', 'Unknown Title'),
+            'uploader': info.get('uploader', 'Unknown Uploader'),
+            'duration': info.get('duration', 0),
+            'view_count': info.get('view_count', 0),
+            **video_details(metadata)
+        }
+        
+    finally:
+        # Clean up temporary files
+        try:
+            if os.path.exists(audio_file_path):
+                os.remove(audio_file_path)
+            os.rmdir(temp_dir)
+            log.debug('Cleaned up temporary files')
+        except Exception as e:
+            log.debug(f'Error cleaning up temp files: {e}')
+
+
+def fetch_transcript_rapidapi(video_id, deadline=None):
+    """Fetch transcript using RapidAPI YouTube Transcripts service (no download required)"""
+    if not RAPIDAPI_KEY:
+        raise Exception('RapidAPI key not configured')
+    
+    log.debug(f'Using RapidAPI for video: {video_id}')
+    
+    try:
+        # Build the full YouTube URL
+        youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+        
+        querystring = {
+            "url": youtube_url,
+            "videoId": video_id,
+            "lang": "en",
+            "chunkSize": "500",
+            "text": "false"  # Get structured data with timestamps
+        }
+        
+        headers = {
+            "x-rapidapi-key": RAPIDAPI_KEY,
+            "x-rapidapi-host": "youtube-transcripts.p.rapidapi.com"
+        }
+        
+        log.debug('Requesting transcript from RapidAPI...')
+        response = requests.get(RAPIDAPI_TRANSCRIPT_URL, headers=headers, params=querystring,
+                                timeout=request_timeout(deadline, 30))
+        
+        log.debug(f'RapidAPI status code: {response.status_code}')
+        
+        if response.status_code != 200:
+            raise Exception(f'RapidAPI returned status {response.status_code}: {response.text}')
+        
+        data = response.json()
+        log.debug(f'RapidAPI response type: {type(data)}')
+        
+        # RapidAPI returns array of transcript segments
+        # Format: [{"text": "...", "start": 0, "duration": 2}, ...]
+        if isinstance(data, list):
+            full_text = ' '.join([item.get('text', '') for item in data])
+            segments = [
+                {
+                    'text': item.get('text', ''),
+                    'start': item.get('start', 0),
+                    'duration': item.get('duration', 0)
+                }
+                for item in data
+            ]
+        elif isinstance(data, dict) and 'content' in data:
+            # Alternative format: {"content": [...]}
+            content = data['content']
+            full_text = ' '.join([item.get('text', '') for item in content])
+            segments = content
+        else:
+            raise Exception(f'Unexpected RapidAPI response format: {type(data)}')
+        
+        log.debug(f'RapidAPI transcript fetched: {len(full_text)} chars, {len(segments)} segments')
+        
+        return {
+            'full': full_text,
+            'segments': segments,
+            'method': 'rapidapi'
+        }
+        
+    except requests.exceptions.RequestException as e:
+        log.debug(f'RapidAPI request error: {str(e)}')
+        raise Exception(f'RapidAPI request failed: {str(e)}')
+    except Exception as e:
+        log.debug(f'RapidAPI error: {str(e)}')
+        raise
+
+
+def find_caption_tracks(page_html):
+    """The captionTracks array embedded in a YouTube watch page"""
+    if '"captionTracks":' not in page_html:
+        raise Exception('No captions available for this video')
+
+    start = page_html.find('"captionTracks":') + len('"captionTracks":')
+    # Find the end of the array
+    bracket_count = 0
+    end = start
+    for i, char in enumerate(page_html[start:], start):
+        if char == '[':
+            bracket_count += 1
+        elif char == ']':
+            bracket_count -= 1
+            if bracket_count == 0:
+                end = i + 1
+                break
+
+    return json.loads(page_html[start:end])
+
+
+def parse_timedtext_xml(xml_text):
+    """Segments and joined text from a timedtext XML caption document"""
+    import xml.etree.ElementTree as ET
+    
+    root = ET.fromstring(xml_text)
+    segments = []
+    full_text_parts = []
+    
+    for text_elem in root.findall('.//text'):
+        text = text_elem.text
+        if text:
+            # Clean up the text
+            text = text.strip()
+            if text:
+                segments.append({
+                    'text': text,
+                    'start': float(text_elem.get('start', 0)),
+                    'duration': float(text_elem.get('dur', 0))
+                })
+                full_text_parts.append(text)
+
+    return segments, ' '.join(full_text_parts)
+
+
+def srt_to_text(srt_text):
+    """Caption text from an SRT document, without sequence numbers and timing lines"""
+    text = re.sub(r'\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n', '', srt_text)
+    text = re.sub(r'\d+\n', '', text)
+    return ' '.join(text.split('\n'))
+
+
+WATCH_PAGE_HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                   'Chrome/120.0.0.0 Safari/537.36'),
+    'Accept-Language': 'en-US,en;q=0.9'
+}
+
+VIDEO_DETAILS_PATTERN = re.compile(r'"videoDetails":\s*')
+PLAYABILITY_STATUS_PATTERN = re.compile(r'"playabilityStatus":\s*')
+
+
+def _find_player_object(page_html, pattern):
+    """The JSON object that follows the first match of `pattern` in a watch page, or {}"""
+    match = pattern.search(page_html)
+    if not match:
+        return {}
+    try:
+        return json.JSONDecoder().raw_decode(page_html, match.end())[0]
+    except ValueError:
+        return {}
+
+
+def find_video_details(page_html):
+    """The videoDetails object (title, author, lengthSeconds, viewCount) of a watch page, or {}"""
+    return _find_player_object(page_html, VIDEO_DETAILS_PATTERN)
+
+
+def find_playability_status(page_html):
+    """The player's playabilityStatus.status ('OK', 'LOGIN_REQUIRED', ...) on a watch page, or None"""
+    return _find_player_object(page_html, PLAYABILITY_STATUS_PATTERN).get('status')
+
+
+def probe_watch_page(video_id, deadline=None):
+    """Video metadata and caption tracks from one fetch of the watch page (see probe_video)"""
+    response = requests.get(f'{YOUTUBE_BASE_URL}/watch?v={video_id}', headers=WATCH_PAGE_HEADERS,
+                            timeout=request_timeout(deadline, 15))
+    if response.status_code != 200:
+        raise Exception(f'Failed to fetch video page: {response.status_code}')
+
+    details = find_video_details(response.text)
+    try:
+        tracks = find_caption_tracks(response.text)
+    except Exception:
+        tracks = None
+    if not details and tracks is None:
+        # A consent or bot-check page: nothing is known about the captions either way
+        raise Exception('Watch page has no player data')
+
+    return {
+        'title': details.get('title'),
+        'uploader': details.get('author'),
+        'duration': int(details['lengthSeconds']) if details.get('lengthSeconds') else None,
+        'view_count': int(details['viewCount']) if details.get('viewCount') else None,
+        # A login or bot-check player lists no captions whether or not the video has them
+        'captionsKnown': find_playability_status(response.text) == 'OK',
+        'captionTracks': [
+            {'languageCode': track.get('languageCode', ''), 'generated': track.get('kind') == 'asr',
+             'url': track['baseUrl'], 'format': 'xml'}
+            for track in tracks or [] if track.get('baseUrl')
+        ]
+    }
+
+
+def probe_video(video_id, deadline=None, abandoned=None):
+    """
+    Title, uploader, duration, view count and caption tracks of a video, probed once and
+    shared by every transcript tier and the response. Tries the watch page, then one yt-dlp
+    extraction in the media pool; returns None if both fail (tiers then run blind). The
+    yt-dlp extraction is skipped once the `abandoned` event is set (nobody waits for it).
+    """
+    entry = metadata_cache.get(video_id)
+    if entry and time.time() - entry[1] <= VIDEO_METADATA_MAX_AGE_SECONDS:
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'metadata', 'result': 'hit'})
+        return entry[0]
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'metadata', 'result': 'miss'})
+    
+    metadata = None
+    try:
+        metadata = {**probe_watch_page(video_id, deadline), 'source': 'watch_page'}
+    except Exception as e:
+        log.info(f'Watch page probe failed: {str(e)}')
+    if metadata is None and not (deadline is not None and deadline.expired()) and \
+            not (abandoned is not None and abandoned.is_set()):
+        try:
+            metadata = {
+                **run_media_job(media_jobs.probe_video, video_id, VIDEO_PROBE_TIMEOUT_SECONDS, YOUTUBE_COOKIES_PATH,
+                                deadline=deadline, timeout=VIDEO_PROBE_TIMEOUT_SECONDS),
+                'captionsKnown': True,
+                'source': 'yt-dlp'
+            }
+        except Exception as e:
+            log.info(f'yt-dlp probe failed: {str(e)}')
+
+    if metadata is not None:
+        log.debug(f'Probed {video_id} via {metadata["source"]}: {len(metadata["captionTracks"])} caption tracks, '
+                  f'{metadata["duration"]}s')
+        metadata_cache.set(video_id, metadata)
+    return metadata
+
+
+probe_executor = ThreadPoolExecutor(max_workers=VIDEO_PROBE_WORKERS, thread_name_prefix='video-probe')
+
+
+def captions_absent(metadata):
+    """Whether a probe shows the video has no captions, not merely a page that listed none"""
+    return metadata is not None and metadata.get('captionsKnown', False) and not metadata['captionTracks']
+
+
+def video_details(metadata):
+    """The probed fields a transcript carries into the analysis response"""
+    return {key: metadata[key] for key in ('title', 'uploader', 'duration', 'view_count')
+            if metadata and metadata.get(key) is not None}
+
+
+def pick_caption_track(tracks):
+    """Manual English, then automatic English, then any manual track, then anything"""
+    for generated in (False, True):
+        for track in tracks:
+            if track['generated'] == generated and is_english(track['languageCode']):
+                return track
+    return next((track for track in tracks if not track['generated']), tracks[0] if tracks else None)
+
+
+def fetch_transcript_youtube_api(video_id, deadline=None, metadata=None):
+    """Fetch the best caption track listed by the video probe (timedtext XML or json3)"""
+    metadata = metadata or probe_video(video_id, deadline)
+    track = pick_caption_track(metadata['captionTracks'] if metadata else [])
+    if not track:
+        raise Exception('No captions available for this video')
+
+    log.debug(f'Fetching {track["languageCode"]} caption ({track["format"]}) from: {track["url"][:100]}...')
+    caption_response = requests.get(track['url'], headers=WATCH_PAGE_HEADERS, timeout=request_timeout(deadline, 15))
+    if caption_response.status_code != 200:
+        raise Exception(f'Failed to fetch caption: {caption_response.status_code}')
+
+    if track['format'] == 'json3':
+        segments, full_text = media_jobs.parse_json3_events(caption_response.json())
+    else:
+        segments, full_text = parse_timedtext_xml(caption_response.text)
+    log.debug(f'Extracted {len(segments)} caption segments, {len(full_text)} chars')
+
+    return {
+        'full': full_text,
+        'segments': segments,
+        'method': 'youtube_timedtext_api'
+    }
+
+
+def is_english(language_code):
+    return language_code == 'en' or language_code.startswith('en-')
+
+
+def pick_transcript_track(transcripts):
+    """
+    The best of the tracks youtube-transcript-api lists for a video, as (transcript, translate_to):
+    manual before auto-generated, English variants before a translation to English, then any language.
+    """
+    tracks = sorted(transcripts, key=lambda track: track.is_generated)  # Stable: manual tracks first
+    if not tracks:
+        raise Exception('No transcripts listed for this video')
+
+    english = next((track for track in tracks if is_english(track.language_code)), None)
+    if english:
+        return english, None
+
+    translatable = next((track for track in tracks
+                         if any(lang['language_code'] == 'en' for lang in track.translation_languages)), None)
+    if translatable:
+        return translatable, 'en'
+    
+    return tracks[0], None
+
+
+def fetch_transcript_listed(video_id):
+    """
+    Fetch a transcript with youtube-transcript-api: list the video's tracks once (the watch
+    page), pick one in memory and fetch only that track.
+    """
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    track, translate_to = pick_transcript_track(YouTubeTranscriptApi.list_transcripts(video_id))
+    label = f'{track.language_code}{", auto" if track.is_generated else ""}'
+    if translate_to:
+        label = f'{label} -> {translate_to}'
+        track = track.translate(translate_to)
+    log.debug(f'Selected transcript track: {label}')
+
+    segments = [
+        {'text': entry['text'].strip(), 'start': entry['start'], 'duration': entry['duration']}
+        for entry in track.fetch(preserve_formatting=False) if entry['text'].strip()
+    ]
+    if not segments:
+        raise Exception(f'Transcript track {label} is empty')
+
+    return {
+        'full': ' '.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'method': f'youtube-transcript-api ({label})'
+    }
+
+
+def fetch_transcript_ytdlp(video_id, deadline=None):
+    """Fetch transcript using yt-dlp with enhanced bot bypass (runs in the media pool)"""
+    return run_media_job(media_jobs.caption_transcript, video_id, request_timeout(deadline, 30),
+                         YOUTUBE_COOKIES_PATH, deadline=deadline)
+
+
+@app.route('/api/transcription', methods=['POST'])
+def get_transcription():
+    try:
+        data = request.get_json()
+        youtube_url = data.get('youtubeUrl')
+        
+        if not youtube_url:
+            return jsonify({'error': 'YouTube URL is required'}), 400
+        
+        video_id = extract_video_id(youtube_url)
+        
+        if not video_id:
+            return jsonify({'error': 'Invalid YouTube URL'}), 400
+        
+        try:
+            backend = requested_transcription_backend(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        log.info(f'Fetching transcription for video: {video_id}')
         
-        # Check file size (Whisper has 25MB limit)
-        file_size = os.path.getsize(audio_file_path)
-        file_size_mb = file_size / (1024 * 1024)
-        print(f'DEBUG: Audio file size: {file_size_mb:.2f} MB')
+        # Same budget as an analysis, so the request ends inside the proxy timeout
+        deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
+        transcript = None
+        error_messages = []
         
-        if file_size_mb > 25:
-            raise Exception(f'Audio file too large ({file_size_mb:.2f} MB). Whisper API limit is 25 MB.')
+        # Try yt-dlp captions first (fast and free)
+        try:
+            log.info('Fetching transcript via yt-dlp captions...')
+            transcript = fetch_transcript_ytdlp(video_id, deadline)
+            log.info(f'Successfully fetched via yt-dlp with {len(transcript["segments"])} segments')
+        except Exception as e:
+            error_messages.append(f'yt-dlp: {str(e)}')
+            log.info(f'yt-dlp failed: {str(e)}')
+
+        # Fallback to Whisper if yt-dlp failed (accurate; API credits or local CPU time)
+        with transcription_backend_override(backend):
+            if not transcript and deadline.remaining() < WHISPER_MIN_SECONDS:
+                error_messages.append(f'Whisper: skipped with {max(deadline.remaining(), 0):.0f}s left')
+            elif not transcript and transcription_available():
+                try:
+                    log.info('Attempting Whisper transcription')
+                    transcript = fetch_transcript_whisper(video_id, deadline)
+                    log.info(f'Successfully transcribed via Whisper with {len(transcript["segments"])} segments')
+                except Exception as e:
+                    error_messages.append(f'Whisper: {str(e)}')
+                    log.warning(f'Whisper failed: {str(e)}')
         
-        # Transcribe using Whisper
-        print('DEBUG: Sending to Whisper API for transcription...')
-        with open(audio_file_path, 'rb') as audio_file:
-            transcript_response = openai_client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                timestamp_granularities=["segment"]
-            )
+        if not transcript:
+            return jsonify({
+                'error': 'Failed to fetch transcription from all sources',
+                'details': ' | '.join(error_messages)
+            }), 500
         
-        print(f'DEBUG: Whisper transcription complete. Language detected: {transcript_response.language}')
+        return jsonify(project_fields({
+            'success': True,
+            'videoId': video_id,
+            'transcript': transcript,
+            'method': transcript.get('method', 'unknown')
+        }, request.args.get('fields')))
         
-        # Extract segments
-        segments = []
-        full_text_parts = []
+    except Exception as e:
+        log.exception(f'Unexpected error: {str(e)}')
+        return jsonify({
+            'error': 'Failed to fetch transcription',
+            'details': str(e)
+        }), 500
+
+@app.route('/api/extract-facts', methods=['POST'])
+def extract_facts():
+    """Extract verifiable facts from transcript using GPT"""
+    try:
+        if not get_openai_client():
+            return jsonify({'error': 'OpenAI API key not configured'}), 500
         
-        for segment in transcript_response.segments:
-            # Segment is an object, not a dict - access attributes directly
-            text = segment.text.strip() if hasattr(segment, 'text') else ''
-            if text:
-                start_time = segment.start if hasattr(segment, 'start') else 0
-                end_time = segment.end if hasattr(segment, 'end') else 0
-                
-                segments.append({
-                    'text': text,
-                    'start': start_time,
-                    'duration': end_time - start_time
-                })
-                full_text_parts.append(text)
+        data = request.get_json()
+        transcript_text = data.get('transcript')
         
-        full_text = ' '.join(full_text_parts)
+        if not transcript_text:
+            return jsonify({'error': 'Transcript text is required'}), 400
         
-        return {
-            'full': full_text,
-            'segments': segments,
-            'method': 'whisper',
-            'language': transcript_response.language,
-            'title': info.get('title', 'Unknown Title'),
-            'uploader': info.get('uploader', 'Unknown Uploader'),
-            'duration': info.get('duration', 0),
-            'view_count': info.get('view_count', 0)
-        }
+        log.info(f'Extracting facts from transcript ({len(transcript_text)} characters)...')
         
-    finally:
-        # Clean up temporary files
-        try:
-            if os.path.exists(audio_file_path):
-                os.remove(audio_file_path)
-            os.rmdir(temp_dir)
-            print('DEBUG: Cleaned up temporary files')
-        except Exception as e:
-            print(f'DEBUG: Error cleaning up temp files: {e}')
+        # Create the prompt for GPT
+        system_prompt = """You are a fact-checking assistant. Your task is to analyze transcripts and extract verifiable factual claims.
 
-def fetch_transcript_rapidapi(video_id):
-    """Fetch transcript using RapidAPI YouTube Transcripts service (no download required)"""
-    if not RAPIDAPI_KEY:
-        raise Exception('RapidAPI key not configured')
-    
-    print(f'DEBUG: Using RapidAPI for video: {video_id}')
-    
+For each claim, identify:
+1. The specific factual statement
+2. The category (statistics, historical event, scientific claim, quote, etc.)
+3. Why it needs verification
+4. Key entities or topics to search for verification
+
+Focus on:
+- Specific numbers, dates, statistics
+- Historical events or facts
+- Scientific or medical claims
+- Quotes attributed to people
+- Assertions about companies, products, or events
+
+Ignore:
+- Opinions or subjective statements
+- Hypotheticals or future predictions
+- General statements without specific claims
+
+Return your response as a JSON array of fact objects."""
+
+        user_prompt = f"""Analyze this transcript and extract all verifiable factual claims:
+
+"{transcript_text}"
+
+Return a JSON array where each fact has:
+- "claim": the exact factual statement
+- "category": type of claim (statistic/historical/scientific/quote/general)
+- "context": surrounding context from transcript
+- "entities": key terms to search for verification
+- "verifiable": boolean if this can be fact-checked"""
+
+        # Call GPT API
+        response = chat_completion(
+            'extract_facts',
+            model="gpt-5-mini",  
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"}
+        )
+        
+        # Parse the response
+        import json
+        result = json.loads(response.choices[0].message.content)
+        
+        # Ensure we have a facts array
+        facts = result.get('facts', []) if isinstance(result.get('facts'), list) else []
+        
+        log.info(f'Extracted {len(facts)} facts from transcript')
+        
+        return jsonify({
+            'success': True,
+            'factCount': len(facts),
+            'facts': facts,
+            'usage': {
+                'promptTokens': response.usage.prompt_tokens,
+                'completionTokens': response.usage.completion_tokens,
+                'totalTokens': response.usage.total_tokens
+            }
+        })
+        
+    except Exception as e:
+        log.exception(f'Error extracting facts: {str(e)}')
+        return jsonify({
+            'error': 'Failed to extract facts',
+            'details': str(e)
+        }), 500
+
+@app.route('/api/extract-facts-chunk', methods=['POST'])
+def extract_facts_chunk():
+    """Extract facts from a chunk of transcript"""
     try:
-        # RapidAPI YouTube Transcripts endpoint
-        url = "https://youtube-transcripts.p.rapidapi.com/youtube/transcript"
+        if not get_openai_client():
+            return jsonify({'error': 'OpenAI API key not configured'}), 500
         
-        # Build the full YouTube URL
-        youtube_url = f"https://www.youtube.com/watch?v={video_id}"
+        data = request.get_json()
+        transcript_chunk = data.get('chunk')
+        chunk_index = data.get('chunkIndex', 0)
+        total_chunks = data.get('totalChunks', 1)
         
-        querystring = {
-            "url": youtube_url,
-            "videoId": video_id,
-            "lang": "en",
-            "chunkSize": "500",
-            "text": "false"  # Get structured data with timestamps
-        }
+        if not transcript_chunk:
+            return jsonify({'error': 'Transcript chunk is required'}), 400
         
-        headers = {
-            "x-rapidapi-key": RAPIDAPI_KEY,
-            "x-rapidapi-host": "youtube-transcripts.p.rapidapi.com"
-        }
+        log.info(f'Processing chunk {chunk_index + 1}/{total_chunks} ({len(transcript_chunk)} characters)...')
         
-        print(f'DEBUG: Requesting transcript from RapidAPI...')
-        response = requests.get(url, headers=headers, params=querystring, timeout=30)
+        system_prompt = """You are a fact-checking assistant. Extract verifiable factual claims from this transcript segment.
+
+For each claim, identify:
+1. The specific factual statement
+2. The category (statistics, historical event, scientific claim, quote, etc.)
+3. Key entities or topics to search for verification
+
+Focus on:
+- Specific numbers, dates, statistics
+- Historical events or facts
+- Scientific or medical claims
+- Quotes attributed to people
+- Assertions about companies, products, or events
+
+Ignore opinions, hypotheticals, and general statements.
+Return a JSON object with a "facts" array."""
+
+        user_prompt = f"""Extract all verifiable factual claims from this transcript segment:
+
+"{transcript_chunk}"
+
+Return JSON with a "facts" array where each fact has:
+- "claim": the exact factual statement
+- "category": type (statistic/historical/scientific/quote/general)
+- "context": surrounding context (max 100 chars)
+- "entities": key terms array (max 5 items)
+- "verifiable": boolean"""
+
+        response = chat_completion(
+            'extract_facts_chunk',
+            model="gpt-5-mini",
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            response_format={"type": "json_object"}
+        )
         
-        print(f'DEBUG: RapidAPI status code: {response.status_code}')
+        import json
+        result = json.loads(response.choices[0].message.content)
+        facts = result.get('facts', []) if isinstance(result.get('facts'), list) else []
         
-        if response.status_code != 200:
-            raise Exception(f'RapidAPI returned status {response.status_code}: {response.text}')
+        log.info(f'Extracted {len(facts)} facts from chunk {chunk_index + 1}')
         
-        data = response.json()
-        print(f'DEBUG: RapidAPI response type: {type(data)}')
+        return jsonify({
+            'success': True,
+            'chunkIndex': chunk_index,
+            'factCount': len(facts),
+            'facts': facts
+        })
         
-        # RapidAPI returns array of transcript segments
-        # Format: [{"text": "...", "start": 0, "duration": 2}, ...]
-        if isinstance(data, list):
-            full_text = ' '.join([item.get('text', '') for item in data])
-            segments = [
-                {
-                    'text': item.get('text', ''),
-                    'start': item.get('start', 0),
-                    'duration': item.get('duration', 0)
-                }
-                for item in data
-            ]
-        elif isinstance(data, dict) and 'content' in data:
-            # Alternative format: {"content": [...]}
-            content = data['content']
-            full_text = ' '.join([item.get('text', '') for item in content])
-            segments = content
-        else:
-            raise Exception(f'Unexpected RapidAPI response format: {type(data)}')
+    except Exception as e:
+        log.exception(f'Error extracting facts from chunk: {str(e)}')
+        return jsonify({
+            'error': 'Failed to extract facts from chunk',
+            'details': str(e)
+        }), 500
+
+@app.route('/api/verify-fact', methods=['POST'])
+def verify_single_fact():
+    """Verify a single fact"""
+    try:
+        if not get_openai_client() or not BRAVE_API_KEY:
+            return jsonify({'error': 'APIs not configured'}), 500
+        
+        data = request.get_json()
+        fact = data.get('fact')
+        fact_index = data.get('factIndex', 0)
+        total_facts = data.get('totalFacts', 1)
+        
+        if not fact:
+            return jsonify({'error': 'Fact is required'}), 400
+        
+        log.debug(f'Verifying fact {fact_index + 1}/{total_facts}: {fact.get("claim", "")[:50]}...')
+        
+        # Build search query
+        claim = fact.get('claim', '').strip()
+        if not claim:
+            raise Exception('Empty claim')
+        
+        entities = fact.get('entities', [])
+        entity_text = ' '.join(str(e) for e in entities[:2] if e) if entities else ''
+        search_query = f"{claim} {entity_text}".strip()
         
-        print(f'DEBUG: RapidAPI transcript fetched: {len(full_text)} chars, {len(segments)} segments')
+        if len(search_query) > 300:
+            search_query = search_query[:300].rsplit(' ', 1)[0]
+        
+        # Search Brave, keeping the passages that best match the claim
+        sources = select_evidence(claim, search_brave(search_query, count=EVIDENCE_SEARCH_COUNT))
+        
+        # GPT verification
+        verification_prompt = f"""Analyze if these search results support or refute this claim.
+
+CLAIM: {claim}
+
+SEARCH RESULTS:
+{chr(10).join([f"{i+1}. {evidence_line(s)}" for i, s in enumerate(sources)])}
+
+Return JSON with:
+- verdict: "supported", "refuted", "partially_true", "unverified", or "inconclusive"
+- confidence: 0-100
+- reasoning: brief explanation (max 150 chars)
+- relevant_sources: indices array (0-based)
+- conflicting_evidence: true if the results contradict each other"""
+
+        verification_result = cascaded_verdict('verify_fact', {
+            'messages': [
+                {"role": "system", "content": "You are a fact-checker. Be concise."},
+                {"role": "user", "content": verification_prompt}
+            ],
+            'response_format': {"type": "json_object"}
+        })
         
-        return {
-            'full': full_text,
-            'segments': segments,
-            'method': 'rapidapi'
+        verified_fact = {
+            **fact,
+            'verification': {
+                'verdict': verification_result.get('verdict', 'inconclusive'),
+                'confidence': verification_result.get('confidence', 0),
+                'reasoning': verification_result.get('reasoning', '')[:200],  # Limit reasoning
+                'sources': [sources[i] for i in verification_result.get('relevant_sources', []) if i < len(sources)][:2]  # Max 2 sources
+            }
         }
         
-    except requests.exceptions.RequestException as e:
-        print(f'DEBUG: RapidAPI request error: {str(e)}')
-        raise Exception(f'RapidAPI request failed: {str(e)}')
+        log.info(f'Verified: {verification_result.get("verdict")}')
+        
+        return jsonify({
+            'success': True,
+            'factIndex': fact_index,
+            'verifiedFact': verified_fact
+        })
+        
     except Exception as e:
-        print(f'DEBUG: RapidAPI error: {str(e)}')
-        raise
+        log.warning(f'Error verifying fact: {str(e)}')
+        return jsonify({
+            'success': False,
+            'factIndex': fact_index,
+            'error': str(e),
+            'verifiedFact': {
+                **fact,
+                'verification': {
+                    'verdict': 'error',
+                    'confidence': 0,
+                    'reasoning': f'Error: {str(e)[:100]}',
+                    'sources': []
+                }
+            }
+        }), 200  # Return 200 to continue processing
+
+
+STOPWORDS = {
+    'the', 'and', 'for', 'are', 'was', 'were', 'that', 'this', 'with', 'from', 'has', 'have', 'had',
+    'its', 'not', 'but', 'they', 'their', 'which', 'been', 'than', 'then', 'into', 'about', 'over',
+    'more', 'most', 'also', 'will', 'would', 'can', 'could', 'there', 'what', 'when', 'who', 'how'
+}
+
+
+def content_words(text):
+    """Lowercased content words of a text, in order, repeats included"""
+    return [word for word in re.findall(r'[a-z0-9]+', text.lower()) if len(word) > 2 and word not in STOPWORDS]
+
+
+def search_terms(text):
+    """Lowercased content words of a claim or query, in order, without duplicates"""
+    return list(dict.fromkeys(content_words(text)))
+
+
+class EvidenceIndex(LocalSQLiteStore):
+    """Full-text index (SQLite FTS5) of every search result we have paid for"""
+
+    def _create_schema(self, conn):
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS evidence_docs '
+            '(id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, title TEXT, description TEXT, '
+            'query TEXT, fetched_at REAL NOT NULL)'
+        )
+        conn.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS evidence_fts USING fts5('
+            "title, description, content='evidence_docs', content_rowid='id', tokenize='porter unicode61')"
+        )
+        # Keep the FTS index in sync with the documents table
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS evidence_ai AFTER INSERT ON evidence_docs BEGIN '
+            'INSERT INTO evidence_fts(rowid, title, description) VALUES (new.id, new.title, new.description); END'
+        )
+        conn.execute(
+            'CREATE TRIGGER IF NOT EXISTS evidence_ad AFTER DELETE ON evidence_docs BEGIN '
+            "INSERT INTO evidence_fts(evidence_fts, rowid, title, description) "
+            'VALUES (\'delete\', old.id, old.title, old.description); END'
+        )
+
+    def add_results(self, query, results):
+        """Store Brave web results (replacing older copies of the same URL)"""
+        now = time.time()
+        rows = [
+            (r.get('url', ''), r.get('title', ''), r.get('description', ''), query, now)
+            for r in results if r.get('url')
+        ]
+        if not rows:
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.executemany('DELETE FROM evidence_docs WHERE url = ?', [(row[0],) for row in rows])
+                conn.executemany(
+                    'INSERT INTO evidence_docs (url, title, description, query, fetched_at) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+        except sqlite3.Error as e:
+            log.warning(f'Evidence index write error: {e}')
 
-def fetch_transcript_youtube_api(video_id):
-    """Fetch transcript using YouTube's timedtext API (no OAuth required)"""
-    if not YOUTUBE_API_KEY:
-        raise Exception('YouTube API key not configured')
+    def search(self, query, count=3):
+        """
+        Return up to `count` fresh, relevant results in Brave's result shape,
+        or an empty list if the index can't answer the query well enough.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        cutoff = time.time() - EVIDENCE_MAX_AGE_SECONDS
+        try:
+            rows = self._connect().execute(
+                'SELECT d.title, d.url, d.description, d.query, d.fetched_at '
+                'FROM evidence_fts JOIN evidence_docs d ON d.id = evidence_fts.rowid '
+                'WHERE evidence_fts MATCH ? AND d.fetched_at >= ? '
+                'ORDER BY bm25(evidence_fts) LIMIT ?',
+                (match, cutoff, count * 4)
+            ).fetchall()
+        except sqlite3.Error as e:
+            log.warning(f'Evidence index read error: {e}')
+            return []
+
+        # BM25 only ranks; require real term overlap with the claim before trusting a snippet
+        results = []
+        for title, url, description, source_query, fetched_at in rows:
+            doc_terms = set(search_terms(f'{title} {description} {source_query}'))
+            overlap = sum(1 for term in terms if term in doc_terms) / len(terms)
+            if overlap >= EVIDENCE_MIN_TERM_OVERLAP:
+                results.append({'title': title, 'url': url, 'description': description, 'fetched_at': fetched_at})
+            if len(results) >= count:
+                break
+        return results
+
+
+evidence_index = EvidenceIndex(EVIDENCE_INDEX_PATH)
+
+BRAVE_SEARCH_URL = os.getenv('BRAVE_SEARCH_URL', 'https://api.search.brave.com/res/v1/web/search')
+
+
+def prepare_brave_search(query, count):
+    """Validate a search and return (query, headers, params) for the Brave API"""
+    if not BRAVE_API_KEY:
+        raise Exception('Brave API key not configured')
+    
+    # Clean and validate query
+    query = query.strip()
+    if not query:
+        raise Exception('Empty search query')
+    
+    # Limit query length (Brave API limit is around 400 chars)
+    if len(query) > 400:
+        query = query[:400]
+    
+    headers = {
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip',
+        'X-Subscription-Token': BRAVE_API_KEY
+    }
+    params = {
+        'q': query,
+        'count': min(count, 5),  # Reduce to max 5 results
+        'text_decorations': False,  # Disable text decorations to reduce response size
+        'search_lang': 'en',
+        'extra_snippets': 'true'  # Up to 5 more excerpts per result, ranked by select_evidence
+    }
+    return query, headers, params
+
+
+def local_evidence_results(query, count):
+    """Answer from the local evidence index when it has enough fresh, relevant results"""
+    local_results = evidence_index.search(query, count=min(count, 5))
+    if len(local_results) >= min(count, EVIDENCE_MIN_RESULTS):
+        log.debug(f'Evidence index hit ({len(local_results)} results): {query[:100]}...')
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'evidence_index', 'result': 'hit'})
+        return {'web': {'results': local_results}, 'source': 'evidence_index'}
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'evidence_index', 'result': 'miss'})
+    return None
+
+
+def search_brave(query, count=3, deadline=None):
+    """Search using Brave Search API"""
+    query, headers, params = prepare_brave_search(query, count)
+
+    local_results = local_evidence_results(query, count)
+    if local_results:
+        return local_results
     
-    print(f'DEBUG: Using YouTube timedtext API for video ID: {video_id}')
+    log.debug(f'Brave Search query: {query[:100]}...')
     
     try:
-        # First, get the video info to find caption tracks
-        url = f'https://www.youtube.com/watch?v={video_id}'
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9'
-        }
-        
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code != 200:
-            raise Exception(f'Failed to fetch video page: {response.status_code}')
-        
-        # Extract caption track URLs from the page
-        import json as json_lib
-        
-        # Find captionTracks in the page HTML
-        if '"captionTracks":' in response.text:
-            # Extract the captionTracks JSON
-            start = response.text.find('"captionTracks":')
-            if start != -1:
-                start = start + len('"captionTracks":')
-                # Find the end of the array
-                bracket_count = 0
-                end = start
-                for i, char in enumerate(response.text[start:], start):
-                    if char == '[':
-                        bracket_count += 1
-                    elif char == ']':
-                        bracket_count -= 1
-                        if bracket_count == 0:
-                            end = i + 1
-                            break
-                
-                caption_tracks_json = response.text[start:end]
-                caption_tracks = json_lib.loads(caption_tracks_json)
-                
-                print(f'DEBUG: Found {len(caption_tracks)} caption tracks')
-                
-                # Find English caption
-                caption_url = None
-                for track in caption_tracks:
-                    lang_code = track.get('languageCode', '')
-                    print(f'DEBUG: Caption track - Language: {lang_code}, Name: {track.get("name", {}).get("simpleText", "")}')
-                    
-                    if lang_code.startswith('en'):
-                        caption_url = track.get('baseUrl')
-                        print(f'DEBUG: Selected English caption: {lang_code}')
-                        break
-                
-                if not caption_url and caption_tracks:
-                    # Use first available caption
-                    caption_url = caption_tracks[0].get('baseUrl')
-                    print(f'DEBUG: Using first available caption')
-                
-                if not caption_url:
-                    raise Exception('No caption URL found')
-                
-                # Fetch the caption data
-                print(f'DEBUG: Fetching caption from: {caption_url[:100]}...')
-                caption_response = requests.get(caption_url, headers=headers)
-                
-                if caption_response.status_code != 200:
-                    raise Exception(f'Failed to fetch caption: {caption_response.status_code}')
-                
-                # Parse XML caption data
-                import xml.etree.ElementTree as ET
-                
-                root = ET.fromstring(caption_response.text)
-                
-                segments = []
-                full_text_parts = []
-                
-                for text_elem in root.findall('.//text'):
-                    text = text_elem.text
-                    if text:
-                        # Clean up the text
-                        text = text.strip()
-                        if text:
-                            start_time = float(text_elem.get('start', 0))
-                            duration = float(text_elem.get('dur', 0))
-                            
-                            segments.append({
-                                'text': text,
-                                'start': start_time,
-                                'duration': duration
-                            })
-                            full_text_parts.append(text)
-                
-                full_text = ' '.join(full_text_parts)
-                
-                print(f'DEBUG: Extracted {len(segments)} caption segments, {len(full_text)} chars')
-                
-                return {
-                    'full': full_text,
-                    'segments': segments,
-                    'method': 'youtube_timedtext_api'
-                }
-            else:
-                raise Exception('Could not find caption tracks in page')
-        else:
-            raise Exception('No captions available for this video')
-            
+        with metrics.timer('truthquest_provider_request_seconds', {'provider': 'brave', 'operation': 'search'},
+                           errors='truthquest_provider_errors_total'):
+            response = requests.get(BRAVE_SEARCH_URL, headers=headers, params=params,
+                                    timeout=request_timeout(deadline, 10))
+            response.raise_for_status()
+            results = response.json()
+        evidence_index.add_results(query, results.get('web', {}).get('results', []))
+        return results
+    except requests.exceptions.HTTPError as e:
+        log.warning(f'Brave API HTTP Error: {e.response.status_code} - {e.response.text}')
+        raise Exception(f'Brave Search API error: {e.response.status_code}')
     except Exception as e:
-        print(f'DEBUG: YouTube timedtext API error: {str(e)}')
+        log.warning(f'Brave API Error: {str(e)}')
         raise
 
-def fetch_transcript_ytdlp(video_id):
-    """Fetch transcript using yt-dlp with enhanced bot bypass"""
-    
-    # Try multiple strategies to bypass bot detection
-    strategies = [
-        # Strategy 1: Android client (most reliable)
-        {
-            'name': 'Android client',
-            'opts': {
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android'],
-                        'skip': ['dash', 'hls']
-                    }
-                }
-            }
-        },
-        # Strategy 2: iOS client
-        {
-            'name': 'iOS client',
-            'opts': {
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['ios'],
-                        'skip': ['dash', 'hls']
-                    }
-                }
-            }
+
+def claim_search_query(fact):
+    """Brave query for /api/verify-facts: the claim plus its top two entities"""
+    claim = fact.get('claim', '').strip()
+    if not claim:
+        raise Exception('Empty claim')
+
+    entities = fact.get('entities', [])
+
+    # Build a clean search query
+    # Use claim + top 2-3 entities, limit to reasonable length
+    entity_text = ' '.join(str(e) for e in entities[:2] if e) if entities else ''
+    search_query = f"{claim} {entity_text}".strip()
+
+    # Limit query length
+    if len(search_query) > 300:
+        search_query = search_query[:300].rsplit(' ', 1)[0]  # Cut at last word
+    return claim, search_query
+
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def estimated_tokens(text):
+    """Rough prompt-token count (about four characters per token of English)"""
+    return len(text) // 4 + 1
+
+
+def result_passages(result, min_words=8, max_chars=300):
+    """A search result's description and extra snippets split into sentence passages"""
+    passages = []
+    for snippet in [result.get('description') or '', *(result.get('extra_snippets') or [])]:
+        current = ''
+        for sentence in SENTENCE_END.split(snippet.strip()):
+            # Short sentences are joined to the next one so passages carry some context
+            current = f'{current} {sentence}'.strip()
+            if len(current.split()) >= min_words:
+                passages.append(current)
+                current = ''
+        if current:
+            passages.append(current)
+    return [passage if len(passage) <= max_chars else passage[:max_chars].rsplit(' ', 1)[0] + '...'
+            for passage in dict.fromkeys(passages)]
+
+
+def bm25_scores(query_terms, documents, k1=1.2, b=0.75):
+    """Okapi BM25 score of each document (a list of content words) for the query terms"""
+    if not documents:
+        return []
+    average_length = sum(len(document) for document in documents) / len(documents) or 1
+    document_frequency = Counter(term for document in documents for term in set(document))
+    scores = []
+    for document in documents:
+        frequencies = Counter(document)
+        score = 0.0
+        for term in set(query_terms):
+            if frequencies[term]:
+                df = document_frequency[term]
+                idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+                score += idf * frequencies[term] * (k1 + 1) / (
+                    frequencies[term] + k1 * (1 - b + b * len(document) / average_length))
+        scores.append(score)
+    return scores
+
+
+def select_evidence(claim, search_results, max_passages=None, token_budget=None):
+    """
+    The passages of the search results that best match the claim (BM25), within max_passages
+    and token_budget, as sources in the search engine's order: {'title', 'url', 'description'}
+    with the chosen passages of each result as its description. Titles compete as passages,
+    and a result's title is always shown with its passages.
+    """
+    max_passages = EVIDENCE_MAX_PASSAGES if max_passages is None else max_passages
+    token_budget = EVIDENCE_TOKEN_BUDGET if token_budget is None else token_budget
+    results = search_results.get('web', {}).get('results', [])
+    titles = [result.get('title', '')[:150] for result in results]
+    candidates = []  # (result index, passage, or None for the title)
+    for index, result in enumerate(results):
+        candidates.append((index, None))
+        candidates.extend((index, passage) for passage in result_passages(result))
+
+    scores = bm25_scores(search_terms(claim), [content_words(passage or titles[index])
+                                               for index, passage in candidates])
+    # Best first, ties in the search engine's order; unmatched passages only count when nothing matched
+    ranked = sorted(range(len(candidates)), key=lambda i: -scores[i])
+    if any(scores):
+        ranked = [i for i in ranked if scores[i] > 0]
+
+    chosen = {}  # result index -> candidate positions of its chosen passages
+    used = picked = 0
+    for i in ranked:
+        if picked >= max_passages:
+            break
+        index, passage = candidates[i]
+        cost = estimated_tokens(passage) if passage else 0
+        if index not in chosen:
+            cost += estimated_tokens(titles[index])
+        if used + cost <= token_budget:
+            chosen.setdefault(index, []).append(i)
+            used += cost
+            picked += 1
+    metrics.observe('truthquest_evidence_tokens', used)
+
+    return [{
+        'title': titles[index],
+        'url': results[index].get('url', ''),
+        'description': ' '.join(candidates[i][1] for i in sorted(chosen[index]) if candidates[i][1])
+    } for index in sorted(chosen)]
+
+
+def evidence_line(source):
+    """One source as a prompt line: its title, then its chosen passages"""
+    return f"{source['title']}: {source['description']}" if source.get('description') else source['title']
+
+
+def detailed_verdict_request(claim, sources):
+    """Chat completion arguments for a verdict with confidence and relevant sources"""
+    verification_prompt = f"""You are a fact-checker. Analyze if the following search results support or refute this claim.
+
+CLAIM: {claim}
+
+SEARCH RESULTS:
+{chr(10).join([f"{i+1}. {evidence_line(s)}" for i, s in enumerate(sources)])}
+
+Analyze the search results and determine:
+1. verdict: "supported", "refuted", "partially_true", "unverified", or "inconclusive"
+2. confidence: 0-100 (how confident are you in this verdict)
+3. reasoning: brief explanation of your analysis
+4. relevant_sources: indices of most relevant search results (0-based array)
+5. conflicting_evidence: true if the search results contradict each other
+
+Return as JSON with these exact fields."""
+
+    return {
+        'model': MODEL_ROUTES['verify_facts'][0],
+        'messages': [
+            {"role": "system", "content": "You are a fact-checking expert who analyzes search results objectively."},
+            {"role": "user", "content": verification_prompt}
+        ],
+        'response_format': {"type": "json_object"}
+    }
+
+
+def detailed_verified_fact(fact, verification_result, sources, search_query):
+    """Combine fact with verification result"""
+    log.info(f'Verified: {verification_result.get("verdict")} ({verification_result.get("confidence")}% confidence)')
+    return {
+        **fact,
+        'verification': {
+            'verdict': verification_result.get('verdict', 'inconclusive'),
+            'confidence': verification_result.get('confidence', 0),
+            'reasoning': verification_result.get('reasoning', ''),
+            'sources': [sources[i] for i in verification_result.get('relevant_sources', []) if i < len(sources)]
         },
-        # Strategy 3: TV embedded client
-        {
-            'name': 'TV embedded',
-            'opts': {
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['tv_embedded'],
-                        'skip': ['dash', 'hls']
-                    }
-                }
-            }
+        'searchQuery': search_query
+    }
+
+
+def detailed_failed_fact(fact, error):
+    log.warning(f'Error verifying fact: {str(error)}')
+    return {
+        **fact,
+        'verification': {
+            'verdict': 'error',
+            'confidence': 0,
+            'reasoning': f'Error during verification: {str(error)}',
+            'sources': []
         }
-    ]
-    
-    for strategy in strategies:
-        try:
-            print(f'DEBUG: Trying yt-dlp with {strategy["name"]}...')
-            
-            ydl_opts = {
-                'skip_download': True,
-                'writesubtitles': True,
-                'writeautomaticsub': True,
-                'subtitleslangs': ['en'],
-                'quiet': True,
-                'no_warnings': True,
-                **strategy['opts']
-            }
-            
-            # Add cookies if file exists
-            if os.path.exists(YOUTUBE_COOKIES_PATH):
-                ydl_opts['cookiefile'] = YOUTUBE_COOKIES_PATH
-                print(f'DEBUG: Using cookies from: {YOUTUBE_COOKIES_PATH}')
-            else:
-                print(f'DEBUG: No cookies file found at: {YOUTUBE_COOKIES_PATH}')
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(f'https://www.youtube.com/watch?v={video_id}', download=False)
-                
-                # Get subtitles
-                subtitles = info.get('subtitles', {})
-                automatic_captions = info.get('automatic_captions', {})
-                
-                # Try to get manual subtitles first, then automatic
-                transcript_data = None
-                if 'en' in subtitles:
-                    transcript_data = subtitles['en']
-                elif 'en' in automatic_captions:
-                    transcript_data = automatic_captions['en']
-                else:
-                    # Try any available language
-                    if subtitles:
-                        lang = list(subtitles.keys())[0]
-                        transcript_data = subtitles[lang]
-                    elif automatic_captions:
-                        lang = list(automatic_captions.keys())[0]
-                        transcript_data = automatic_captions[lang]
-                
-                if not transcript_data:
-                    continue  # Try next strategy
-                
-                # Find the json3 format (contains text data)
-                json_url = None
-                for fmt in transcript_data:
-                    if fmt.get('ext') == 'json3':
-                        json_url = fmt.get('url')
-                        break
-                
-                if not json_url:
-                    continue  # Try next strategy
-                
-                # Fetch and parse the subtitle JSON
-                import urllib.request
-                import json
-                
-                with urllib.request.urlopen(json_url) as response:
-                    subtitle_json = json.loads(response.read().decode('utf-8'))
-                
-                # Extract text from events
-                full_text_parts = []
-                segments = []
-                
-                for event in subtitle_json.get('events', []):
-                    if 'segs' in event:
-                        text = ''.join([seg.get('utf8', '') for seg in event['segs']])
-                        if text.strip():
-                            full_text_parts.append(text.strip())
-                            segments.append({
-                                'text': text.strip(),
-                                'start': event.get('tStartMs', 0) / 1000,
-                                'duration': event.get('dDurationMs', 0) / 1000
-                            })
-                
-                full_text = ' '.join(full_text_parts)
-                
-                if full_text:
-                    print(f'✓ Success with {strategy["name"]}!')
-                    return {
-                        'full': full_text,
-                        'segments': segments,
-                        'method': f'yt-dlp ({strategy["name"]})'
-                    }
-                    
-        except Exception as e:
-            print(f'DEBUG: {strategy["name"]} failed: {str(e)}')
-            continue
-    
-    # All strategies failed
-    raise Exception('All yt-dlp strategies failed. YouTube may be blocking automated access.')
+    }
 
 
-@app.route('/api/transcription', methods=['POST'])
-def get_transcription():
+def verify_fact_with_search(fact):
+    """Verify one fact with Brave Search + GPT; errors are returned as an 'error' verdict"""
     try:
-        data = request.get_json()
-        youtube_url = data.get('youtubeUrl')
-        
-        if not youtube_url:
-            return jsonify({'error': 'YouTube URL is required'}), 400
-        
-        video_id = extract_video_id(youtube_url)
-        
-        if not video_id:
-            return jsonify({'error': 'Invalid YouTube URL'}), 400
-        
-        print(f'Fetching transcription for video: {video_id}')
+        claim, search_query = claim_search_query(fact)
+
+        # Search Brave, keeping the passages that best match the claim
+        sources = select_evidence(claim, search_brave(search_query, count=EVIDENCE_SEARCH_COUNT))
+
+        # Use GPT to analyze if search results support or refute the claim
+        verification_result = cascaded_verdict('verify_facts', detailed_verdict_request(claim, sources))
+
+        return detailed_verified_fact(fact, verification_result, sources, search_query)
+
+    except Exception as e:
+        return detailed_failed_fact(fact, e)
+
+
+def verification_summary(verified_facts):
+    """Overall score for /api/verify-facts"""
+    total_facts = len(verified_facts)
+    supported = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'supported')
+    refuted = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'refuted')
+    partially_true = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'partially_true')
+
+    # Score calculation (supported: 100%, partially: 50%, refuted: 0%)
+    score = ((supported * 100) + (partially_true * 50)) / total_facts if total_facts > 0 else 0
+
+    log.info(f'Verification complete. Score: {score:.1f}/100')
+
+    return {
+        'totalFacts': total_facts,
+        'supported': supported,
+        'refuted': refuted,
+        'partiallyTrue': partially_true,
+        'score': round(score, 1)
+    }
+
+@app.route('/api/verify-facts', methods=['POST'])
+def verify_facts():
+    """Verify facts using Brave Search and GPT analysis"""
+    try:
+        if not get_openai_client():
+            return jsonify({'error': 'OpenAI API key not configured'}), 500
         
-        transcript = None
-        error_messages = []
+        if not BRAVE_API_KEY:
+            return jsonify({'error': 'Brave Search API key not configured'}), 500
         
-        # Try yt-dlp captions first (fast and free)
-        try:
-            print('Fetching transcript via yt-dlp captions...')
-            transcript = fetch_transcript_ytdlp(video_id)
-            print(f'✓ Successfully fetched via yt-dlp with {len(transcript["segments"])} segments')
-        except Exception as e:
-            error_messages.append(f'yt-dlp: {str(e)}')
-            print(f'✗ yt-dlp failed: {str(e)}')
+        data = request.get_json()
+        facts = data.get('facts', [])
         
-        # Fallback to Whisper API if yt-dlp failed (accurate but uses API credits)
-        if not transcript and openai_client:
-            try:
-                print('=' * 60)
-                print('ATTEMPTING OPENAI WHISPER TRANSCRIPTION')
-                print('=' * 60)
-                transcript = fetch_transcript_whisper(video_id)
-                print(f'✓ Successfully transcribed via Whisper with {len(transcript["segments"])} segments')
-            except Exception as e:
-                error_messages.append(f'Whisper: {str(e)}')
-                print(f'✗ Whisper failed: {str(e)}')
-                print('=' * 60)
+        if not facts:
+            return jsonify({'error': 'No facts provided for verification'}), 400
         
-        if not transcript:
-            return jsonify({
-                'error': 'Failed to fetch transcription from all sources',
-                'details': ' | '.join(error_messages)
-            }), 500
+        # Limit to first 10 facts to avoid response size issues
+        max_facts = 10
+        if len(facts) > max_facts:
+            log.info(f'Limiting verification to first {max_facts} facts (received {len(facts)})')
+            facts = facts[:max_facts]
         
-        return jsonify({
+        log.info(f'Verifying {len(facts)} facts...')
+        
+        verified_facts = []
+        
+        for idx, fact in enumerate(facts):
+            log.debug(f'Verifying fact {idx + 1}/{len(facts)}: {fact.get("claim", "")[:50]}...')
+            
+            verified_facts.append(verify_fact_with_search(fact))
+        
+        return jsonify(project_fields({
             'success': True,
-            'videoId': video_id,
-            'transcript': transcript,
-            'method': transcript.get('method', 'unknown')
-        })
+            'verifiedFacts': verified_facts,
+            'summary': verification_summary(verified_facts)
+        }, request.args.get('fields')))
         
     except Exception as e:
-        print(f'Unexpected error: {str(e)}')
-        import traceback
-        traceback.print_exc()
+        log.exception(f'Error verifying facts: {str(e)}')
         return jsonify({
-            'error': 'Failed to fetch transcription',
+            'error': 'Failed to verify facts',
             'details': str(e)
         }), 500
 
-@app.route('/api/extract-facts', methods=['POST'])
-def extract_facts():
-    """Extract verifiable facts from transcript using GPT"""
-    try:
-        if not openai_client:
-            return jsonify({'error': 'OpenAI API key not configured'}), 500
-        
-        data = request.get_json()
-        transcript_text = data.get('transcript')
-        
-        if not transcript_text:
-            return jsonify({'error': 'Transcript text is required'}), 400
-        
-        print(f'Extracting facts from transcript ({len(transcript_text)} characters)...')
+
+def iter_ndjson_facts():
+    """Yield facts from an NDJSON request body, one per line, as the body is read"""
+    for line in request.stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def stream_facts_input():
+    """
+    (facts, None) for the request body, or (None, error response) when it can't be used.
+    NDJSON bodies are parsed lazily while streaming; JSON {"facts": [...]} bodies are parsed
+    and validated here, before the response starts.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return iter_ndjson_facts(), None
+    if not request.is_json:
+        return None, (jsonify({'error': 'Send a JSON {"facts": [...]} body or NDJSON'}), 415)
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return None, (jsonify({'error': 'Invalid JSON body'}), 400)
+    facts = data.get('facts')
+    if not isinstance(facts, list):
+        return None, (jsonify({'error': '"facts" must be a list'}), 400)
+    if not facts:
+        return None, (jsonify({'error': 'No facts provided for verification'}), 400)
+    if len(facts) > VERIFY_STREAM_MAX_FACTS:
+        return None, (jsonify({'error': f'At most {VERIFY_STREAM_MAX_FACTS} facts can be verified per request'}), 400)
+    return facts, None
+
+
+@app.route('/api/verify-facts/stream', methods=['POST'])
+@verify_token
+@reserve_usage_quota
+def verify_facts_stream():
+    """
+    Verify up to VERIFY_STREAM_MAX_FACTS facts with bounded concurrency, streaming one NDJSON
+    line per verified fact as soon as it is ready, then a summary line. Each request uses
+    one analysis of the user's quota.
+    """
+    if not get_openai_client():
+        return jsonify({'error': 'OpenAI API key not configured'}), 500
+
+    if not BRAVE_API_KEY:
+        return jsonify({'error': 'Brave Search API key not configured'}), 500
+
+    facts, error = stream_facts_input()
+    if error:
+        return error
+
+    def generate():
+        verdicts = []  # Only the verdicts are kept for the summary, so memory stays flat
+        pending = set()
+
+        def drain(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                pending.discard(future)
+                index, verified_fact = future.result()
+                verdicts.append({'verification': {'verdict': verified_fact.get('verification', {}).get('verdict')}})
+                yield json.dumps({'type': 'result', 'factIndex': index, 'verifiedFact': verified_fact}) + '\n'
+
+        with ThreadPoolExecutor(max_workers=VERIFY_STREAM_CONCURRENCY) as executor:
+            try:
+                for index, fact in enumerate(facts):
+                    if index == VERIFY_STREAM_MAX_FACTS:
+                        # NDJSON bodies are read as they stream, so the cap is applied here
+                        log.warning(f'Streaming verification stopped at {VERIFY_STREAM_MAX_FACTS} facts')
+                        details = f'Only the first {VERIFY_STREAM_MAX_FACTS} facts are verified'
+                        yield json.dumps({'type': 'error', 'error': 'Too many facts', 'details': details}) + '\n'
+                        break
+                    if not isinstance(fact, dict):
+                        fact = {'claim': str(fact)}
+                    pending.add(executor.submit(contextvars.copy_context().run,
+                                                lambda i, f: (i, verify_fact_with_search(f)), index, fact))
+                    # Only keep a small window of facts in flight so memory stays flat
+                    if len(pending) >= VERIFY_STREAM_CONCURRENCY * 2:
+                        yield from drain(FIRST_COMPLETED)
+            except ValueError as e:
+                log.warning(f'Invalid fact in stream: {str(e)}')
+                yield json.dumps({'type': 'error', 'error': 'Invalid fact input', 'details': str(e)}) + '\n'
+
+            if pending:
+                yield from drain(ALL_COMPLETED)
         
-        # Create the prompt for GPT
-        system_prompt = """You are a fact-checking assistant. Your task is to analyze transcripts and extract verifiable factual claims.
+        yield json.dumps({'type': 'summary', 'summary': verification_summary(verdicts)}) + '\n'
 
-For each claim, identify:
-1. The specific factual statement
-2. The category (statistics, historical event, scientific claim, quote, etc.)
-3. Why it needs verification
-4. Key entities or topics to search for verification
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}  # Don't let nginx buffer the stream
+    )
 
-Focus on:
-- Specific numbers, dates, statistics
+
+class AnalysisError(Exception):
+    """Analysis failure that maps to a specific JSON error response"""
+    def __init__(self, payload, status_code=500):
+        super().__init__(payload.get('error', 'Analysis failed'))
+        self.payload = payload
+        self.status_code = status_code
+
+
+analysis_cache = SQLiteCache(ANALYSIS_CACHE_PATH, 'analysis_results')
+transcript_cache = SQLiteCache(ANALYSIS_CACHE_PATH, 'transcripts')
+facts_cache = SQLiteCache(ANALYSIS_CACHE_PATH, 'extracted_facts')
+verdict_cache = SQLiteCache(ANALYSIS_CACHE_PATH, 'verdicts')
+metadata_cache = SQLiteCache(ANALYSIS_CACHE_PATH, 'video_metadata')
+_refreshing_analyses = set()
+_refreshing_lock = threading.Lock()
+refresh_executor = ThreadPoolExecutor(max_workers=ANALYSIS_REFRESH_WORKERS, thread_name_prefix='analysis-refresh')
+
+
+def _analysis_cache_key(video_id, check_mode):
+    return f'{video_id}:{check_mode}'
+
+
+def store_analysis(video_id, check_mode, result):
+    """Cache a finished analysis payload and mark it as fresh (degraded results are not cached)"""
+    if result.get('degraded'):
+        return result
+    created_at = analysis_cache.set(_analysis_cache_key(video_id, check_mode), result)
+    return {
+        **result,
+        'cachedAt': datetime.utcfromtimestamp(created_at).isoformat() + 'Z',
+        'fresh': True
+    }
+
+
+def _verdict_cache_key(video_id, item):
+    return f'{video_id}:{hashlib.sha256(json.dumps(item, sort_keys=True).encode("utf-8")).hexdigest()}'
+
+
+def get_cached_verdicts(video_id, items):
+    """Verification entries from earlier runs on this video, aligned with `items` (None where missing)"""
+    entries = []
+    for item in items:
+        entry = verdict_cache.get(_verdict_cache_key(video_id, item))
+        fresh = entry is not None and time.time() - entry[1] <= VERDICT_CACHE_MAX_AGE_SECONDS
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'verdict', 'result': 'hit' if fresh else 'miss'})
+        entries.append(entry[0] if fresh else None)
+    return entries
+
+
+def store_verdict(video_id, item, entry):
+    """Keep a fact (or thesis) verification for later runs; failed and unverified checks are not kept"""
+    if entry and entry['verification']['verdict'] not in ('error', 'unverified'):
+        verdict_cache.set(_verdict_cache_key(video_id, item), entry)
+
+
+def thesis_cache_item(transcript_text):
+    """Verdict-cache identity of a video's central thesis (it is extracted from the transcript)"""
+    return {'thesisOf': hashlib.sha256(transcript_text.encode('utf-8')).hexdigest()}
+
+
+def analysis_cache_age(video_id, check_mode):
+    """Age in seconds of the cached analysis (without refreshing it), or None if there is none"""
+    entry = analysis_cache.get(_analysis_cache_key(video_id, check_mode))
+    return time.time() - entry[1] if entry else None
+
+
+def get_cached_analysis(video_id, check_mode):
+    """
+    Return a cached analysis payload, or None if it must be recomputed.
+    Entries past the freshness window are still served, but trigger a background refresh.
+    """
+    entry = analysis_cache.get(_analysis_cache_key(video_id, check_mode))
+    if not entry:
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'analysis', 'result': 'miss'})
+        return None
+
+    result, created_at = entry
+    age = time.time() - created_at
+    if age > ANALYSIS_CACHE_MAX_AGE_SECONDS:
+        log.info(f'Analysis cache expired for {video_id} ({check_mode}), recomputing...')
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'analysis', 'result': 'miss'})
+        return None
+
+    fresh = age <= ANALYSIS_CACHE_FRESH_SECONDS
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'analysis', 'result': 'hit' if fresh else 'stale'})
+    log.info(f'Analysis cache hit for {video_id} ({check_mode}), age {age:.0f}s{"" if fresh else " (stale)"}')
+    if not fresh:
+        refresh_analysis_async(video_id, check_mode)
+
+    return {
+        **result,
+        'cachedAt': datetime.utcfromtimestamp(created_at).isoformat() + 'Z',
+        'fresh': fresh
+    }
+
+
+def refresh_analysis_async(video_id, check_mode):
+    """
+    Recompute a stale analysis on the small refresh pool (one refresh per key at a time).
+    When too many refreshes are pending the request is dropped; a later stale hit asks again.
+    """
+    key = _analysis_cache_key(video_id, check_mode)
+    with _refreshing_lock:
+        if key in _refreshing_analyses:
+            return
+        if len(_refreshing_analyses) >= ANALYSIS_REFRESH_MAX_PENDING:
+            log.info(f'Refresh queue full, not refreshing {video_id} ({check_mode}) now')
+            return
+        _refreshing_analyses.add(key)
+
+    def refresh():
+        try:
+            log.info(f'Refreshing stale analysis for {video_id} ({check_mode}) in background...')
+            # Refreshes queue for pipeline capacity behind every interactive request
+            with admitted_analysis('stale-refresh', 'batch', ANALYSIS_DEADLINE_SECONDS):
+                store_analysis(video_id, check_mode, run_analysis(video_id, check_mode))
+            log.info(f'Background refresh complete for {video_id} ({check_mode})')
+        except Exception as e:
+            log.warning(f'Background refresh failed for {video_id} ({check_mode}): {str(e)}')
+        finally:
+            with _refreshing_lock:
+                _refreshing_analyses.discard(key)
+
+    refresh_executor.submit(refresh)
+
+
+def get_cached_transcript(video_id):
+    """(transcript, transcript_method) from the transcript cache, or None"""
+    entry = transcript_cache.get(video_id)
+    if not entry or time.time() - entry[1] > TRANSCRIPT_CACHE_MAX_AGE_SECONDS:
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'transcript', 'result': 'miss'})
+        return None
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'transcript', 'result': 'hit'})
+    return entry[0]['transcript'], entry[0]['method']
+
+
+def fetch_transcript_for_analysis(video_id, deadline=None, skipped=None):
+    """
+    Try each transcript source in turn; returns (transcript, transcript_method).
+    With a deadline, tiers stop once it has passed and Whisper is skipped (noted in `skipped`)
+    when too little of the budget is left for it. Fetched transcripts are cached.
+    """
+    cached = get_cached_transcript(video_id)
+    if cached:
+        log.info(f'[1/5] Transcript cache hit for {video_id}')
+        return cached
+
+    # 4-tier system: RapidAPI → timedtext → youtube-transcript-api → yt-dlp → Whisper
+    log.info('[1/5] Fetching transcript...')
+    transcript = None
+    transcript_method = None
+
+    def out_of_time():
+        return deadline is not None and deadline.expired()
+
+    # One shared probe: metadata for the response, and which caption tiers are worth trying.
+    # RapidAPI doesn't need it, so the probe runs while RapidAPI is tried
+    probe_abandoned = threading.Event()
+    probe = probe_executor.submit(contextvars.copy_context().run, probe_video, video_id, deadline, probe_abandoned)
+
+    # METHOD 1: Try RapidAPI (no download, works for all users)
+    if RAPIDAPI_KEY:
+        try:
+            log.debug('Trying RapidAPI YouTube Transcript...')
+            transcript = fetch_transcript_rapidapi(video_id, deadline)
+            transcript_method = transcript.get('method', 'rapidapi')
+            log.info(f'Transcript fetched via RapidAPI ({len(transcript["full"])} chars)')
+            record_transcript_attempt('rapidapi', 'success')
+        except Exception as e:
+            log.info(f'RapidAPI failed: {str(e)}')
+            record_transcript_attempt('rapidapi', 'failure')
+
+    if transcript:
+        # The metadata only labels a RapidAPI transcript, so an unfinished probe isn't waited for.
+        # It finishes in the background (filling the metadata cache) without its yt-dlp fallback
+        try:
+            metadata = probe.result(timeout=VIDEO_PROBE_GRACE_SECONDS)
+        except FutureTimeoutError:
+            log.debug(f'Not waiting for the probe of {video_id}')
+            probe_abandoned.set()
+            probe.cancel()
+            metadata = None
+    else:
+        metadata = probe.result()
+    no_captions = captions_absent(metadata)
+    if no_captions and not transcript:
+        log.info('Video has no caption tracks, skipping the caption tiers')
+
+    # METHOD 2: Try YouTube timedtext API (tracks listed by the probe, no OAuth required)
+    if not transcript and metadata and not no_captions and not out_of_time():
+        try:
+            log.debug('Trying YouTube timedtext API...')
+            transcript = fetch_transcript_youtube_api(video_id, deadline, metadata)
+            transcript_method = transcript.get('method', 'youtube_timedtext_api')
+            log.info(f'Transcript fetched via YouTube timedtext API ({len(transcript["full"])} chars)')
+            record_transcript_attempt('timedtext', 'success')
+        except Exception as e:
+            log.info(f'YouTube timedtext API failed: {str(e)}')
+            record_transcript_attempt('timedtext', 'failure')
+
+    # METHOD 3: Try youtube-transcript-api (no OAuth required)
+    if not transcript and not no_captions and not out_of_time():
+        try:
+            log.debug('Trying youtube-transcript-api...')
+            transcript = fetch_transcript_listed(video_id)
+            transcript_method = transcript['method']
+            log.info(f'Transcript fetched via {transcript_method} ({len(transcript["full"])} chars)')
+            record_transcript_attempt('youtube_transcript_api', 'success')
+        except Exception as e:
+            log.info(f'youtube-transcript-api failed: {type(e).__name__}: {str(e)}')
+            record_transcript_attempt('youtube_transcript_api', 'failure')
+
+    # METHOD 3: Try yt-dlp with multiple strategies
+    if not transcript and not no_captions and not out_of_time():
+        try:
+            log.debug('Trying yt-dlp with enhanced bot bypass...')
+            transcript = fetch_transcript_ytdlp(video_id, deadline)
+            transcript_method = transcript.get('method', 'yt-dlp')
+            log.info(f'Transcript fetched via {transcript_method} ({len(transcript["full"])} chars)')
+            record_transcript_attempt('yt_dlp', 'success')
+        except Exception as e:
+            log.info(f'yt-dlp failed: {str(e)}')
+            record_transcript_attempt('yt_dlp', 'failure')
+
+    # METHOD 4: Try OpenAI Whisper API as last resort
+    if not transcript and deadline is not None and deadline.remaining() < WHISPER_MIN_SECONDS:
+        log.warning(f'Skipping Whisper: {max(deadline.remaining(), 0):.0f}s of the request budget left')
+        if skipped is not None:
+            skipped.append('whisper_skipped')
+    elif not transcript and transcription_available():
+        try:
+            log.debug('Trying Whisper...')
+            transcript = fetch_transcript_whisper(video_id, deadline, metadata)
+            transcript_method = 'OpenAI Whisper' if transcript['method'] == 'whisper' else transcript['method']
+            log.info(f'Transcript fetched via Whisper ({len(transcript["full"])} chars)')
+            record_transcript_attempt('whisper', 'success')
+        except Exception as e:
+            log.warning(f'Whisper failed: {str(e)}')
+            record_transcript_attempt('whisper', 'failure')
+            raise AnalysisError({'error': f'All transcription methods failed. Last error: {str(e)}'}, 500)
+
+    if not transcript and deadline is not None and deadline.remaining() < WHISPER_MIN_SECONDS:
+        raise AnalysisError({'error': 'Ran out of time before a transcript was available', 'degraded': True}, 504)
+    if not transcript:
+        raise AnalysisError({'error': 'Could not fetch transcript from any source'}, 500)
+
+    transcript = {**video_details(metadata), **transcript}
+    transcript_cache.set(video_id, {'transcript': transcript, 'method': transcript_method})
+    return transcript, transcript_method
+
+
+FACTS_EXTRACTION_PROMPT = """Extract verifiable factual claims from this transcript. Focus on:
+- Specific numbers, statistics, dates
 - Historical events or facts
 - Scientific or medical claims
 - Quotes attributed to people
 - Assertions about companies, products, or events
 
-Ignore:
-- Opinions or subjective statements
-- Hypotheticals or future predictions
-- General statements without specific claims
+Return ONLY facts that can be verified through web search. Ignore opinions and predictions."""
 
-Return your response as a JSON array of fact objects."""
+THESIS_EXTRACTION_PROMPT = """Analyze this video transcript and identify THE ONE central claim or main thesis.
+This should be the primary argument or key message the video is trying to convey.
+Return only the single most important claim that represents the video's core message."""
 
-        user_prompt = f"""Analyze this transcript and extract all verifiable factual claims:
+VERDICT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "verification",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "verdict": {"type": "string", "enum": ["supported", "refuted", "partially_true"]},
+                "reasoning": {"type": "string"},
+                "confidence": {"type": "integer"},
+                "conflicting_evidence": {"type": "boolean"}
+            },
+            "required": ["verdict", "reasoning", "confidence", "conflicting_evidence"]
+        }
+    }
+}
 
-"{transcript_text}"
 
-Return a JSON array where each fact has:
-- "claim": the exact factual statement
-- "category": type of claim (statistic/historical/scientific/quote/general)
-- "context": surrounding context from transcript
-- "entities": key terms to search for verification
-- "verifiable": boolean if this can be fact-checked"""
+def extraction_model(transcript_text):
+    """The fact-extraction model for a transcript: the small one unless the transcript is long"""
+    return EXTRACTION_MODEL_LONG if len(transcript_text) > EXTRACTION_LONG_TRANSCRIPT_CHARS else EXTRACTION_MODEL_SHORT
 
-        # Call GPT API
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",  
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        # Parse the response
-        import json
-        result = json.loads(response.choices[0].message.content)
-        
-        # Ensure we have a facts array
-        facts = result.get('facts', []) if isinstance(result.get('facts'), list) else []
-        
-        print(f'✓ Extracted {len(facts)} facts from transcript')
-        
-        return jsonify({
-            'success': True,
-            'factCount': len(facts),
-            'facts': facts,
-            'usage': {
-                'promptTokens': response.usage.prompt_tokens,
-                'completionTokens': response.usage.completion_tokens,
-                'totalTokens': response.usage.total_tokens
+
+def facts_extraction_request(transcript_text):
+    """Chat completion arguments for extracting every verifiable fact from a transcript"""
+    return {
+        'model': extraction_model(transcript_text),
+        'messages': [
+            {"role": "system", "content": FACTS_EXTRACTION_PROMPT},
+            {"role": "user", "content": f"Extract all verifiable facts from this transcript:\n\n{transcript_text}"}
+        ],
+        'response_format': {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "facts_extraction",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "facts": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "claim": {"type": "string"},
+                                    "category": {"type": "string"},
+                                    "entities": {"type": "array", "items": {"type": "string"}}
+                                },
+                                "required": ["claim", "category", "entities"]
+                            }
+                        }
+                    },
+                    "required": ["facts"]
+                }
             }
-        })
-        
+        }
+    }
+
+
+def parse_extracted_facts(response):
+    """Facts from an extraction response, normalized to dictionaries"""
+    all_facts = json.loads(response.choices[0].message.content).get('facts', [])
+
+    # Validate that all_facts contains dictionaries, not strings
+    validated_facts = []
+    for fact in all_facts:
+        if isinstance(fact, dict):
+            validated_facts.append(fact)
+        elif isinstance(fact, str):
+            # If it's a string, convert it to a dict format
+            validated_facts.append({
+                'claim': fact,
+                'category': 'General',
+                'entities': []
+            })
+        else:
+            log.warning(f'Skipping invalid fact format: {type(fact)}')
+
+    log.info(f'Extracted {len(validated_facts)} total facts')
+    return validated_facts
+
+
+def facts_cache_key(request_kwargs):
+    """Extraction results depend only on the request (model, prompt, schema and transcript)"""
+    return hashlib.sha256(json.dumps(request_kwargs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_facts(key):
+    entry = facts_cache.get(key)
+    if not entry or time.time() - entry[1] > TRANSCRIPT_CACHE_MAX_AGE_SECONDS:
+        metrics.inc('truthquest_cache_requests_total', {'cache': 'facts', 'result': 'miss'})
+        return None
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'facts', 'result': 'hit'})
+    return entry[0]
+
+
+def extract_facts_cached(transcript_text, deadline=None):
+    """Every verifiable fact in a transcript, from the facts cache or one extraction call"""
+    request_kwargs = facts_extraction_request(transcript_text)
+    key = facts_cache_key(request_kwargs)
+    all_facts = get_cached_facts(key)
+    if all_facts is None:
+        all_facts = parse_extracted_facts(chat_completion('extract_facts', deadline, **request_kwargs))
+        facts_cache.set(key, all_facts)
+    return all_facts
+
+
+def thesis_extraction_request(transcript_text):
+    """Chat completion arguments for identifying the video's central thesis"""
+    return {
+        'model': "gpt-5-mini",
+        'messages': [
+            {"role": "system", "content": THESIS_EXTRACTION_PROMPT},
+            {"role": "user", "content": f"Transcript:\n\n{transcript_text[:8000]}"}
+        ],
+        'response_format': {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "thesis_extraction",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "thesis": {"type": "string"},
+                        "importance": {"type": "string"}
+                    },
+                    "required": ["thesis", "importance"]
+                }
+            }
+        }
+    }
+
+
+def parse_thesis(response):
+    central_thesis = json.loads(response.choices[0].message.content).get('thesis', '')
+    log.info(f'Central thesis: {central_thesis[:100]}...')
+    return central_thesis
+
+
+def fact_search_query(fact):
+    """Brave query for a sampled fact: the claim plus its top entities"""
+    entities = fact.get('entities', [])
+    if isinstance(entities, list):
+        entities_str = ' '.join(str(e) for e in entities[:3])
+    else:
+        entities_str = ''
+    return f'{fact.get("claim", "")[:200]} {entities_str}'
+
+
+def source_links(sources):
+    """Sources as the analysis payload shows them: title and URL"""
+    return [{'title': source['title'], 'url': source['url']} for source in sources]
+
+
+def verdict_request(claim, sources):
+    """Chat completion arguments for judging a claim against the selected search evidence"""
+    analysis_prompt = f"""Claim: "{claim}"
+
+Search Results:
+{chr(10).join([f"- {evidence_line(s)}" for s in sources])}
+
+Verdict (supported/refuted/partially_true), your confidence (0-100) and whether the results conflict:"""
+
+    return {
+        'model': MODEL_ROUTES['analyze'][0],
+        'messages': [{"role": "user", "content": analysis_prompt}],
+        'response_format': VERDICT_RESPONSE_FORMAT
+    }
+
+
+def parse_verdict(response):
+    return json.loads(response.choices[0].message.content)
+
+
+def escalation_reason(result):
+    """Why a fast-model verdict should be re-asked of the strong model, or None to accept it"""
+    if result.get('verdict') in ('inconclusive', 'unverified'):
+        return 'inconclusive'
+    if result.get('conflicting_evidence'):
+        return 'conflicting_evidence'
+    confidence = result.get('confidence')
+    if not isinstance(confidence, (int, float)) or confidence < CASCADE_MIN_CONFIDENCE:
+        return 'low_confidence'
+    return None
+
+
+def cascade_step(endpoint, result):
+    """
+    After the fast model's verdict: the strong model to re-ask, or None to keep the verdict.
+    Counts the outcome per endpoint, which gives the escalation rate.
+    """
+    fast, *strong = MODEL_ROUTES[endpoint]
+    reason = escalation_reason(result) if strong else None
+    metrics.inc('truthquest_model_cascade_total', {'endpoint': endpoint, 'outcome': reason or 'accepted'})
+    if reason:
+        log.debug(f'Escalating {endpoint} verdict from {fast} to {strong[0]} ({reason})')
+        return strong[0]
+    return None
+
+
+def fast_verdict(endpoint, request_kwargs, deadline=None):
+    """The fast model's verdict (parsed JSON) and the strong model to re-ask it of, or None"""
+    fast = MODEL_ROUTES[endpoint][0]
+    result = parse_verdict(chat_completion('verdict', deadline, **{**request_kwargs, 'model': fast}))
+    return result, cascade_step(endpoint, result)
+
+
+def escalated_verdict(strong, request_kwargs, fast_result, deadline=None):
+    """The strong model's verdict; if it fails, the fast verdict stands"""
+    try:
+        return parse_verdict(chat_completion('verdict_escalated', deadline, **{**request_kwargs, 'model': strong}))
     except Exception as e:
-        print(f'Error extracting facts: {str(e)}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': 'Failed to extract facts',
-            'details': str(e)
-        }), 500
+        log.warning(f'Escalated verdict failed, keeping the fast verdict: {str(e)}')
+        return fast_result
+
+
+def cascaded_verdict(endpoint, request_kwargs, deadline=None):
+    """
+    A verdict (parsed JSON) from the endpoint's fast model, or from its strong model when the
+    fast answer is unsure. If the strong model fails, the fast verdict stands.
+    """
+    result, strong = fast_verdict(endpoint, request_kwargs, deadline)
+    if strong:
+        return escalated_verdict(strong, request_kwargs, result, deadline)
+    return result
+
+
+escalation_executor = ThreadPoolExecutor(max_workers=CASCADE_ESCALATION_WORKERS,
+                                         thread_name_prefix='verdict-escalation')
+
+
+def deferred_verdict(endpoint, request_kwargs, build, deadline=None):
+    """
+    cascaded_verdict without waiting for an escalation: a future of build(verdict). It is
+    already done unless the fast verdict escalated; then the strong model is asked on the
+    escalation pool while the caller goes on to its next claim.
+    """
+    result, strong = fast_verdict(endpoint, request_kwargs, deadline)
+    if not strong:
+        return completed_future(build(result))
+    return escalation_executor.submit(contextvars.copy_context().run, lambda: build(
+        escalated_verdict(strong, request_kwargs, result, deadline)
+    ))
+
+
+def completed_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def thesis_entry(central_thesis, thesis_result, thesis_sources):
+    """The centralThesis section of an analysis payload"""
+    return {
+        'claim': central_thesis,
+        'category': 'Central Thesis',
+        'entities': [],
+        'verification': {
+            'verdict': thesis_result['verdict'],
+            'reasoning': thesis_result['reasoning'][:200],
+            'sources': source_links(thesis_sources)
+        }
+    }
+
+
+def verified_fact_entry(fact, result, sources):
+    return {
+        **fact,
+        'verification': {
+            'verdict': result['verdict'],
+            'reasoning': result['reasoning'][:200],
+            'sources': source_links(sources)
+        }
+    }
+
+
+def failed_fact_entry(fact, error):
+    return {
+        **fact,
+        'verification': {
+            'verdict': 'error',
+            'reasoning': f'Verification failed: {str(error)}',
+            'sources': []
+        }
+    }
 
-@app.route('/api/extract-facts-chunk', methods=['POST'])
-def extract_facts_chunk():
-    """Extract facts from a chunk of transcript"""
-    try:
-        if not openai_client:
-            return jsonify({'error': 'OpenAI API key not configured'}), 500
-        
-        data = request.get_json()
-        transcript_chunk = data.get('chunk')
-        chunk_index = data.get('chunkIndex', 0)
-        total_chunks = data.get('totalChunks', 1)
-        
-        if not transcript_chunk:
-            return jsonify({'error': 'Transcript chunk is required'}), 400
-        
-        print(f'Processing chunk {chunk_index + 1}/{total_chunks} ({len(transcript_chunk)} characters)...')
-        
-        system_prompt = """You are a fact-checking assistant. Extract verifiable factual claims from this transcript segment.
 
-For each claim, identify:
-1. The specific factual statement
-2. The category (statistics, historical event, scientific claim, quote, etc.)
-3. Key entities or topics to search for verification
+def checkable_claim(fact, index):
+    """The claim to verify for a sampled fact, or None if the fact can't be checked"""
+    # Ensure fact is a dictionary
+    if not isinstance(fact, dict):
+        log.warning(f'Skipping invalid fact format at index {index}: {type(fact)}')
+        return None
 
-Focus on:
-- Specific numbers, dates, statistics
-- Historical events or facts
-- Scientific or medical claims
-- Quotes attributed to people
-- Assertions about companies, products, or events
+    # Get claim with fallback
+    claim = fact.get('claim', str(fact))
+    if not claim:
+        log.warning(f'Skipping fact {index} - no claim found')
+        return None
+    return claim
 
-Ignore opinions, hypotheticals, and general statements.
-Return a JSON object with a "facts" array."""
 
-        user_prompt = f"""Extract all verifiable factual claims from this transcript segment:
+def sample_facts(all_facts, check_mode):
+    """Smart sampling - select facts based on mode"""
+    import random
 
-"{transcript_chunk}"
+    if check_mode == 'full':
+        # Full check - verify ALL facts
+        sampled_facts = all_facts
+        log.info(f'[4/5] Full check mode - verifying ALL {len(sampled_facts)} facts...')
+    else:
+        # Sample check - select 5-7 representative facts
+        sample_size = min(7, len(all_facts))
+        sampled_facts = random.sample(all_facts, sample_size) if len(all_facts) > sample_size else all_facts
+        log.info(f'[4/5] Sample check mode - verifying {len(sampled_facts)} facts...')
+    return sampled_facts
 
-Return JSON with a "facts" array where each fact has:
-- "claim": the exact factual statement
-- "category": type (statistic/historical/scientific/quote/general)
-- "context": surrounding context (max 100 chars)
-- "entities": key terms array (max 5 items)
-- "verifiable": boolean"""
 
-        response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
+def no_facts_payload(check_mode):
+    return {
+        'success': True,
+        'grade': 'N/A',
+        'gradeDescription': 'No verifiable facts found',
+        'gradeColor': 'gray',
+        'totalFacts': 0,
+        'sampledFacts': 0,
+        'verifiedFacts': [],
+        'checkMode': check_mode
+    }
+
+
+def unverified_thesis_entry(central_thesis, reason):
+    return thesis_entry(central_thesis, {'verdict': 'unverified', 'reasoning': reason}, [])
+
+
+def verify_thesis(transcript_text, deadline=None, degraded=None):
+    """
+    Extract and verify the central thesis, returning a future of its entry (see deferred_verdict).
+    If the deadline cuts this short, the thesis is returned unverified (and noted in `degraded`)
+    so the facts verified so far still count.
+    """
+    central_thesis = ''
+    try:
+        central_thesis = parse_thesis(
+            chat_completion('thesis', deadline, **thesis_extraction_request(transcript_text))
         )
         
-        import json
-        result = json.loads(response.choices[0].message.content)
-        facts = result.get('facts', []) if isinstance(result.get('facts'), list) else []
-        
-        print(f'✓ Extracted {len(facts)} facts from chunk {chunk_index + 1}')
+        log.debug('Verifying central thesis...')
+        thesis_search_results = search_brave(f'{central_thesis[:200]}', count=EVIDENCE_SEARCH_COUNT, deadline=deadline)
+        thesis_sources = select_evidence(central_thesis, thesis_search_results)
         
-        return jsonify({
-            'success': True,
-            'chunkIndex': chunk_index,
-            'factCount': len(facts),
-            'facts': facts
-        })
+        def thesis_verification(thesis_result):
+            log.info(f'Thesis verdict: {thesis_result["verdict"]}')
+            return thesis_entry(central_thesis, thesis_result, thesis_sources)
         
+        return deferred_verdict('analyze', verdict_request(central_thesis, thesis_sources), thesis_verification,
+                                deadline)
     except Exception as e:
-        print(f'Error extracting facts from chunk: {str(e)}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': 'Failed to extract facts from chunk',
-            'details': str(e)
-        }), 500
+        if deadline is None or not deadline.expired():
+            raise
+        log.warning(f'Thesis not verified before the deadline: {str(e)}')
+        if degraded is not None:
+            degraded.append('thesis_unverified')
+        return completed_future(unverified_thesis_entry(central_thesis, 'Not verified before the request deadline'))
 
-@app.route('/api/verify-fact', methods=['POST'])
-def verify_single_fact():
-    """Verify a single fact"""
-    try:
-        if not openai_client or not BRAVE_API_KEY:
-            return jsonify({'error': 'APIs not configured'}), 500
-        
-        data = request.get_json()
-        fact = data.get('fact')
-        fact_index = data.get('factIndex', 0)
-        total_facts = data.get('totalFacts', 1)
-        
-        if not fact:
-            return jsonify({'error': 'Fact is required'}), 400
-        
-        print(f'Verifying fact {fact_index + 1}/{total_facts}: {fact.get("claim", "")[:50]}...')
-        
-        # Build search query
-        claim = fact.get('claim', '').strip()
-        if not claim:
-            raise Exception('Empty claim')
-        
-        entities = fact.get('entities', [])
-        entity_text = ' '.join(str(e) for e in entities[:2] if e) if entities else ''
-        search_query = f"{claim} {entity_text}".strip()
-        
-        if len(search_query) > 300:
-            search_query = search_query[:300].rsplit(' ', 1)[0]
-        
-        # Search Brave
-        search_results = search_brave(search_query, count=3)
-        
-        # Extract sources
-        sources = []
-        for result in search_results.get('web', {}).get('results', [])[:3]:
-            description = result.get('description', '')
-            if len(description) > 200:
-                description = description[:200] + '...'
-            
-            sources.append({
-                'title': result.get('title', '')[:150],
-                'url': result.get('url', ''),
-                'description': description
-            })
-        
-        # GPT verification
-        verification_prompt = f"""Analyze if these search results support or refute this claim.
 
-CLAIM: {claim}
+THESIS_ONLY_SCORES = {'supported': 100, 'partially_true': 50, 'refuted': 0}
 
-SEARCH RESULTS:
-{chr(10).join([f"{i+1}. {s['title']}: {s['description']}" for i, s in enumerate(sources)])}
 
-Return JSON with:
-- verdict: "supported", "refuted", "partially_true", "unverified", or "inconclusive"
-- confidence: 0-100
-- reasoning: brief explanation (max 150 chars)
-- relevant_sources: indices array (0-based)"""
+def analysis_payload(video_id, check_mode, transcript, transcript_method, all_facts, sampled_facts,
+                     verified_facts, thesis_verification, degraded_reasons=()):
+    """Grade the verified facts (with thesis weight) and build the /api/analyze response"""
+    thesis_verdict = thesis_verification['verification']['verdict']
 
-        verification_response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "system", "content": "You are a fact-checker. Be concise."},
-                {"role": "user", "content": verification_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        import json
-        verification_result = json.loads(verification_response.choices[0].message.content)
-        
-        verified_fact = {
-            **fact,
-            'verification': {
-                'verdict': verification_result.get('verdict', 'inconclusive'),
-                'confidence': verification_result.get('confidence', 0),
-                'reasoning': verification_result.get('reasoning', '')[:200],  # Limit reasoning
-                'sources': [sources[i] for i in verification_result.get('relevant_sources', []) if i < len(sources)][:2]  # Max 2 sources
-            }
-        }
-        
-        print(f'✓ Verified: {verification_result.get("verdict")}')
-        
-        return jsonify({
-            'success': True,
-            'factIndex': fact_index,
-            'verifiedFact': verified_fact
-        })
-        
-    except Exception as e:
-        print(f'Error verifying fact: {str(e)}')
-        return jsonify({
-            'success': False,
-            'factIndex': fact_index,
-            'error': str(e),
-            'verifiedFact': {
-                **fact,
-                'verification': {
-                    'verdict': 'error',
-                    'confidence': 0,
-                    'reasoning': f'Error: {str(e)[:100]}',
-                    'sources': []
-                }
-            }
-        }), 200  # Return 200 to continue processing
+    supported = sum(1 for f in verified_facts if f['verification']['verdict'] == 'supported')
+    refuted = sum(1 for f in verified_facts if f['verification']['verdict'] == 'refuted')
+    partially_true = sum(1 for f in verified_facts if f['verification']['verdict'] == 'partially_true')
 
-def search_brave(query, count=3):
-    """Search using Brave Search API"""
-    if not BRAVE_API_KEY:
-        raise Exception('Brave API key not configured')
-    
-    # Clean and validate query
-    query = query.strip()
-    if not query:
-        raise Exception('Empty search query')
-    
-    # Limit query length (Brave API limit is around 400 chars)
-    if len(query) > 400:
-        query = query[:400]
-    
-    url = 'https://api.search.brave.com/res/v1/web/search'
-    headers = {
-        'Accept': 'application/json',
-        'Accept-Encoding': 'gzip',
-        'X-Subscription-Token': BRAVE_API_KEY
-    }
-    params = {
-        'q': query,
-        'count': min(count, 5),  # Reduce to max 5 results
-        'text_decorations': False,  # Disable text decorations to reduce response size
-        'search_lang': 'en'
+    # Calculate base score: supported=100%, partially=50%, refuted=0%
+    base_score = ((supported * 100) + (partially_true * 50)) / len(verified_facts) if verified_facts else 0
+
+    # Apply thesis multiplier - thesis has significant weight on final score
+    if not verified_facts and 'thesis_only' in degraded_reasons:
+        # Degraded: no facts were checked in time, so the thesis alone sets the score
+        final_score = THESIS_ONLY_SCORES.get(thesis_verdict, 0)
+        log.info(f'Thesis-only grading ({thesis_verdict}): {final_score:.1f}%')
+    elif thesis_verdict == 'refuted':
+        # Central thesis refuted = automatic fail (max 40% score)
+        final_score = min(base_score * 0.4, 40)
+        log.info(f'Central thesis REFUTED - score reduced from {base_score:.1f}% to {final_score:.1f}%')
+    elif thesis_verdict == 'partially_true':
+        # Central thesis partially true = slightly reduced score (90% of base)
+        final_score = base_score * 0.90
+        log.info(f'Central thesis PARTIALLY TRUE - score reduced from {base_score:.1f}% to {final_score:.1f}%')
+    elif thesis_verdict == 'supported':
+        # Central thesis supported = bonus! +15 points (capped at 100)
+        final_score = min(base_score + 15, 100)
+        log.info(f'Central thesis SUPPORTED - score boosted from {base_score:.1f}% to {final_score:.1f}%')
+    else:
+        # Thesis could not be verified in time - facts alone set the score
+        final_score = base_score
+
+    # Assign grade based on final score
+    score = final_score
+    if score >= 80:
+        grade = 'A'
+        description = 'High Truth - Most claims are well-supported'
+        color = 'green'
+    elif score >= 60:
+        grade = 'B'
+        description = 'Needs Verification - Some claims need fact-checking'
+        color = 'blue'
+    elif score >= 40:
+        grade = 'C'
+        description = 'Read Other Sources - Many unverified claims'
+        color = 'orange'
+    else:
+        grade = 'D'
+        description = "Don't Believe - Most claims are questionable"
+        color = 'red'
+
+    log.info(f'GRADE: {grade} ({score:.1f}%) - {description}')
+
+    return {
+        'success': True,
+        'videoId': video_id,
+        'videoTitle': transcript.get('title', 'Unknown Title'),
+        'videoUploader': transcript.get('uploader', 'Unknown Uploader'),
+        'videoDuration': transcript.get('duration', 0),
+        'videoViewCount': transcript.get('view_count', 0),
+        'transcriptMethod': transcript_method,  # NEW: Show which method was used
+        'grade': grade,
+        'gradeDescription': description,
+        'gradeColor': color,
+        'score': round(score, 1),
+        'totalFacts': len(all_facts),
+        'sampledFacts': len(sampled_facts),
+        'verifiedFacts': verified_facts,
+        'centralThesis': thesis_verification,
+        'checkMode': check_mode,
+        'summary': {
+            'supported': supported,
+            'refuted': refuted,
+            'partiallyTrue': partially_true
+        },
+        'degraded': bool(degraded_reasons),
+        **({'degradedReasons': list(degraded_reasons)} if degraded_reasons else {})
     }
-    
-    print(f'Brave Search query: {query[:100]}...')
-    
-    try:
-        response = requests.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        print(f'Brave API HTTP Error: {e.response.status_code} - {e.response.text}')
-        raise Exception(f'Brave Search API error: {e.response.status_code}')
-    except Exception as e:
-        print(f'Brave API Error: {str(e)}')
-        raise
 
-@app.route('/api/verify-facts', methods=['POST'])
-def verify_facts():
-    """Verify facts using Brave Search and GPT analysis"""
-    try:
-        if not openai_client:
-            return jsonify({'error': 'OpenAI API key not configured'}), 500
-        
-        if not BRAVE_API_KEY:
-            return jsonify({'error': 'Brave Search API key not configured'}), 500
-        
-        data = request.get_json()
-        facts = data.get('facts', [])
-        
-        if not facts:
-            return jsonify({'error': 'No facts provided for verification'}), 400
-        
-        # Limit to first 10 facts to avoid response size issues
-        max_facts = 10
-        if len(facts) > max_facts:
-            print(f'Limiting verification to first {max_facts} facts (received {len(facts)})')
-            facts = facts[:max_facts]
-        
-        print(f'Verifying {len(facts)} facts...')
-        
-        verified_facts = []
-        
-        for idx, fact in enumerate(facts):
-            print(f'Verifying fact {idx + 1}/{len(facts)}: {fact.get("claim", "")[:50]}...')
-            
+
+@metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'total'})
+def run_analysis(video_id, check_mode, deadline=None):
+    """
+    Run the full analysis pipeline for a video and return the response payload.
+    As the deadline approaches the pipeline degrades instead of overrunning: Whisper is skipped,
+    the fact sample shrinks, or only the thesis is checked, and the payload says which.
+    """
+    deadline = deadline or Deadline(ANALYSIS_DEADLINE_SECONDS)
+    degraded = []
+    log.info(f'Analyzing video: {video_id} (Mode: {check_mode})')
+
+    with metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'transcript'}):
+        transcript, transcript_method = fetch_transcript_for_analysis(video_id, deadline, degraded)
+
+    # Normalize transcript format (use 'full' key for consistency)
+    transcript_text = transcript.get('full', '')
+
+    all_facts = []
+    if deadline.remaining() < THESIS_ONLY_BELOW_SECONDS:
+        log.warning(f'Only {deadline.remaining():.0f}s left after the transcript, checking the thesis only')
+        degraded.append('thesis_only')
+    else:
+        # Extract ALL facts at once (no chunking)
+        log.info(f'[2/5] Extracting facts from transcript... (Method: {transcript_method})')
+        with metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'fact_extraction'}):
+            all_facts = extract_facts_cached(transcript_text, deadline)
+
+    # Extract and verify central thesis
+    log.info('[3/5] Extracting central thesis...')
+    with metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'thesis'}):
+        thesis_item = thesis_cache_item(transcript_text)
+        thesis_verification = get_cached_verdicts(video_id, [thesis_item])[0]
+        pending_thesis = None
+        if thesis_verification is None:
+            # An escalated thesis verdict finishes while the facts are verified
+            pending_thesis = verify_thesis(transcript_text, deadline, degraded)
+
+    if len(all_facts) == 0 and 'thesis_only' not in degraded:
+        return no_facts_payload(check_mode)
+
+    # Facts verified by an earlier run (e.g. the sample run before a full one) are not checked again
+    sampled_facts = sample_facts(all_facts, check_mode)
+    reused = get_cached_verdicts(video_id, sampled_facts)
+    if any(reused):
+        log.info(f'Reusing {sum(1 for entry in reused if entry)} verdicts from earlier runs')
+
+    unverified = [i for i, entry in enumerate(reused) if entry is None]
+    affordable = max(0, int((deadline.remaining() - DEADLINE_MARGIN_SECONDS) // FACT_VERIFY_ESTIMATE_SECONDS))
+    if len(unverified) > affordable:
+        log.warning(f'Verifying {affordable} of {len(unverified)} unverified sampled facts to stay within the deadline')
+        dropped = set(unverified[affordable:])
+        sampled_facts = [fact for i, fact in enumerate(sampled_facts) if i not in dropped]
+        reused = [entry for i, entry in enumerate(reused) if i not in dropped]
+        degraded.append('sample_reduced')
+
+    # Verify sampled facts
+    log.info('[5/5] Verifying sampled facts...')
+    verified_facts = []
+    verification_started = time.monotonic()
+    checked = 0
+
+    pending_entries = []  # (index in verified_facts, fact, future entry)
+
+    with metrics.timer('truthquest_pipeline_stage_seconds', {'stage': 'verification'}):
+        for i, fact in enumerate(sampled_facts, 1):
+            if reused[i - 1]:
+                verified_facts.append(reused[i - 1])
+                continue
+
+            per_fact = (time.monotonic() - verification_started) / checked if checked else FACT_VERIFY_ESTIMATE_SECONDS
+            if deadline.remaining() - DEADLINE_MARGIN_SECONDS < per_fact:
+                log.warning(f'Deadline reached after {i - 1} of {len(sampled_facts)} facts')
+                sampled_facts = sampled_facts[:i - 1]
+                if 'sample_reduced' not in degraded:
+                    degraded.append('sample_reduced')
+                break
+
+            claim = checkable_claim(fact, i)
+            if not claim:
+                continue
+
+            checked += 1
             try:
-                # Build search query from claim and entities
-                claim = fact.get('claim', '').strip()
-                if not claim:
-                    raise Exception('Empty claim')
-                    
-                entities = fact.get('entities', [])
-                
-                # Build a clean search query
-                # Use claim + top 2-3 entities, limit to reasonable length
-                entity_text = ' '.join(str(e) for e in entities[:2] if e) if entities else ''
-                search_query = f"{claim} {entity_text}".strip()
-                
-                # Limit query length
-                if len(search_query) > 300:
-                    search_query = search_query[:300].rsplit(' ', 1)[0]  # Cut at last word
+                log.debug(f'Verifying fact {i}/{len(sampled_facts)}: {claim[:60]}...')
                 
-                # Search Brave (reduced to 3 results)
-                search_results = search_brave(search_query, count=3)
+                # Search with Brave
+                search_results = search_brave(fact_search_query(fact), count=EVIDENCE_SEARCH_COUNT, deadline=deadline)
+                sources = select_evidence(claim, search_results)
                 
-                # Extract relevant info from search results (limit to 3)
-                sources = []
-                for result in search_results.get('web', {}).get('results', [])[:3]:
-                    # Truncate descriptions to reduce response size
-                    description = result.get('description', '')
-                    if len(description) > 200:
-                        description = description[:200] + '...'
-                    
-                    sources.append({
-                        'title': result.get('title', '')[:150],  # Limit title length
-                        'url': result.get('url', ''),
-                        'description': description
-                    })
+                # Analyze with GPT
+                entry = deferred_verdict('analyze', verdict_request(claim, sources),
+                                         partial(verified_fact_entry, fact, sources=sources), deadline)
+                pending_entries.append((len(verified_facts), fact, entry))
+                verified_facts.append(None)  # Filled in below, once any escalation has finished
                 
-                # Use GPT to analyze if search results support or refute the claim
-                verification_prompt = f"""You are a fact-checker. Analyze if the following search results support or refute this claim.
+            except Exception as e:
+                log.warning(f'Error verifying fact {i}: {str(e)}')
+                verified_facts.append(failed_fact_entry(fact, e))
+        
+        for index, fact, entry in pending_entries:
+            verified_facts[index] = entry.result()
+            store_verdict(video_id, fact, verified_facts[index])
+            log.debug(f'Verdict: {verified_facts[index]["verification"]["verdict"]}')
+
+    if pending_thesis is not None:
+        thesis_verification = pending_thesis.result()
+        store_verdict(video_id, thesis_item, thesis_verification)
+
+    if all_facts and not sampled_facts and 'thesis_only' not in degraded:
+        degraded.append('thesis_only')
+
+    return analysis_payload(video_id, check_mode, transcript, transcript_method, all_facts, sampled_facts,
+                            verified_facts, thesis_verification, degraded)
+
+
+class AdmissionRejected(Exception):
+    """The analysis pipeline is over capacity; the client should retry after `retry_after` seconds"""
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def response(self):
+        """(payload, status, headers) of the 503 sent for this rejection"""
+        return ({'error': str(self), 'overloaded': True, 'retryAfter': self.retry_after}, 503,
+                {'Retry-After': str(self.retry_after)})
+
+
+class AdmissionTicket:
+    def __init__(self, user_uid, priority, seq):
+        self.user_uid = user_uid
+        self.priority = priority
+        self.seq = seq
+        self.admitted = threading.Event()
+        self.decided = threading.Event()  # Set once admitted or evicted from the queue
+        self.rejection = None  # The AdmissionRejected of an evicted ticket
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.callbacks = []
+
+
+class AdmissionController:
+    """
+    Global and per-user concurrency limits for the analysis pipeline with a bounded waiting
+    queue. Waiting tickets are admitted by priority class, then fair share (the user with
+    the fewest analyses running), then arrival. When the queue is full, the lowest-priority,
+    newest waiting ticket (possibly the new one) is rejected with an estimate of when
+    capacity frees up.
+    """
+
+    def __init__(self, max_active, max_active_per_user, max_queue):
+        self.max_active = max_active
+        self.max_active_per_user = max_active_per_user
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = {}  # uid -> analyses running
+        self._waiting = []
+        self._seq = itertools.count()
+        self._mean_seconds = 30.0  # Moving average of analysis time, for Retry-After
+
+    def queue_depth(self, max_priority=None):
+        """Waiting tickets, or only those of priority max_priority and more urgent"""
+        with self._lock:
+            return sum(1 for t in self._waiting if max_priority is None or t.priority <= max_priority)
+
+    def _retry_after(self):
+        return max(1, math.ceil((len(self._waiting) + 1) * self._mean_seconds / self.max_active))
+
+    def _dispatch(self):
+        """Start waiting tickets while there is capacity (called with the lock held)"""
+        while sum(self._active.values()) < self.max_active:
+            runnable = [t for t in self._waiting if self._active.get(t.user_uid, 0) < self.max_active_per_user]
+            if not runnable:
+                return
+            ticket = min(runnable, key=lambda t: (t.priority, self._active.get(t.user_uid, 0), t.seq))
+            self._waiting.remove(ticket)
+            self._active[ticket.user_uid] = self._active.get(ticket.user_uid, 0) + 1
+            ticket.started_at = time.monotonic()
+            ticket.admitted.set()
+            self._decide(ticket)
+
+    def _decide(self, ticket):
+        ticket.decided.set()
+        for callback in ticket.callbacks:
+            callback()
+
+    def enter(self, user_uid, priority):
+        """
+        Queue an analysis; it may be admitted at once. Raises AdmissionRejected if the queue is
+        full and nothing waiting is less urgent; otherwise the least urgent ticket is evicted.
+        """
+        with self._lock:
+            ticket = AdmissionTicket(user_uid, priority, next(self._seq))
+            self._waiting.append(ticket)
+            self._dispatch()
+            if len(self._waiting) > self.max_queue:
+                victim = max(self._waiting, key=lambda t: (t.priority, t.seq))
+                self._waiting.remove(victim)
+                metrics.inc('truthquest_admission_total', {'decision': 'shed'})
+                victim.rejection = AdmissionRejected('Server is at capacity, please retry shortly',
+                                                     self._retry_after())
+                if victim is ticket:
+                    raise ticket.rejection
+                self._decide(victim)
+        return ticket
+
+    def on_decided(self, ticket, callback):
+        """
+        Call `callback` once the ticket is admitted or evicted (right away, or from the thread
+        that frees a slot or evicts it)
+        """
+        with self._lock:
+            if ticket.decided.is_set():
+                callback()
+            else:
+                ticket.callbacks.append(callback)
 
-CLAIM: {claim}
+    def settle(self, ticket):
+        """
+        Stop waiting for a slot. Returns if the ticket was admitted (it must then be released
+        like any other); raises AdmissionRejected if it was evicted or is still waiting.
+        """
+        with self._lock:
+            if ticket.admitted.is_set():
+                return
+            if ticket.rejection is not None:
+                raise ticket.rejection
+            self._waiting.remove(ticket)
+            metrics.inc('truthquest_admission_total', {'decision': 'timeout'})
+            raise AdmissionRejected('Timed out waiting for analysis capacity, please retry', self._retry_after())
 
-SEARCH RESULTS:
-{chr(10).join([f"{i+1}. {s['title']}: {s['description']}" for i, s in enumerate(sources)])}
+    def started(self, ticket):
+        metrics.inc('truthquest_admission_total', {'decision': 'admitted'})
+        metrics.observe('truthquest_admission_wait_seconds', ticket.started_at - ticket.queued_at)
 
-Analyze the search results and determine:
-1. verdict: "supported", "refuted", "partially_true", "unverified", or "inconclusive"
-2. confidence: 0-100 (how confident are you in this verdict)
-3. reasoning: brief explanation of your analysis
-4. relevant_sources: indices of most relevant search results (0-based array)
+    def release(self, ticket):
+        with self._lock:
+            self._active[ticket.user_uid] -= 1
+            if not self._active[ticket.user_uid]:
+                del self._active[ticket.user_uid]
+            self._mean_seconds = 0.8 * self._mean_seconds + 0.2 * (time.monotonic() - ticket.started_at)
+            self._dispatch()
 
-Return as JSON with these exact fields."""
 
-                verification_response = openai_client.chat.completions.create(
-                    model="gpt-5-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a fact-checking expert who analyzes search results objectively."},
-                        {"role": "user", "content": verification_prompt}
-                    ],
-                    response_format={"type": "json_object"}
-                )
-                
-                import json
-                verification_result = json.loads(verification_response.choices[0].message.content)
-                
-                # Combine fact with verification result
-                verified_fact = {
-                    **fact,
-                    'verification': {
-                        'verdict': verification_result.get('verdict', 'inconclusive'),
-                        'confidence': verification_result.get('confidence', 0),
-                        'reasoning': verification_result.get('reasoning', ''),
-                        'sources': [sources[i] for i in verification_result.get('relevant_sources', []) if i < len(sources)]
-                    },
-                    'searchQuery': search_query
-                }
-                
-                verified_facts.append(verified_fact)
-                print(f'✓ Verified: {verification_result.get("verdict")} ({verification_result.get("confidence")}% confidence)')
-                
-            except Exception as e:
-                print(f'✗ Error verifying fact: {str(e)}')
-                verified_facts.append({
-                    **fact,
-                    'verification': {
-                        'verdict': 'error',
-                        'confidence': 0,
-                        'reasoning': f'Error during verification: {str(e)}',
-                        'sources': []
-                    }
-                })
-        
-        # Calculate overall score
-        total_facts = len(verified_facts)
-        supported = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'supported')
-        refuted = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'refuted')
-        partially_true = sum(1 for f in verified_facts if f.get('verification', {}).get('verdict') == 'partially_true')
-        
-        # Score calculation (supported: 100%, partially: 50%, refuted: 0%)
-        score = ((supported * 100) + (partially_true * 50)) / total_facts if total_facts > 0 else 0
-        
-        print(f'✓ Verification complete. Score: {score:.1f}/100')
-        
-        return jsonify({
-            'success': True,
-            'verifiedFacts': verified_facts,
-            'summary': {
-                'totalFacts': total_facts,
-                'supported': supported,
-                'refuted': refuted,
-                'partiallyTrue': partially_true,
-                'score': round(score, 1)
-            }
-        })
-        
-    except Exception as e:
-        print(f'Error verifying facts: {str(e)}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': 'Failed to verify facts',
-            'details': str(e)
-        }), 500
+def admission_limit(threads=None):
+    """
+    ADMISSION_MAX_ACTIVE, or when unset three quarters of the worker's request threads, leaving
+    the rest for waiting and light requests (ADMISSION_DEFAULT_MAX_ACTIVE without a thread limit)
+    """
+    if ADMISSION_MAX_ACTIVE:
+        return ADMISSION_MAX_ACTIVE
+    return max(1, threads * 3 // 4) if threads else ADMISSION_DEFAULT_MAX_ACTIVE
+
+
+def size_admission(threads):
+    """Fit the running-analysis limit to a gunicorn worker's thread count"""
+    admission.max_active = admission_limit(threads)
+    log.info(f'Admitting up to {admission.max_active} analyses at once ({threads} threads)')
+
+
+admission = AdmissionController(admission_limit(), ADMISSION_MAX_ACTIVE_PER_USER, ADMISSION_MAX_QUEUE)
+
+
+def admission_timeout(deadline):
+    """How long an analysis may wait for capacity and still get a useful share of its deadline"""
+    return max(0, min(ADMISSION_QUEUE_TIMEOUT_SECONDS, deadline.remaining() - THESIS_ONLY_BELOW_SECONDS))
+
+
+def admission_check_mode(check_mode):
+    """
+    The check mode to run under the current load: full checks run as samples once interactive
+    requests (not batch videos or background refreshes) queue up
+    """
+    if check_mode == 'full' and admission.queue_depth(ADMISSION_PRIORITIES['full']) >= ADMISSION_DOWNGRADE_QUEUE:
+        metrics.inc('truthquest_admission_total', {'decision': 'downgraded'})
+        log.warning('Analysis queue is backed up, running a sample check instead of a full one')
+        return 'sample'
+    return check_mode
+
+
+@contextmanager
+def admitted_analysis(user_uid, priority, timeout):
+    """Hold an admission slot for the block, waiting up to `timeout` seconds (AdmissionRejected otherwise)"""
+    ticket = admission.enter(user_uid, ADMISSION_PRIORITIES[priority])
+    ticket.decided.wait(timeout)
+    admission.settle(ticket)
+    admission.started(ticket)
+    try:
+        yield
+    finally:
+        admission.release(ticket)
+
+
+def downgraded(result, check_mode):
+    """Mark a result that was computed in a cheaper mode than the one requested"""
+    return {**result, 'downgradedFrom': check_mode} if result.get('checkMode') != check_mode else result
+
 
 @app.route('/api/analyze', methods=['POST'])
 @verify_token
+@reserve_usage_quota
 def analyze_video():
     """Fast video analysis: transcript → extract facts → sample & verify → grade"""
+    deadline = Deadline(ANALYSIS_DEADLINE_SECONDS)
     try:
-        import random
-        
         # Get authenticated user info
         user_uid = request.user['uid']
-        user_email = request.user.get('email', 'anonymous')
-        print(f'Authenticated user: {user_email} ({user_uid})')
-        
+        log.debug(f'Authenticated user: {user_uid}')
+
         data = request.get_json()
         youtube_url = data.get('youtubeUrl')
         check_mode = data.get('checkMode', 'sample')  # 'sample' or 'full'
-        
+        force_refresh = bool(data.get('forceRefresh', False))  # Bypass the analysis cache
+
         if not youtube_url:
             return jsonify({'error': 'YouTube URL is required'}), 400
         
@@ -1313,468 +3841,291 @@ def analyze_video():
         if not video_id:
             return jsonify({'error': 'Invalid YouTube URL'}), 400
         
-        print(f'\n{"="*60}')
-        print(f'ANALYZING VIDEO: {video_id} (Mode: {check_mode})')
-        print(f'{"="*60}')
-        
-        # Step 2: Get transcript (4-tier system: YouTube Data API → youtube-transcript-api → yt-dlp → Whisper)
-        print('\n[1/5] Fetching transcript...')
-        transcript = None
-        transcript_method = None
-        
-        # METHOD 1: Try RapidAPI (no download, works for all users)
-        if RAPIDAPI_KEY:
-            try:
-                print('Trying RapidAPI YouTube Transcript...')
-                transcript = fetch_transcript_rapidapi(video_id)
-                transcript_method = transcript.get('method', 'rapidapi')
-                print(f'✓ Transcript fetched via RapidAPI ({len(transcript["full"])} chars)')
-            except Exception as e:
-                print(f'✗ RapidAPI failed: {str(e)}')
-        
-        # METHOD 2: Try YouTube timedtext API (scraping, no OAuth required)
-        if not transcript:
-            try:
-                print('Trying YouTube timedtext API...')
-                transcript = fetch_transcript_youtube_api(video_id)
-                transcript_method = transcript.get('method', 'youtube_timedtext_api')
-                print(f'✓ Transcript fetched via YouTube timedtext API ({len(transcript["full"])} chars)')
-            except Exception as e:
-                print(f'✗ YouTube timedtext API failed: {str(e)}')
-        
-        # METHOD 3: Try youtube-transcript-api (no OAuth required)
-        if not transcript:
-            try:
-                print('Trying youtube-transcript-api...')
-                print(f'DEBUG: Fetching transcript for video ID: {video_id}')
-                
-                # Try with different language codes if English doesn't work
-                language_codes = ['en', 'en-US', 'en-GB', 'a.en']  # a.en is auto-generated
-                
-                for lang in language_codes:
-                    try:
-                        print(f'DEBUG: Trying language code: {lang}')
-                        transcript_list = YouTubeTranscriptApi.get_transcript(
-                            video_id, 
-                            languages=[lang],
-                            proxies=None,
-                            preserve_formatting=False
-                        )
-                        # Combine all text segments
-                        full_text = ' '.join([entry['text'] for entry in transcript_list])
-                        transcript = {'full': full_text}
-                        transcript_method = f'youtube-transcript-api ({lang})'
-                        print(f'✓ Transcript fetched via youtube-transcript-api with {lang} ({len(full_text)} chars)')
-                        break
-                    except (TranscriptsDisabled, NoTranscriptFound):
-                        continue
-                        
-            except TranscriptsDisabled as e:
-                print(f'✗ youtube-transcript-api failed: Transcripts are disabled for this video - {str(e)}')
-            except NoTranscriptFound as e:
-                print(f'✗ youtube-transcript-api failed: No transcript found - {str(e)}')
-            except Exception as e:
-                print(f'✗ youtube-transcript-api error: {type(e).__name__}: {str(e)}')
-        
-        # METHOD 3: Try yt-dlp with multiple strategies
-        if not transcript:
-            try:
-                print('Trying yt-dlp with enhanced bot bypass...')
-                transcript = fetch_transcript_ytdlp(video_id)
-                transcript_method = transcript.get('method', 'yt-dlp')
-                print(f'✓ Transcript fetched via {transcript_method} ({len(transcript["full"])} chars)')
-            except Exception as e:
-                print(f'✗ yt-dlp failed: {str(e)}')
+        try:
+            backend = requested_transcription_backend(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # METHOD 4: Try OpenAI Whisper API as last resort
-        if not transcript and openai_client:
+        # Serve finished analyses from the cache (stale entries are refreshed in the background)
+        result = None if force_refresh else get_cached_analysis(video_id, check_mode)
+
+        run_mode = check_mode
+        if result is None:
+            run_mode = admission_check_mode(check_mode)
+            if run_mode != check_mode and not force_refresh:
+                result = get_cached_analysis(video_id, run_mode)
+
+        if result is None:
             try:
-                print('Trying OpenAI Whisper...')
-                transcript = fetch_transcript_whisper(video_id)
-                transcript_method = 'OpenAI Whisper'
-                print(f'✓ Transcript fetched via Whisper ({len(transcript["full"])} chars)')
-            except Exception as e:
-                print(f'✗ Whisper failed: {str(e)}')
-                return jsonify({'error': f'All transcription methods failed. Last error: {str(e)}'}), 500
-        
-        if not transcript:
-            return jsonify({'error': 'Could not fetch transcript from any source'}), 500
-        
-        # Normalize transcript format (use 'full' key for consistency)
-        transcript_text = transcript.get('full', '')
-        
-        # Step 3: Extract ALL facts at once (no chunking)
-        print(f'\n[2/5] Extracting facts from transcript... (Method: {transcript_method})')
+                with admitted_analysis(user_uid, run_mode, admission_timeout(deadline)):
+                    with transcription_backend_override(backend):
+                        result = run_analysis(video_id, run_mode, deadline)
+            except AdmissionRejected as e:
+                payload, status, headers = e.response()
+                return jsonify(payload), status, headers
+            except AnalysisError as e:
+                return jsonify(e.payload), e.status_code
+            result = store_analysis(video_id, run_mode, result)
+
+        return jsonify(project_fields(downgraded(result, check_mode), request.args.get('fields')))
         
-        system_prompt = """Extract verifiable factual claims from this transcript. Focus on:
-- Specific numbers, statistics, dates
-- Historical events or facts
-- Scientific or medical claims
-- Quotes attributed to people
-- Assertions about companies, products, or events
+    except Exception as e:
+        log.exception(f'Analysis failed: {str(e)}')
+        return jsonify({
+            'error': 'Failed to analyze video',
+            'details': str(e)
+        }), 500
 
-Return ONLY facts that can be verified through web search. Ignore opinions and predictions."""
 
-        user_prompt = f"Extract all verifiable facts from this transcript:\n\n{transcript_text}"
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "facts_extraction",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "facts": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "claim": {"type": "string"},
-                                        "category": {"type": "string"},
-                                        "entities": {"type": "array", "items": {"type": "string"}}
-                                    },
-                                    "required": ["claim", "category", "entities"]
-                                }
-                            }
-                        },
-                        "required": ["facts"]
-                    }
-                }
-            }
-        )
-        
-        import json
-        all_facts = json.loads(response.choices[0].message.content).get('facts', [])
-        
-        # Validate that all_facts contains dictionaries, not strings
-        validated_facts = []
-        for fact in all_facts:
-            if isinstance(fact, dict):
-                validated_facts.append(fact)
-            elif isinstance(fact, str):
-                # If it's a string, convert it to a dict format
-                validated_facts.append({
-                    'claim': fact,
-                    'category': 'General',
-                    'entities': []
-                })
-            else:
-                print(f'Warning: Skipping invalid fact format: {type(fact)}')
-        
-        all_facts = validated_facts
-        print(f'✓ Extracted {len(all_facts)} total facts')
-        
-        # Step 3.5: Extract and verify central thesis
-        print('\n[3/5] Extracting central thesis...')
-        
-        thesis_prompt = """Analyze this video transcript and identify THE ONE central claim or main thesis.
-This should be the primary argument or key message the video is trying to convey.
-Return only the single most important claim that represents the video's core message."""
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+CHANNEL_URL_PATTERN = re.compile(
+    r'^(?:https?://)?(?:www\.|m\.)?youtube\.com/(?:@[^/?#]+|channel/[^/?#]+|c/[^/?#]+|user/[^/?#]+)/?$'
+)
 
-        thesis_response = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[
-                {"role": "system", "content": thesis_prompt},
-                {"role": "user", "content": f"Transcript:\n\n{transcript_text[:8000]}"}
-            ],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "thesis_extraction",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "thesis": {"type": "string"},
-                            "importance": {"type": "string"}
-                        },
-                        "required": ["thesis", "importance"]
-                    }
-                }
-            }
-        )
-        
-        thesis_data = json.loads(thesis_response.choices[0].message.content)
-        central_thesis = thesis_data.get('thesis', '')
-        print(f'✓ Central thesis: {central_thesis[:100]}...')
-        
-        # Verify the central thesis
-        print('  Verifying central thesis...')
-        thesis_search_query = f'{central_thesis[:200]}'
-        thesis_search_results = search_brave(thesis_search_query, count=5)
-        thesis_web_results = thesis_search_results.get('web', {}).get('results', [])[:3]
-        thesis_sources = [{'title': r.get('title', '')[:150], 'url': r.get('url', '')} for r in thesis_web_results]
-        
-        thesis_analysis_prompt = f"""Claim: "{central_thesis}"
 
-Search Results:
-{chr(10).join([f"- {s['title']}" for s in thesis_sources])}
+def listing_url(url):
+    """A playlist or channel URL as yt-dlp should list it (a bare channel URL means its uploads)"""
+    url = url.strip()
+    return url.rstrip('/') + '/videos' if CHANNEL_URL_PATTERN.match(url) else url
 
-Verdict (supported/refuted/partially_true):"""
 
-        thesis_analysis = openai_client.chat.completions.create(
-            model="gpt-5-mini",
-            messages=[{"role": "user", "content": thesis_analysis_prompt}],
-            response_format={
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "verification",
-                    "schema": {
-                        "type": "object",
-                        "properties": {
-                            "verdict": {"type": "string", "enum": ["supported", "refuted", "partially_true"]},
-                            "reasoning": {"type": "string"}
-                        },
-                        "required": ["verdict", "reasoning"]
-                    }
-                }
-            }
-        )
-        
-        thesis_result = json.loads(thesis_analysis.choices[0].message.content)
-        thesis_verdict = thesis_result['verdict']
-        print(f'  ✓ Thesis verdict: {thesis_verdict}')
-        
-        # Store thesis verification
-        thesis_verification = {
-            'claim': central_thesis,
-            'category': 'Central Thesis',
-            'entities': [],
-            'verification': {
-                'verdict': thesis_verdict,
-                'reasoning': thesis_result['reasoning'][:200],
-                'sources': thesis_sources
-            }
-        }
-        
-        # Step 4: Smart sampling - select facts based on mode
-        if check_mode == 'full':
-            # Full check - verify ALL facts
-            sampled_facts = all_facts
-            print(f'\n[4/5] Full check mode - verifying ALL {len(sampled_facts)} facts...')
+def batch_videos(data):
+    """
+    The videos of an /api/analyze-batch request as [{'videoId', 'title'}], from videoIds,
+    youtubeUrls, or a playlist/channel url (one flat yt-dlp listing of up to `limit` videos).
+    Raises ValueError for invalid input.
+    """
+    try:
+        limit = min(int(data.get('limit', BATCH_MAX_VIDEOS)), BATCH_MAX_VIDEOS)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a number')
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+
+    if data.get('url'):
+        url = data['url']
+        video_id = extract_video_id(url)
+        if video_id and 'list=' not in url:
+            videos = [{'videoId': video_id, 'title': None}]
         else:
-            # Sample check - select 5-7 representative facts
-            sample_size = min(7, len(all_facts))
-            sampled_facts = random.sample(all_facts, sample_size) if len(all_facts) > sample_size else all_facts
-            print(f'\n[4/5] Sample check mode - verifying {len(sampled_facts)} facts...')
-        
-        if len(all_facts) == 0:
-            return jsonify({
-                'success': True,
-                'grade': 'N/A',
-                'gradeDescription': 'No verifiable facts found',
-                'gradeColor': 'gray',
-                'totalFacts': 0,
-                'sampledFacts': 0,
-                'verifiedFacts': [],
-                'checkMode': check_mode
-            })
-        
-        # Step 5: Verify sampled facts
-        print('\n[5/5] Verifying sampled facts...')
-        verified_facts = []
-        
-        for i, fact in enumerate(sampled_facts, 1):
-            try:
-                # Ensure fact is a dictionary
-                if not isinstance(fact, dict):
-                    print(f'  ⚠ Skipping invalid fact format at index {i}: {type(fact)}')
-                    continue
-                
-                # Get claim with fallback
-                claim = fact.get('claim', str(fact))
-                if not claim:
-                    print(f'  ⚠ Skipping fact {i} - no claim found')
-                    continue
-                
-                print(f'  Verifying fact {i}/{len(sampled_facts)}: {claim[:60]}...')
-                
-                # Search with Brave
-                entities = fact.get('entities', [])
-                if isinstance(entities, list):
-                    entities_str = ' '.join(str(e) for e in entities[:3])
-                else:
-                    entities_str = ''
-                
-                search_query = f'{claim[:200]} {entities_str}'
-                search_results = search_brave(search_query, count=3)
-                
-                web_results = search_results.get('web', {}).get('results', [])[:2]
-                sources = [{'title': r.get('title', '')[:150], 'url': r.get('url', '')} for r in web_results]
-                
-                # Analyze with GPT
-                analysis_prompt = f"""Claim: "{claim}"
+            log.info(f'Listing videos for batch: {url}')
+            videos = run_media_job(media_jobs.list_videos, listing_url(url), limit, 30, YOUTUBE_COOKIES_PATH)
+    else:
+        videos = []
+        for video_id in data.get('videoIds') or []:
+            if not isinstance(video_id, str) or not VIDEO_ID_PATTERN.match(video_id):
+                raise ValueError(f'Invalid video ID: {video_id}')
+            videos.append({'videoId': video_id, 'title': None})
+        for youtube_url in data.get('youtubeUrls') or []:
+            video_id = extract_video_id(youtube_url) if isinstance(youtube_url, str) else None
+            if not video_id:
+                raise ValueError(f'Invalid YouTube URL: {youtube_url}')
+            videos.append({'videoId': video_id, 'title': None})
 
-Search Results:
-{chr(10).join([f"- {s['title']}" for s in sources])}
+    if not videos:
+        raise ValueError('No videos to analyze (send url, videoIds or youtubeUrls)')
+    if len(videos) > limit:
+        raise ValueError(f'At most {limit} videos per batch')
 
-Verdict (supported/refuted/partially_true):"""
-                
-                analysis = openai_client.chat.completions.create(
-                    model="gpt-5-mini",
-                    messages=[{"role": "user", "content": analysis_prompt}],
-                    response_format={
-                        "type": "json_schema",
-                        "json_schema": {
-                            "name": "verification",
-                            "schema": {
-                                "type": "object",
-                                "properties": {
-                                    "verdict": {"type": "string", "enum": ["supported", "refuted", "partially_true"]},
-                                    "reasoning": {"type": "string"}
-                                },
-                                "required": ["verdict", "reasoning"]
-                            }
-                        }
-                    }
-                )
-                
-                result = json.loads(analysis.choices[0].message.content)
-                
-                verified_facts.append({
-                    **fact,
-                    'verification': {
-                        'verdict': result['verdict'],
-                        'reasoning': result['reasoning'][:200],
-                        'sources': sources
-                    }
-                })
-                
-                print(f'    ✓ {result["verdict"]}')
-                
-            except Exception as e:
-                print(f'    ✗ Error: {str(e)}')
-                verified_facts.append({
-                    **fact,
-                    'verification': {
-                        'verdict': 'error',
-                        'reasoning': f'Verification failed: {str(e)}',
-                        'sources': []
-                    }
-                })
-        
-        # Step 6: Calculate grade with thesis weight
-        supported = sum(1 for f in verified_facts if f['verification']['verdict'] == 'supported')
-        refuted = sum(1 for f in verified_facts if f['verification']['verdict'] == 'refuted')
-        partially_true = sum(1 for f in verified_facts if f['verification']['verdict'] == 'partially_true')
-        
-        # Calculate base score: supported=100%, partially=50%, refuted=0%
-        base_score = ((supported * 100) + (partially_true * 50)) / len(verified_facts) if verified_facts else 0
-        
-        # Apply thesis multiplier - thesis has significant weight on final score
-        if thesis_verdict == 'refuted':
-            # Central thesis refuted = automatic fail (max 40% score)
-            final_score = min(base_score * 0.4, 40)
-            print(f'⚠️  Central thesis REFUTED - score reduced from {base_score:.1f}% to {final_score:.1f}%')
-        elif thesis_verdict == 'partially_true':
-            # Central thesis partially true = slightly reduced score (90% of base)
-            final_score = base_score * 0.90
-            print(f'⚠️  Central thesis PARTIALLY TRUE - score reduced from {base_score:.1f}% to {final_score:.1f}%')
-        else:
-            # Central thesis supported = bonus! +15 points (capped at 100)
-            final_score = min(base_score + 15, 100)
-            print(f'✓ Central thesis SUPPORTED - score boosted from {base_score:.1f}% to {final_score:.1f}%')
-        
-        # Assign grade based on final score
-        score = final_score
-        if score >= 80:
-            grade = 'A'
-            description = 'High Truth - Most claims are well-supported'
-            color = 'green'
-        elif score >= 60:
-            grade = 'B'
-            description = 'Needs Verification - Some claims need fact-checking'
-            color = 'blue'
-        elif score >= 40:
-            grade = 'C'
-            description = 'Read Other Sources - Many unverified claims'
-            color = 'orange'
-        else:
-            grade = 'D'
-            description = "Don't Believe - Most claims are questionable"
-            color = 'red'
-        
-        print(f'\n{"="*60}')
-        print(f'GRADE: {grade} ({score:.1f}%) - {description}')
-        print(f'{"="*60}\n')
-        
-        # Increment user's usage count
-        increment_usage(user_uid)
-        
-        return jsonify({
-            'success': True,
-            'videoId': video_id,
-            'videoTitle': transcript.get('title', 'Unknown Title'),
-            'videoUploader': transcript.get('uploader', 'Unknown Uploader'),
-            'videoDuration': transcript.get('duration', 0),
-            'videoViewCount': transcript.get('view_count', 0),
-            'transcriptMethod': transcript_method,  # NEW: Show which method was used
-            'grade': grade,
-            'gradeDescription': description,
-            'gradeColor': color,
-            'score': round(score, 1),
-            'totalFacts': len(all_facts),
-            'sampledFacts': len(sampled_facts),
-            'verifiedFacts': verified_facts,
-            'centralThesis': thesis_verification,
-            'checkMode': check_mode,
+    # Playlists can repeat a video; it is analyzed (and counted) once
+    unique = {}
+    for video in videos:
+        unique.setdefault(video['videoId'], video)
+    return list(unique.values())
+
+
+def analyze_batch_video(user_uid, video_id, check_mode):
+    """
+    One video of a batch as (payload, status, cached), like /api/analyze; it reserves one
+    analysis of the user's quota and refunds it if the analysis fails
+    """
+    allowed, error_message, reservation = reserve_usage(user_uid)
+    if not allowed:
+        return {'error': error_message, 'limit_exceeded': True}, 429, False
+
+    try:
+        result = get_cached_analysis(video_id, check_mode)
+        if result is not None:
+            return result, 200, True
+        # Batch videos queue behind interactive analyses; each one's time budget starts once it runs
+        with admitted_analysis(user_uid, 'batch', ANALYSIS_DEADLINE_SECONDS):
+            result = run_analysis(video_id, check_mode, Deadline(ANALYSIS_DEADLINE_SECONDS))
+        return store_analysis(video_id, check_mode, result), 200, False
+    except AdmissionRejected as e:
+        refund_usage(user_uid, reservation)
+        return e.response()[0], 503, False
+    except AnalysisError as e:
+        refund_usage(user_uid, reservation)
+        return e.payload, e.status_code, False
+    except Exception as e:
+        refund_usage(user_uid, reservation)
+        log.exception(f'Batch analysis of {video_id} failed: {str(e)}')
+        return {'error': 'Failed to analyze video', 'details': str(e)}, 500, False
+
+
+@app.route('/api/analyze-batch', methods=['POST'])
+@verify_token
+def analyze_batch():
+    """
+    Analyze a playlist, a channel's latest uploads or a list of videos. Videos run with
+    bounded concurrency over the shared caches and evidence index; one NDJSON line is
+    streamed per video as it finishes, then a summary line. Each video uses one analysis
+    of the user's quota.
+    """
+    user_uid = request.user['uid']
+    data = request.get_json(silent=True) or {}
+    check_mode = data.get('checkMode', 'sample')  # 'sample' or 'full'
+
+    try:
+        backend = requested_transcription_backend(data)
+        videos = batch_videos(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        log.warning(f'Batch listing failed: {str(e)}')
+        return jsonify({'error': 'Could not list the playlist or channel', 'details': str(e)}), 502
+
+    def analyze_one(index, video):
+        with transcription_backend_override(backend):
+            return index, video, *analyze_batch_video(user_uid, video['videoId'], check_mode)
+
+    def generate():
+        yield json.dumps({'type': 'batch', 'totalVideos': len(videos), 'videos': videos}) + '\n'
+
+        grades = {'A': 0, 'B': 0, 'C': 0, 'D': 0, 'N/A': 0}  # N/A: no checkable facts, so no score
+        scores = []
+        counts = {'analyzed': 0, 'cached': 0, 'degraded': 0, 'failed': 0, 'skipped': 0}
+        limit_reached = False
+
+        with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as executor:
+            pending = set()
+            queued = iter(enumerate(videos))
+            while True:
+                # Keep BATCH_CONCURRENCY videos in flight; stop starting new ones once the quota runs out
+                for index, video in queued:
+                    if limit_reached:
+                        counts['skipped'] += 1
+                        continue
+                    pending.add(executor.submit(contextvars.copy_context().run, analyze_one, index, video))
+                    if len(pending) >= BATCH_CONCURRENCY:
+                        break
+                if not pending:
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, video, payload, status, cached = future.result()
+                    line = {'type': 'result', 'index': index, 'videoId': video['videoId']}
+                    if status == 200:
+                        counts['cached' if cached else 'analyzed'] += 1
+                        counts['degraded'] += bool(payload.get('degraded'))
+                        if payload.get('grade') in grades:
+                            grades[payload['grade']] += 1
+                        if payload.get('score') is not None:
+                            scores.append(payload['score'])
+                        line['result'] = payload
+                    else:
+                        limit_reached = limit_reached or status == 429
+                        counts['failed'] += 1
+                        line.update(type='error', status=status, **payload)
+                    yield json.dumps(line) + '\n'
+
+        log.info(f'Batch complete: {len(videos)} videos, {counts}')
+        yield json.dumps({
+            'type': 'summary',
             'summary': {
-                'supported': supported,
-                'refuted': refuted,
-                'partiallyTrue': partially_true
+                'totalVideos': len(videos),
+                **counts,
+                'grades': grades,
+                'averageScore': round(sum(scores) / len(scores), 1) if scores else None,
+                'limitExceeded': limit_reached
             }
-        })
-        
+        }) + '\n'
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'}  # Don't let nginx buffer the stream
+    )
+
+
+_usage_cache = OrderedDict()  # uid -> ((today, current_month, version), counts, cached_at)
+_usage_cache_lock = threading.Lock()
+_usage_invalidations = 0  # Bumped on every invalidation; a read that overlaps one isn't cached
+
+
+def invalidate_usage_cache(user_uid):
+    """Drop a user's cached counts; called after every reservation and refund"""
+    global _usage_invalidations
+    with _usage_cache_lock:
+        _usage_cache.pop(user_uid, None)
+        _usage_invalidations += 1
+
+
+def usage_version(user_uid):
+    """The quota store's version of a user's counters (local accounting), or None"""
+    if USAGE_ACCOUNTING != 'local':
+        return None
+    try:
+        return quota_engine.version(user_uid)
     except Exception as e:
-        print(f'\n✗ Analysis failed: {str(e)}')
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': 'Failed to analyze video',
-            'details': str(e)
-        }), 500
+        log.warning(f'Usage version read error: {e}')
+        return None
+
+
+def cached_usage_counts(user_uid, version=None):
+    """
+    get_usage_counts, served from the per-process usage cache while it is current: while the
+    counters' version is unchanged, or for USAGE_CACHE_SECONDS when there is no version
+    """
+    key = (*_current_periods(), version)
+    with _usage_cache_lock:
+        entry = _usage_cache.get(user_uid)
+        if entry and entry[0] == key and (version is not None or time.monotonic() - entry[2] < USAGE_CACHE_SECONDS):
+            _usage_cache.move_to_end(user_uid)
+            metrics.inc('truthquest_cache_requests_total', {'cache': 'usage', 'result': 'hit'})
+            return entry[1]
+        invalidations = _usage_invalidations
+
+    metrics.inc('truthquest_cache_requests_total', {'cache': 'usage', 'result': 'miss'})
+    counts = get_usage_counts(user_uid)
+
+    with _usage_cache_lock:
+        if invalidations == _usage_invalidations:
+            _usage_cache[user_uid] = (key, counts, time.monotonic())
+            while len(_usage_cache) > USAGE_CACHE_MAX_ENTRIES:
+                _usage_cache.popitem(last=False)
+
+    return counts
+
+
+def get_usage_counts(user_uid):
+    """(daily_count, monthly_count) for the current day and month"""
+    if USAGE_ACCOUNTING == 'local':
+        return quota_engine.get_counts(user_uid)
+
+    if not get_db():
+        raise Exception('Database not available')
+
+    # Get user's usage document
+    user_doc = get_db().collection('usage').document(user_uid).get()
+    today, current_month = _current_periods()
+    return _current_counts(user_doc.to_dict() if user_doc.exists else None, today, current_month)
 
 @app.route('/api/usage', methods=['GET'])
 @verify_token
 def get_usage():
-    """Get user's current usage count from Firestore"""
+    """Get user's current usage count (ETag-validated: unchanged usage is a bodyless 304)"""
     try:
         user_uid = request.user['uid']
-        
-        if not db:
-            return jsonify({'error': 'Database not available'}), 500
-        
-        # Get user's usage document
-        user_ref = db.collection('usage').document(user_uid)
-        user_doc = user_ref.get()
-        
-        now = datetime.utcnow()
-        today = str(now.date())
-        current_month = f"{now.year}-{now.month:02d}"
-        
-        if user_doc.exists:
-            data = user_doc.to_dict()
-            
-            # Get daily count (reset if different day)
-            last_used_date = data.get('last_used_date', '')
-            if last_used_date == today:
-                daily_count = data.get('daily_count', 0)
-            else:
-                daily_count = 0  # Reset if it's a new day
-            
-            # Get monthly count (reset if different month)
-            current_month_data = data.get('current_month', '')
-            if current_month_data == current_month:
-                monthly_count = data.get('monthly_count', 0)
-            else:
-                monthly_count = 0  # Reset if it's a new month
-            
-            return jsonify({
+        version = usage_version(user_uid)
+        # The counter version is the validator: a matching ETag needs no counts at all
+        etag = f'usage-{version}-{_current_periods()[0]}' if version is not None else None
+        if etag and etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            daily_count, monthly_count = cached_usage_counts(user_uid, version)
+            response = jsonify({
                 'success': True,
                 'dailyCount': daily_count,
                 'monthlyCount': monthly_count,
@@ -1782,30 +4133,43 @@ def get_usage():
                 'monthlyLimit': MONTHLY_LIMIT,
                 'limitReached': daily_count >= DAILY_LIMIT
             })
+        if etag:
+            response.set_etag(etag)
         else:
-            # User hasn't used the service yet
-            return jsonify({
-                'success': True,
-                'dailyCount': 0,
-                'monthlyCount': 0,
-                'dailyLimit': DAILY_LIMIT,
-                'monthlyLimit': MONTHLY_LIMIT,
-                'limitReached': False
-            })
+            response.add_etag()  # Hash of the body: changes exactly when the counts do
+        response.headers['Cache-Control'] = 'private, no-cache'  # Browsers keep it but revalidate every time
+        return response.make_conditional(request)
     
     except Exception as e:
-        print(f'Error fetching usage: {str(e)}')
-        traceback.print_exc()
+        log.exception(f'Error fetching usage: {str(e)}')
         return jsonify({
             'error': 'Failed to fetch usage',
             'details': str(e)
         }), 500
 
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint; requires `Authorization: Bearer $METRICS_TOKEN`"""
+    if not METRICS_TOKEN:
+        return jsonify({'error': 'Metrics are disabled; set METRICS_TOKEN to enable them'}), 403
+    if request.headers.get('Authorization', '') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.render(METRICS_DIR), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'ok', 'message': 'Truth Quest Python API is running'})
 
-if __name__ == '__main__':
+
+def main():
+    """Serve the app with Flask's own server (see serve.py)"""
+    warm_up()
     port = int(os.getenv('PORT', 3001))
-    print(f'🚀 Flask server running on http://localhost:{port}')
+    log.info(f'Flask server running on http://localhost:{port}')
     app.run(debug=True, port=port, host='0.0.0.0')
+
+
+if __name__ == '__main__':
+    log.warning('Media pool processes re-import server.py when it is the main script; run python serve.py instead')
+    main()
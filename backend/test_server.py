@@ -49,11 +49,1188 @@ def test_server_module():
     except Exception as e:
         pytest.fail(f"Error loading server.py: {e}")
 
+
+def test_server_import_is_lazy():
+    """Importing server.py must not load provider SDKs or touch the network"""
+    import subprocess
+
+    code = (
+        "import sys, server; "
+        "print('loaded:' + ','.join(m for m in ('yt_dlp', 'firebase_admin', 'googleapiclient', 'openai', "
+        "'youtube_transcript_api') if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().splitlines()[-1] == 'loaded:'
+
 def test_firebase_credentials_path():
     """Test Firebase credentials file path"""
     service_account_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS', './serviceAccountKey.json')
     # In CI, file might not exist but path should be set
     assert service_account_path is not None
 
+
+class FakeCompletions:
+    """Stand-in for openai_client.chat.completions that answers by response schema"""
+    def __init__(self, facts, verdict='supported'):
+        self.facts = facts
+        self.verdict = verdict
+        self.calls = []
+
+    def create(self, **kwargs):
+        import json
+        from types import SimpleNamespace
+
+        self.calls.append(kwargs)
+        name = kwargs.get('response_format', {}).get('json_schema', {}).get('name')
+        if name == 'facts_extraction':
+            content = {'facts': self.facts}
+        elif name == 'thesis_extraction':
+            content = {'thesis': 'The video thesis', 'importance': 'high'}
+        else:
+            content = {'verdict': self.verdict, 'reasoning': 'Because', 'confidence': 90}
+        message = SimpleNamespace(content=json.dumps(content))
+        usage = SimpleNamespace(prompt_tokens=1, completion_tokens=1, total_tokens=2)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def fake_openai_client(facts, verdict='supported'):
+    from types import SimpleNamespace
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(facts, verdict)))
+
+
+@pytest.fixture
+def isolated_caches(tmp_path, monkeypatch):
+    """Point the analysis, transcript, facts, verdict and metadata caches at a temporary file"""
+    import server
+    path = str(tmp_path / 'cache.db')
+    for name, table in (('analysis_cache', 'analysis_results'), ('transcript_cache', 'transcripts'),
+                        ('facts_cache', 'extracted_facts'), ('verdict_cache', 'verdicts'),
+                        ('metadata_cache', 'video_metadata')):
+        monkeypatch.setattr(server, name, server.SQLiteCache(path, table))
+    return server
+
+
+def test_run_analysis_pipeline(monkeypatch, isolated_caches):
+    """The pipeline grades sampled facts with the thesis weight applied"""
+    import server
+
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': ['x']} for i in range(10)]
+    fake = fake_openai_client(facts)
+    monkeypatch.setattr(server, 'openai_client', fake)
+    monkeypatch.setattr(server, 'fetch_transcript_for_analysis', lambda video_id, deadline=None, skipped=None: (
+        {'full': 'transcript text', 'title': 'A video'}, 'rapidapi'
+    ))
+    monkeypatch.setattr(server, 'search_brave', lambda query, count=3, deadline=None: {
+        'web': {'results': [{'title': 'Result', 'url': 'https://example.com', 'description': 'd'}]}
+    })
+
+    result = server.run_analysis('abc123', 'sample')
+    assert result['grade'] == 'A' and result['score'] == 100
+    assert result['totalFacts'] == 10 and result['sampledFacts'] == 7
+    assert len(result['verifiedFacts']) == 7
+    assert result['centralThesis']['verification']['verdict'] == 'supported'
+    assert result['videoTitle'] == 'A video'
+
+    # Upgrading to full reuses the thesis and the 7 sampled verdicts, verifying only the other 3 facts
+    sample_calls = len(fake.chat.completions.calls)
+    result = server.run_analysis('abc123', 'full')
+    assert len(result['verifiedFacts']) == 10
+    assert result['degraded'] is False
+    upgrade_calls = fake.chat.completions.calls[sample_calls:]
+    assert [call['response_format']['json_schema']['name'] for call in upgrade_calls] == ['verification'] * 3
+
+
+def test_model_cascade_escalates_unsure_verdicts(monkeypatch, isolated_caches):
+    """Only unsure fast-model verdicts are re-asked of the strong model; extraction follows length"""
+    import json
+    import server
+
+    fake = fake_openai_client([])
+    answers = {'gpt-5-nano': {'verdict': 'supported', 'reasoning': 'Maybe', 'confidence': 40}}
+    original_create = fake.chat.completions.create
+
+    def create(**kwargs):
+        response = original_create(**kwargs)
+        if kwargs['model'] in answers:
+            response.choices[0].message.content = json.dumps(answers[kwargs['model']])
+        return response
+
+    fake.chat.completions.create = create
+    monkeypatch.setattr(server, 'openai_client', fake)
+    monkeypatch.setitem(server.MODEL_ROUTES, 'analyze', ('gpt-5-nano', 'gpt-5-mini'))
+
+    def cascade_total(outcome):
+        return server.metrics.total('truthquest_model_cascade_total', endpoint='analyze', outcome=outcome)
+
+    before = {outcome: cascade_total(outcome) for outcome in ('accepted', 'low_confidence', 'conflicting_evidence')}
+    request = server.verdict_request('A claim', [])
+
+    result = server.cascaded_verdict('analyze', request)
+    assert result['confidence'] == 90
+    assert [call['model'] for call in fake.chat.completions.calls] == ['gpt-5-nano', 'gpt-5-mini']
+
+    answers['gpt-5-nano'] = {'verdict': 'refuted', 'reasoning': 'Clear', 'confidence': 95}
+    assert server.cascaded_verdict('analyze', request)['verdict'] == 'refuted'
+    answers['gpt-5-nano'] = {'verdict': 'refuted', 'reasoning': 'Mixed', 'confidence': 95, 'conflicting_evidence': True}
+    server.cascaded_verdict('analyze', request)
+    assert [call['model'] for call in fake.chat.completions.calls][2:] == ['gpt-5-nano', 'gpt-5-nano', 'gpt-5-mini']
+    assert {outcome: cascade_total(outcome) - count for outcome, count in before.items()} == {
+        'accepted': 1, 'low_confidence': 1, 'conflicting_evidence': 1}
+
+    # In an analysis, escalated verdicts finish after the loop but keep their facts' places
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': ['x']} for i in range(3)]
+    fake.chat.completions.facts = facts
+    answers['gpt-5-nano'] = {'verdict': 'refuted', 'reasoning': 'Maybe', 'confidence': 20}
+    monkeypatch.setattr(server, 'fetch_transcript_for_analysis', lambda video_id, deadline=None, skipped=None: (
+        {'full': 'transcript text', 'title': 'A video'}, 'rapidapi'
+    ))
+    monkeypatch.setattr(server, 'search_brave', lambda query, count=3, deadline=None: {'web': {'results': []}})
+    result = server.run_analysis('abc123', 'sample')
+    assert [fact['claim'] for fact in result['verifiedFacts']] == ['Claim 0', 'Claim 1', 'Claim 2']
+    assert [fact['verification']['verdict'] for fact in result['verifiedFacts']] == ['supported'] * 3
+
+    # A single-model route never escalates
+    calls = len(fake.chat.completions.calls)
+    monkeypatch.setitem(server.MODEL_ROUTES, 'analyze', ('gpt-5-nano',))
+    answers['gpt-5-nano']['confidence'] = 10
+    assert server.cascaded_verdict('analyze', request)['confidence'] == 10
+    assert len(fake.chat.completions.calls) == calls + 1
+
+    assert server.facts_extraction_request('short')['model'] == server.EXTRACTION_MODEL_SHORT
+    long_text = 'x' * (server.EXTRACTION_LONG_TRANSCRIPT_CHARS + 1)
+    assert server.facts_extraction_request(long_text)['model'] == server.EXTRACTION_MODEL_LONG
+
+
+def test_analysis_degrades_near_deadline(monkeypatch, isolated_caches):
+    """Short on time, the pipeline checks fewer facts or only the thesis and says so"""
+    import server
+
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': ['x']} for i in range(10)]
+    monkeypatch.setattr(server, 'openai_client', fake_openai_client(facts))
+    monkeypatch.setattr(server, 'fetch_transcript_for_analysis', lambda video_id, deadline=None, skipped=None: (
+        {'full': 'transcript text'}, 'rapidapi'
+    ))
+    monkeypatch.setattr(server, 'search_brave', lambda query, count=3, deadline=None: {'web': {'results': []}})
+
+    result = server.run_analysis('abc123', 'full', server.Deadline(30))
+    assert result['degraded'] and result['degradedReasons'] == ['thesis_only']
+    assert result['sampledFacts'] == 0 and result['score'] == 100
+
+    monkeypatch.setattr(server, 'FACT_VERIFY_ESTIMATE_SECONDS', 20)
+    result = server.run_analysis('abc123', 'full', server.Deadline(60))
+    assert result['degradedReasons'] == ['sample_reduced']
+    assert result['sampledFacts'] == 2 and len(result['verifiedFacts']) == 2
+
+    assert server.store_analysis('abc123', 'full', result) is result
+
+    deadline = server.Deadline(0)
+    with pytest.raises(server.DeadlineExceeded):
+        deadline.timeout(10)
+
+
+def test_asgi_async_analysis_and_flask_fallback(monkeypatch, isolated_caches):
+    """The ASGI app runs /api/analyze natively and serves other routes through Flask"""
+    import asyncio
+    import httpx
+    import server
+    import asgi
+
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': []} for i in range(3)]
+    fake = fake_openai_client(facts)
+
+    async def fake_create(**kwargs):
+        return fake.chat.completions.create(**kwargs)
+
+    async def fake_search(query, count=3, deadline=None):
+        return {'web': {'results': [{'title': 'Result', 'url': 'https://example.com'}]}}
+
+    monkeypatch.setattr(asgi, 'async_openai_client', fake)
+    monkeypatch.setattr(asgi, 'chat', lambda operation, request_kwargs, deadline=None: fake_create(**request_kwargs))
+    monkeypatch.setattr(asgi, 'search_brave_async', fake_search)
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+    monkeypatch.setattr(server, 'reserve_usage', lambda uid: (True, None, None))
+    monkeypatch.setattr(server, 'get_cached_analysis', lambda video_id, mode: None)
+    monkeypatch.setattr(server, 'store_analysis', lambda video_id, mode, result: result)
+    monkeypatch.setattr(server, 'fetch_transcript_for_analysis', lambda video_id, deadline=None, skipped=None: ({'full': 'text'}, 'rapidapi'))
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            analysis = await client.post(
+                '/api/analyze', json={'youtubeUrl': 'https://youtu.be/abc123'},
+                headers={'Authorization': 'Bearer token'}
+            )
+            unauthorized = await client.post('/api/analyze', json={})
+            fallback = await client.post('/api/extract-facts', json={})
+            projected = await client.post(
+                '/api/analyze?fields=grade,verifiedFacts.claim', json={'youtubeUrl': 'https://youtu.be/abc123'},
+                headers={'Authorization': 'Bearer token', 'Accept-Encoding': 'gzip'}
+            )
+        return analysis, unauthorized, fallback, projected
+
+    analysis, unauthorized, fallback, projected = asyncio.run(run())
+    assert analysis.status_code == 200
+    assert analysis.json()['grade'] == 'A' and len(analysis.json()['verifiedFacts']) == 3
+    assert projected.json() == {'grade': 'A', 'verifiedFacts': [{'claim': f'Claim {i}'} for i in range(3)]}
+    assert unauthorized.status_code == 401
+    assert fallback.status_code in (400, 500) and 'error' in fallback.json()
+
+
+def test_asgi_thesis_deadline_bad_body_and_disconnect(monkeypatch, isolated_caches):
+    """The ASGI app reports a timed-out thesis as unverified, rejects non-object bodies and refunds on disconnect"""
+    import asyncio
+    import httpx
+    import server
+    import asgi
+
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': []} for i in range(2)]
+    fake = fake_openai_client(facts)
+    hang = {'analysis': False}
+
+    async def fake_chat(operation, request_kwargs, deadline=None):
+        if hang['analysis']:
+            await asyncio.sleep(60)
+        if operation == 'thesis':
+            raise server.DeadlineExceeded('deadline reached')
+        return fake.chat.completions.create(**request_kwargs)
+
+    async def fake_search(query, count=3, deadline=None):
+        return {'web': {'results': [{'title': 'Result', 'url': 'https://example.com'}]}}
+
+    refunds = []
+    monkeypatch.setattr(asgi, 'async_openai_client', fake)
+    monkeypatch.setattr(asgi, 'chat', fake_chat)
+    monkeypatch.setattr(asgi, 'search_brave_async', fake_search)
+    monkeypatch.setattr(server, 'BRAVE_API_KEY', 'test')
+    monkeypatch.setattr(server.Deadline, 'expired', lambda self: True)
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+    monkeypatch.setattr(server, 'reserve_usage', lambda uid: (True, None, 'reservation'))
+    monkeypatch.setattr(server, 'refund_usage', lambda uid, reservation: refunds.append(reservation))
+    monkeypatch.setattr(server, 'get_cached_analysis', lambda video_id, mode: None)
+    monkeypatch.setattr(server, 'store_analysis', lambda video_id, mode, result: result)
+    monkeypatch.setattr(server, 'fetch_transcript_for_analysis', lambda video_id, deadline=None, skipped=None: ({'full': 'text'}, 'rapidapi'))
+
+    async def disconnecting_request():
+        sent = []
+        messages = [{'type': 'http.request', 'body': b'{"youtubeUrl": "https://youtu.be/abc123"}'}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.sleep(0.1)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/analyze', 'query_string': b'',
+                 'headers': [(b'authorization', b'Bearer token')]}
+        await asyncio.wait_for(asgi.app(scope, receive, send), 5)
+        return sent
+
+    async def run():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            analysis = await client.post(
+                '/api/analyze', json={'youtubeUrl': 'https://youtu.be/abc123'},
+                headers={'Authorization': 'Bearer token'}
+            )
+            bad_body = await client.post('/api/verify-facts', json=['not', 'an', 'object'])
+        hang['analysis'] = True
+        return analysis, bad_body, await disconnecting_request()
+
+    analysis, bad_body, sent = asyncio.run(run())
+    assert analysis.status_code == 200
+    assert analysis.json()['centralThesis']['verification']['verdict'] == 'unverified'
+    assert 'thesis_unverified' in analysis.json()['degradedReasons']
+    assert len(analysis.json()['verifiedFacts']) == 2
+    assert bad_body.status_code == 400
+    assert sent == [] and refunds == ['reservation']
+
+
+def test_response_projection_and_compression(monkeypatch):
+    """fields= trims responses and large JSON bodies are compressed as the client allows"""
+    import gzip
+    import json
+    import server
+
+    payload = {'grade': 'B', 'transcript': {'full': 'text', 'segments': [{'text': 't', 'start': 0}]},
+               'verifiedFacts': [{'claim': 'c', 'verification': {'verdict': 'supported', 'reasoning': 'r'}}]}
+    assert server.project_fields(payload, '-transcript.segments,-verifiedFacts.verification.reasoning') == {
+        'grade': 'B', 'transcript': {'full': 'text'},
+        'verifiedFacts': [{'claim': 'c', 'verification': {'verdict': 'supported'}}]
+    }
+    assert server.project_fields(payload, 'grade,verifiedFacts,verifiedFacts.claim') == {
+        'grade': 'B', 'verifiedFacts': payload['verifiedFacts']
+    }
+    assert server.negotiate_encoding('deflate, gzip;q=0') is None
+    assert server.negotiate_encoding('gzip, deflate') == 'gzip'
+
+    monkeypatch.setattr(server, 'openai_client', object())
+    monkeypatch.setattr(server, 'BRAVE_API_KEY', 'test')
+    monkeypatch.setattr(server, 'verify_fact_with_search', lambda fact: {
+        **fact, 'verification': {'verdict': 'supported', 'reasoning': 'Long reasoning. ' * 40}
+    })
+    client = server.app.test_client()
+    facts = {'facts': [{'claim': f'Claim {i}'} for i in range(10)]}
+
+    response = client.post('/api/verify-facts', json=facts, headers={'Accept-Encoding': 'gzip, br;q=0'})
+    assert response.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response.headers['Vary']
+    body = json.loads(gzip.decompress(response.get_data()))
+    assert len(body['verifiedFacts']) == 10 and body['summary']['supported'] == 10
+
+    response = client.post('/api/verify-facts?fields=-verifiedFacts.verification.reasoning', json=facts)
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['verifiedFacts'][0] == {'claim': 'Claim 0', 'verification': {'verdict': 'supported'}}
+
+
+def test_admission_control(monkeypatch):
+    """Priority and fair-share admission, load shedding with Retry-After, and full-to-sample downgrade"""
+    import server
+
+    controller = server.AdmissionController(max_active=1, max_active_per_user=1, max_queue=2)
+    running = controller.enter('a', server.ADMISSION_PRIORITIES['sample'])
+    full = controller.enter('b', server.ADMISSION_PRIORITIES['full'])
+    sample = controller.enter('c', server.ADMISSION_PRIORITIES['sample'])
+    assert running.admitted.is_set() and not full.admitted.is_set()
+    with pytest.raises(server.AdmissionRejected) as rejected:
+        controller.enter('d', server.ADMISSION_PRIORITIES['full'])  # The newest of the least urgent
+    assert rejected.value.retry_after >= 1
+
+    controller.release(running)
+    assert sample.admitted.is_set() and not full.admitted.is_set()  # Sample jumps the full check
+    with pytest.raises(server.AdmissionRejected):
+        controller.settle(full)
+    controller.release(sample)
+
+    # A full queue evicts its least urgent, newest ticket for a more urgent newcomer
+    controller = server.AdmissionController(max_active=1, max_active_per_user=1, max_queue=2)
+    running = controller.enter('a', server.ADMISSION_PRIORITIES['full'])
+    batch_old = controller.enter('batch', server.ADMISSION_PRIORITIES['batch'])
+    batch_new = controller.enter('batch', server.ADMISSION_PRIORITIES['batch'])
+    evicted = []
+    controller.on_decided(batch_new, lambda: evicted.append(batch_new))
+    sample = controller.enter('c', server.ADMISSION_PRIORITIES['sample'])
+    assert evicted == [batch_new] and batch_new.decided.is_set() and not batch_new.admitted.is_set()
+    with pytest.raises(server.AdmissionRejected):
+        controller.settle(batch_new)
+    with pytest.raises(server.AdmissionRejected):
+        controller.enter('batch', server.ADMISSION_PRIORITIES['batch'])  # Nothing waiting is less urgent
+    assert controller.queue_depth() == 2 and controller.queue_depth(server.ADMISSION_PRIORITIES['full']) == 1
+    controller.release(running)
+    assert sample.admitted.is_set() and not batch_old.admitted.is_set()
+
+    # A user at their limit waits while other users' later requests run
+    controller = server.AdmissionController(max_active=2, max_active_per_user=1, max_queue=4)
+    first, second, other = controller.enter('a', 0), controller.enter('a', 0), controller.enter('b', 0)
+    assert first.admitted.is_set() and other.admitted.is_set() and not second.admitted.is_set()
+
+    # Unset, the running limit follows a gunicorn worker's threads
+    monkeypatch.setattr(server, 'ADMISSION_MAX_ACTIVE', 0)
+    assert server.admission_limit(32) == 24 and server.admission_limit(1) == 1
+    assert server.admission_limit() == server.ADMISSION_DEFAULT_MAX_ACTIVE
+    monkeypatch.setattr(server, 'ADMISSION_MAX_ACTIVE', 6)
+    assert server.admission_limit(32) == 6
+
+    # Through the route: a full queue sheds with 503, a backed-up one runs full checks as samples
+    monkeypatch.setattr(server, 'admission', server.AdmissionController(max_active=1, max_active_per_user=1,
+                                                                         max_queue=0))
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+    monkeypatch.setattr(server, 'reserve_usage', lambda uid: (True, None, None))
+    monkeypatch.setattr(server, 'get_cached_analysis', lambda video_id, mode: None)
+    monkeypatch.setattr(server, 'store_analysis', lambda video_id, mode, result: result)
+    monkeypatch.setattr(server, 'run_analysis', lambda video_id, mode, deadline=None: {'checkMode': mode})
+    client = server.app.test_client()
+    request = {'json': {'youtubeUrl': 'https://youtu.be/abc123', 'checkMode': 'full'},
+               'headers': {'Authorization': 'Bearer token'}}
+
+    held = server.admission.enter('someone-else', 0)
+    shed = client.post('/api/analyze', **request)
+    assert shed.status_code == 503 and int(shed.headers['Retry-After']) >= 1 and shed.json['overloaded']
+    server.admission.release(held)
+
+    assert client.post('/api/analyze', **request).json == {'checkMode': 'full'}
+    monkeypatch.setattr(server, 'ADMISSION_DOWNGRADE_QUEUE', 1)
+    monkeypatch.setattr(server.admission, 'max_queue', 1)
+    held = server.admission.enter('someone-else', 0)
+    waiting_batch = server.admission.enter('batch', server.ADMISSION_PRIORITIES['batch'])
+    assert server.admission_check_mode('full') == 'full'  # Batch videos alone don't downgrade
+    server.admission.release(held)
+    server.admission.release(waiting_batch)
+    monkeypatch.setattr(server, 'ADMISSION_DOWNGRADE_QUEUE', 0)
+    assert client.post('/api/analyze', **request).json == {'checkMode': 'sample', 'downgradedFrom': 'full'}
+
+
+def test_analysis_cache_stale_while_revalidate(tmp_path, monkeypatch):
+    """Stale analyses are served immediately and refreshed in the background"""
+    import time
+    import server
+
+    monkeypatch.setattr(server, 'analysis_cache', server.SQLiteCache(str(tmp_path / 'cache.db'), 'analysis_results'))
+    assert not (tmp_path / 'cache.db').exists()  # Stores open their file on first use, not when created
+    refreshed = []
+    monkeypatch.setattr(server, 'refresh_analysis_async', lambda video_id, mode: refreshed.append((video_id, mode)))
+
+    assert server.get_cached_analysis('abc123', 'sample') is None
+
+    stored = server.store_analysis('abc123', 'sample', {'success': True, 'grade': 'A'})
+    assert stored['fresh'] is True and stored['cachedAt'].endswith('Z')
+
+    cached = server.get_cached_analysis('abc123', 'sample')
+    assert cached['grade'] == 'A' and cached['fresh'] is True
+    assert refreshed == []
+
+    stale_at = time.time() - server.ANALYSIS_CACHE_FRESH_SECONDS - 1
+    server.analysis_cache.set('abc123:sample', {'success': True, 'grade': 'B'}, created_at=stale_at)
+    cached = server.get_cached_analysis('abc123', 'sample')
+    assert cached['grade'] == 'B' and cached['fresh'] is False
+    assert refreshed == [('abc123', 'sample')]
+    assert server.get_cached_analysis('abc123', 'full') is None
+
+
+def test_stale_refreshes_are_bounded(monkeypatch):
+    """Stale refreshes run on a small pool, once per key, and stop queuing when too many are pending"""
+    import threading
+    import time
+    import server
+
+    release = threading.Event()
+    started = []
+
+    def slow_run_analysis(video_id, check_mode, deadline=None):
+        started.append(video_id)
+        release.wait(5)
+        return {'success': True}
+
+    monkeypatch.setattr(server, 'run_analysis', slow_run_analysis)
+    monkeypatch.setattr(server, 'store_analysis', lambda video_id, mode, result: result)
+    monkeypatch.setattr(server, 'ANALYSIS_REFRESH_MAX_PENDING', 3)
+
+    for video_id in ('video1', 'video1', 'video2', 'video3', 'video4'):
+        server.refresh_analysis_async(video_id, 'sample')
+    assert server._refreshing_analyses == {'video1:sample', 'video2:sample', 'video3:sample'}
+
+    release.set()
+    for _ in range(100):
+        if not server._refreshing_analyses:
+            break
+        time.sleep(0.05)
+    assert sorted(started) == ['video1', 'video2', 'video3'] and not server._refreshing_analyses
+
+
+def test_evidence_index_answers_recurring_claims(tmp_path):
+    """Stored search results are reused for claims they cover, and only those"""
+    import server
+
+    index = server.EvidenceIndex(str(tmp_path / 'evidence.db'))
+    index.add_results('eiffel tower height', [
+        {'title': 'Eiffel Tower height', 'url': 'https://a.example', 'description': 'The Eiffel Tower is 330 metres tall.'},
+        {'title': 'Paris landmarks', 'url': 'https://b.example', 'description': 'The Eiffel Tower height grew with antennas.'},
+    ])
+    # Re-adding a URL replaces the old copy instead of duplicating it
+    index.add_results('eiffel tower', [
+        {'title': 'Eiffel Tower height', 'url': 'https://a.example', 'description': 'The Eiffel Tower is 330 metres tall.'},
+    ])
+
+    results = index.search('The Eiffel Tower height is 330 metres', count=3)
+    assert [r['url'] for r in results].count('https://a.example') == 1
+    assert results[0]['url'] == 'https://a.example'
+    assert index.search('Moon landing happened in 1969', count=3) == []
+
+
+def test_evidence_selection_ranks_passages(monkeypatch):
+    """Verdict prompts carry the best-matching passages within the passage and token limits"""
+    import server
+
+    monkeypatch.setattr(server, 'EVIDENCE_MAX_PASSAGES', 2)
+    results = {'web': {'results': [
+        {'title': 'Travel deals', 'url': 'https://a.example',
+         'description': 'Book cheap flights to Paris this summer with our partners. Hotels near every landmark.'},
+        {'title': 'Eiffel Tower facts', 'url': 'https://b.example',
+         'description': 'Visitors queue for hours at the entrance in July and August. '
+                        'The Eiffel Tower is 330 metres tall since its new antenna was added.',
+         'extra_snippets': ['Gustave Eiffel finished the wrought-iron tower in 1889 for the World Fair.']},
+        {'title': 'Weather today', 'url': 'https://c.example', 'description': 'Sunny with a light breeze.'},
+    ]}}
+    claim = 'The Eiffel Tower is 330 metres tall'
+
+    sources = server.select_evidence(claim, results)
+    assert [source['url'] for source in sources] == ['https://b.example']
+    assert sources[0]['description'] == 'The Eiffel Tower is 330 metres tall since its new antenna was added.'
+
+    # Passages that don't fit the budget are left out; a matching title alone is cheap evidence
+    assert server.select_evidence(claim, results, token_budget=6) == [
+        {'title': 'Eiffel Tower facts', 'url': 'https://b.example', 'description': ''}]
+    assert server.select_evidence(claim, results, token_budget=2) == []
+
+    # Nothing matching the claim falls back to the search engine's order
+    assert [s['url'] for s in server.select_evidence('Moon landing 1969', results)] == ['https://a.example']
+
+    prompt = server.verdict_request(claim, sources)['messages'][0]['content']
+    assert '- Eiffel Tower facts: The Eiffel Tower is 330 metres tall' in prompt and 'flights' not in prompt
+    entry = server.verified_fact_entry({'claim': claim}, {'verdict': 'supported', 'reasoning': 'r'}, sources)
+    assert entry['verification']['sources'] == [{'title': 'Eiffel Tower facts', 'url': 'https://b.example'}]
+
+    # Brave is asked for the extra snippets that the passages are drawn from
+    monkeypatch.setattr(server, 'BRAVE_API_KEY', 'test')
+    assert server.prepare_brave_search(claim, server.EVIDENCE_SEARCH_COUNT)[2]['extra_snippets'] == 'true'
+
+
+def test_verify_facts_stream_ndjson(monkeypatch):
+    """NDJSON batches are verified for signed-in users and streamed line by line"""
+    import json
+    import server
+
+    monkeypatch.setattr(server, 'openai_client', object())
+    monkeypatch.setattr(server, 'BRAVE_API_KEY', 'test')
+    monkeypatch.setattr(server, 'verify_fact_with_search', lambda fact: {
+        **fact, 'verification': {'verdict': 'supported' if int(fact['claim']) % 2 else 'refuted'}
+    })
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+    reservations, refunds = [], []
+    monkeypatch.setattr(server, 'reserve_usage', lambda uid: (reservations.append(uid) or True, None, 'reservation'))
+    monkeypatch.setattr(server, 'refund_usage', lambda uid, reservation: refunds.append(uid))
+    client = server.app.test_client()
+    auth = {'Authorization': 'Bearer token'}
+
+    assert client.post('/api/verify-facts/stream', json={'facts': [{'claim': '1'}]}).status_code == 401
+
+    body = ''.join(json.dumps({'claim': str(i)}) + '\n' for i in range(25))
+    response = client.post('/api/verify-facts/stream', data=body, content_type='application/x-ndjson', headers=auth)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.mimetype == 'application/x-ndjson'
+    results = [line for line in lines if line['type'] == 'result']
+    assert sorted(line['factIndex'] for line in results) == list(range(25))
+    assert lines[-1]['type'] == 'summary'
+    assert lines[-1]['summary'] == {'totalFacts': 25, 'supported': 12, 'refuted': 13, 'partiallyTrue': 0, 'score': 48.0}
+
+    # JSON bodies are validated before the stream starts, and rejected requests are refunded
+    monkeypatch.setattr(server, 'VERIFY_STREAM_MAX_FACTS', 3)
+    too_many = json.dumps({'facts': [{'claim': str(i)} for i in range(4)]})
+    for data, content_type, status in (('claim', 'text/plain', 415), ('{"facts": [', 'application/json', 400),
+                                       ('{"facts": 5}', 'application/json', 400),
+                                       ('{"facts": {"a": 1}}', 'application/json', 400),
+                                       ('{"facts": []}', 'application/json', 400),
+                                       (too_many, 'application/json', 400)):
+        response = client.post('/api/verify-facts/stream', data=data, content_type=content_type, headers=auth)
+        assert response.status_code == status and 'error' in response.get_json()
+    assert len(refunds) == 6 and len(reservations) == 7
+
+    response = client.post('/api/verify-facts/stream', json={'facts': [{'claim': '1'}, {'claim': '2'}]}, headers=auth)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[-1]['summary']['totalFacts'] == 2
+
+    # NDJSON bodies stop at the cap
+    response = client.post('/api/verify-facts/stream', data=body, content_type='application/x-ndjson', headers=auth)
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['type'] for line in lines[:-1]) == ['error'] + ['result'] * 3
+    assert lines[-1]['summary']['totalFacts'] == 3
+
+
+def test_analyze_batch_streams_results(monkeypatch):
+    """A playlist is listed once, its videos analyzed concurrently and streamed with a summary"""
+    import json
+    import server
+    import media_jobs
+
+    listings = []
+
+    def fake_media_job(func, url, limit, *args, deadline=None, timeout=None):
+        assert func is media_jobs.list_videos
+        listings.append((url, limit))
+        return [{'videoId': f'video{i:06d}', 'title': f'Video {i}'} for i in [0, 1, 2, 3, 1, 4]]
+
+    def fake_analysis(video_id, check_mode, deadline=None):
+        if video_id == 'video000003':
+            raise server.AnalysisError({'error': 'Could not fetch transcript from any source'}, 500)
+        if video_id == 'video000004':
+            return server.no_facts_payload(check_mode)
+        return {'success': True, 'videoId': video_id, 'grade': 'A' if video_id == 'video000000' else 'C',
+                'score': 90.0 if video_id == 'video000000' else 50.0, 'degraded': False}
+
+    refunds = []
+    monkeypatch.setattr(server, 'run_media_job', fake_media_job)
+    monkeypatch.setattr(server, 'run_analysis', fake_analysis)
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+    monkeypatch.setattr(server, 'reserve_usage', lambda uid: (True, None, 'reservation'))
+    monkeypatch.setattr(server, 'refund_usage', lambda uid, reservation: refunds.append(uid))
+    monkeypatch.setattr(server, 'get_cached_analysis', lambda video_id, mode: (
+        {'success': True, 'videoId': video_id, 'grade': 'C', 'score': 50.0} if video_id == 'video000002' else None
+    ))
+    monkeypatch.setattr(server, 'store_analysis', lambda video_id, mode, result: result)
+
+    client = server.app.test_client()
+    response = client.post('/api/analyze-batch', json={'url': 'https://www.youtube.com/@newsroom', 'limit': 10},
+                           headers={'Authorization': 'Bearer token'})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert listings == [('https://www.youtube.com/@newsroom/videos', 10)]
+    assert lines[0]['type'] == 'batch' and lines[0]['totalVideos'] == 5
+    assert sorted(line['index'] for line in lines[1:-1]) == [0, 1, 2, 3, 4]
+    assert [line['videoId'] for line in lines[1:-1] if line['type'] == 'error'] == ['video000003']
+    assert refunds == ['user-1']
+    assert lines[-1]['summary'] == {'totalVideos': 5, 'analyzed': 3, 'cached': 1, 'degraded': 0, 'failed': 1,
+                                    'skipped': 0, 'grades': {'A': 1, 'B': 0, 'C': 2, 'D': 0, 'N/A': 1},
+                                    'averageScore': 63.3, 'limitExceeded': False}
+
+    response = client.post('/api/analyze-batch', json={'videoIds': ['not-an-id']},
+                           headers={'Authorization': 'Bearer token'})
+    assert response.status_code == 400
+
+
+def test_warm_cache_resumes_and_fills_caches(tmp_path, monkeypatch, capsys, isolated_caches):
+    """The warming job fills every cache once, records progress, and skips finished videos on rerun"""
+    import json
+    import server
+    import warm_cache
+
+    facts = [{'claim': f'Claim {i}', 'category': 'statistic', 'entities': ['x']} for i in range(3)]
+    fake = fake_openai_client(facts)
+    fetched = []
+
+    def fake_rapidapi(video_id, deadline=None):
+        fetched.append(video_id)
+        if video_id == 'badvideo000':
+            raise Exception('No captions')
+        return {'full': f'transcript of {video_id}', 'method': 'rapidapi'}
+
+    monkeypatch.setattr(server, 'openai_client', fake)
+    monkeypatch.setattr(server, 'RAPIDAPI_KEY', 'fake')
+    monkeypatch.setattr(server, 'fetch_transcript_rapidapi', fake_rapidapi)
+    monkeypatch.setattr(server, 'probe_video', lambda video_id, deadline=None, abandoned=None: None)
+    monkeypatch.setattr(server, 'fetch_transcript_ytdlp',
+                        lambda video_id, deadline=None: (_ for _ in ()).throw(Exception('off')))
+    monkeypatch.setattr(server, 'transcription_available', lambda: False)
+    monkeypatch.setattr(server, 'search_brave', lambda query, count=3, deadline=None: {'web': {'results': []}})
+    monkeypatch.setitem(sys.modules, 'youtube_transcript_api', None)  # That tier fails on import
+
+    source = tmp_path / 'ids.txt'
+    source.write_text('# trending\nvideo000001\nhttps://youtu.be/video000002\nbadvideo000\nvideo000001\n')
+    state = tmp_path / 'state.json'
+
+    def run(*extra):
+        monkeypatch.setattr(sys, 'argv', ['warm_cache.py', str(source), '--state', str(state), *extra])
+        with pytest.raises(SystemExit) as exit_info:
+            warm_cache.main()
+        return exit_info.value.code
+
+    assert run() == 1  # badvideo000 failed
+    videos = json.loads(state.read_text())['videos']
+    assert videos['video000001']['status'] == 'done' and videos['video000001']['analysis'].startswith('computed')
+    assert videos['badvideo000']['status'] == 'failed'
+    assert server.get_cached_transcript('video000002')[0]['full'] == 'transcript of video000002'
+    assert server.analysis_cache_age('video000002', 'sample') is not None
+    extractions = [call for call in fake.chat.completions.calls
+                   if call['response_format']['json_schema']['name'] == 'facts_extraction']
+    assert len(extractions) == 2  # The analysis reused the facts warmed before it
+
+    fetched.clear()
+    assert run() == 1
+    assert fetched == ['badvideo000']  # Finished videos are skipped, failures retried
+
+    assert run('--force', '--stages', 'transcript', '--max-openai-calls', '0') == 0
+    assert 'not started 3 (provider budget reached)' in capsys.readouterr().out
+
+
+def test_usage_reservation_counts():
+    """Reservations reset counters on period change and stop at the limits"""
+    import server
+
+    allowed, message, counts = server.apply_usage_reservation(None, '2026-01-02', '2026-01')
+    assert allowed and message is None
+    assert counts == {'last_used_date': '2026-01-02', 'daily_count': 1, 'current_month': '2026-01', 'monthly_count': 1}
+
+    yesterday = {'last_used_date': '2026-01-01', 'daily_count': server.DAILY_LIMIT, 'current_month': '2026-01', 'monthly_count': 10}
+    allowed, _, counts = server.apply_usage_reservation(yesterday, '2026-01-02', '2026-01')
+    assert allowed and counts['daily_count'] == 1 and counts['monthly_count'] == 11
+
+    today = {**yesterday, 'last_used_date': '2026-01-02'}
+    allowed, message, counts = server.apply_usage_reservation(today, '2026-01-02', '2026-01')
+    assert not allowed and 'Daily limit' in message and counts is None
+
+    month_full = {'last_used_date': '2026-01-01', 'daily_count': 0, 'current_month': '2026-01', 'monthly_count': server.MONTHLY_LIMIT}
+    allowed, message, _ = server.apply_usage_reservation(month_full, '2026-01-02', '2026-01')
+    assert not allowed and 'Monthly limit' in message
+
+
+def test_verified_token_cache(monkeypatch):
+    """Tokens are verified once until they expire, and the cache stays bounded"""
+    import time
+    import server
+
+    calls = []
+    def fake_verify(token):
+        calls.append(token)
+        exp = time.time() - 1 if token.startswith('expired') else time.time() + 3600
+        return {'uid': token, 'exp': exp}
+
+    monkeypatch.setattr(server, '_verify_id_token_uncached', fake_verify)
+    monkeypatch.setattr(server, '_token_cache', server.OrderedDict())
+    monkeypatch.setattr(server, 'TOKEN_CACHE_MAX_ENTRIES', 2)
+
+    assert server.verify_id_token_cached('a')['uid'] == 'a'
+    assert server.verify_id_token_cached('a')['uid'] == 'a'
+    assert calls == ['a']
+
+    server.verify_id_token_cached('expired')
+    server.verify_id_token_cached('expired')
+    assert calls == ['a', 'expired', 'expired']
+
+    server.verify_id_token_cached('b')
+    assert len(server._token_cache) == 2
+    assert 'a' not in [v[0]['uid'] for v in server._token_cache.values()]
+
+
+def test_local_quota_engine(tmp_path, monkeypatch):
+    """The local quota engine enforces limits and refunds without Firestore"""
+    import server
+
+    monkeypatch.setattr(server, 'db', None)
+    engine = server.QuotaEngine(str(tmp_path / 'quota.db'))
+
+    reservations = [engine.reserve('user-1') for _ in range(server.DAILY_LIMIT)]
+    assert all(allowed for allowed, _, _ in reservations)
+    allowed, message, _ = engine.reserve('user-1')
+    assert not allowed and 'Daily limit' in message
+    assert engine.get_counts('user-1') == (server.DAILY_LIMIT, server.DAILY_LIMIT)
+
+    engine.refund('user-1', reservations[-1][2])
+    assert engine.get_counts('user-1') == (server.DAILY_LIMIT - 1, server.DAILY_LIMIT - 1)
+    assert engine.reserve('user-1')[0]
+    assert engine.get_counts('user-2') == (0, 0)
+
+
+def test_quota_reconcile_once_keeps_unflushed_counts(tmp_path, monkeypatch):
+    """Only one worker reconciles, and re-seeding keeps unflushed local counts (e.g. a refund) over Firestore's"""
+    import server
+
+    documents = {}
+
+    class FakeDocument:
+        def __init__(self, uid):
+            self.uid = uid
+            self.exists = uid in documents
+
+        def get(self):
+            return FakeDocument(self.uid)
+
+        def to_dict(self):
+            return dict(documents[self.uid])
+
+    class FakeBatch:
+        def set(self, ref, data, merge=False):
+            documents[ref.uid] = {k: v for k, v in data.items() if k != 'last_used_at'}
+
+        def commit(self):
+            pass
+
+    class FakeFirestore:
+        def collection(self, name):
+            return self
+
+        def document(self, uid):
+            return FakeDocument(uid)
+
+        def batch(self):
+            return FakeBatch()
+
+    monkeypatch.setattr(server, '_firebase_initialized', True)
+    monkeypatch.setattr(server, 'db', FakeFirestore())
+    path = str(tmp_path / 'quota.db')
+    engine, other_worker = server.QuotaEngine(path), server.QuotaEngine(path)
+
+    _, _, reservation = engine.reserve('user-1')
+    engine.reserve('user-1')
+    engine.flush()
+    assert documents['user-1']['daily_count'] == 2
+
+    engine.refund('user-1', reservation)  # Not flushed yet
+    assert engine.reconcile()
+    assert not other_worker.reconcile()
+    assert engine.get_counts('user-1') == (1, 1) and documents['user-1']['daily_count'] == 1
+
+    # Once flushed, Firestore has the latest counts (another host may have used some)
+    documents['user-1']['daily_count'] = documents['user-1']['monthly_count'] = 3
+    engine._connect().execute('UPDATE quota_usage SET seeded = 0')
+    engine._connect().commit()
+    assert engine.get_counts('user-1') == (3, 3)
+
+    # Unflushed local changes win over Firestore
+    engine.refund('user-1', reservation)
+    engine._connect().execute('UPDATE quota_usage SET seeded = 0')
+    engine._connect().commit()
+    assert engine.get_counts('user-1') == (2, 2)
+
+
+def test_usage_cache_and_etag(tmp_path, monkeypatch):
+    """/api/usage reads the quota store once per change and answers a matching ETag with 304"""
+    import server
+
+    monkeypatch.setattr(server, 'db', None)
+    monkeypatch.setattr(server, 'USAGE_ACCOUNTING', 'local')
+    monkeypatch.setattr(server, 'quota_engine', server.QuotaEngine(str(tmp_path / 'quota.db')))
+    monkeypatch.setattr(server, '_usage_cache', server.OrderedDict())
+    monkeypatch.setattr(server, 'start_quota_flusher', lambda: None)
+    monkeypatch.setattr(server, 'verify_id_token_cached', lambda token: {'uid': 'user-1', 'exp': 0})
+
+    reads = []
+    get_counts = server.quota_engine.get_counts
+    monkeypatch.setattr(server.quota_engine, 'get_counts', lambda uid: reads.append(uid) or get_counts(uid))
+
+    client = server.app.test_client()
+    headers = {'Authorization': 'Bearer token'}
+    first = client.get('/api/usage', headers=headers)
+    assert first.status_code == 200 and first.json['dailyCount'] == 0 and first.headers['ETag']
+
+    etag = first.headers['ETag']
+    unchanged = client.get('/api/usage', headers={**headers, 'If-None-Match': etag})
+    assert unchanged.status_code == 304 and unchanged.data == b''
+    assert reads == ['user-1']
+
+    # A reservation bumps the counters' version, which is the ETag
+    assert server.reserve_usage('user-1')[0]
+    changed = client.get('/api/usage', headers={**headers, 'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.json['dailyCount'] == 1
+    assert changed.headers['ETag'] != etag and len(reads) == 2
+
+    # Another worker's reservation (same quota file, no invalidation here) shows up at once
+    other_worker = server.QuotaEngine(str(tmp_path / 'quota.db'))
+    assert other_worker.reserve('user-1')[0]
+    seen = client.get('/api/usage', headers={**headers, 'If-None-Match': changed.headers['ETag']})
+    assert seen.status_code == 200 and seen.json['dailyCount'] == 2
+    assert client.get('/api/usage', headers={**headers, 'If-None-Match': seen.headers['ETag']}).status_code == 304
+
+
+def test_metrics_endpoint(tmp_path, monkeypatch):
+    """Stage histograms and provider counters are exposed in Prometheus text format"""
+    import server
+
+    registry = server.MetricsRegistry()
+    registry.histogram('truthquest_pipeline_stage_seconds', 'stage', buckets=(0.5, 1))
+    registry.counter('truthquest_provider_errors_total', 'errors')
+    monkeypatch.setattr(server, 'metrics', registry)
+    monkeypatch.setattr(server, 'METRICS_TOKEN', 'secret')
+
+    registry.observe('truthquest_pipeline_stage_seconds', 0.7, {'stage': 'transcript'})
+    with pytest.raises(RuntimeError):
+        with registry.timer('truthquest_pipeline_stage_seconds', {'stage': 'verification'},
+                            errors='truthquest_provider_errors_total'):
+            raise RuntimeError('boom')
+
+    client = server.app.test_client()
+    assert client.get('/api/metrics').status_code == 401
+    response = client.get('/api/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    body = response.get_data(as_text=True)
+    assert 'truthquest_pipeline_stage_seconds_bucket{stage="transcript",le="0.5"} 0' in body
+    assert 'truthquest_pipeline_stage_seconds_bucket{stage="transcript",le="1"} 1' in body
+    assert 'truthquest_pipeline_stage_seconds_count{stage="verification"} 1' in body
+    assert 'truthquest_provider_errors_total{stage="verification"} 1' in body
+
+    # With a shared directory, a scrape sums every worker's snapshot, whichever worker serves it
+    other_worker = server.MetricsRegistry()
+    other_worker.histogram('truthquest_pipeline_stage_seconds', 'stage', buckets=(0.5, 1))
+    other_worker.observe('truthquest_pipeline_stage_seconds', 0.2, {'stage': 'transcript'})
+    other_worker.inc('truthquest_provider_errors_total', {'stage': 'verification'}, 2)
+    other_worker.write_snapshot(str(tmp_path))
+    monkeypatch.setattr(server, 'METRICS_DIR', str(tmp_path))
+    body = client.get('/api/metrics', headers={'Authorization': 'Bearer secret'}).get_data(as_text=True)
+    assert 'truthquest_pipeline_stage_seconds_bucket{stage="transcript",le="0.5"} 1' in body
+    assert 'truthquest_pipeline_stage_seconds_count{stage="transcript"} 2' in body
+    assert 'truthquest_provider_errors_total{stage="verification"} 3' in body
+
+    # Without a token the endpoint is off
+    monkeypatch.setattr(server, 'METRICS_TOKEN', None)
+    assert client.get('/api/metrics').status_code == 403
+
+
+def test_structured_logging(monkeypatch):
+    """Log records carry the request ID, render as JSON and debug lines can be sampled out"""
+    import json
+    import server
+
+    records = server.queue.SimpleQueue()
+    handler = server.PreparedQueueHandler(records)
+    handler.addFilter(server.RequestContextFilter())
+    monkeypatch.setattr(server.log, 'handlers', [handler])
+    monkeypatch.setattr(server.log, 'level', server.logging.DEBUG)
+    monkeypatch.setattr(server, 'LOG_DEBUG_SAMPLE_RATE', 0.0)
+
+    response = server.app.test_client().get('/api/health', headers={'X-Request-ID': 'req-123'})
+    assert response.headers['X-Request-ID'] == 'req-123'
+
+    token = server.request_id_var.set('req-456')
+    try:
+        server.log.debug('sampled out')
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            server.log.exception('Analysis failed', extra={'video_id': 'abc'})
+    finally:
+        server.request_id_var.reset(token)
+
+    entry = json.loads(server.JSONFormatter().format(records.get_nowait()))
+    assert records.empty()
+    assert entry['level'] == 'error' and entry['msg'] == 'Analysis failed'
+    assert entry['request_id'] == 'req-456' and entry['video_id'] == 'abc'
+    assert 'ValueError: boom' in entry['exc']
+
+
+def test_fake_providers_serve_analysis_pipeline(tmp_path, monkeypatch, isolated_caches):
+    """The load-test stand-ins answer every provider call of a full analysis"""
+    import server
+    from openai import OpenAI
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'benchmarks'))
+    from fake_providers import FakeProviderConfig, PROVIDERS, make_emulator_id_token, start_fake_providers
+
+    config = FakeProviderConfig(latency={p: 0 for p in PROVIDERS}, transcript_words=200, facts_per_video=4)
+    httpd, base_url = start_fake_providers(config)
+    try:
+        monkeypatch.setattr(server, 'RAPIDAPI_KEY', 'fake')
+        monkeypatch.setattr(server, 'RAPIDAPI_TRANSCRIPT_URL', f'{base_url}/youtube/transcript')
+        monkeypatch.setattr(server, 'YOUTUBE_API_KEY', 'fake')
+        monkeypatch.setattr(server, 'YOUTUBE_BASE_URL', base_url)
+        monkeypatch.setattr(server, 'BRAVE_API_KEY', 'fake')
+        monkeypatch.setattr(server, 'BRAVE_SEARCH_URL', f'{base_url}/res/v1/web/search')
+        monkeypatch.setattr(server, 'openai_client', OpenAI(api_key='fake', base_url=f'{base_url}/v1'))
+        monkeypatch.setattr(server, 'evidence_index', server.EvidenceIndex(str(tmp_path / 'evidence.db')))
+
+        assert server.fetch_transcript_youtube_api('abcdefghijk')['full'].startswith('abcdefghijk')
+        result = server.run_analysis('abcdefghijk', 'full')
+        assert result['transcriptMethod'] == 'rapidapi'
+        # RapidAPI has no metadata; the shared watch-page probe supplies it
+        assert result['videoTitle'] == 'Fake video abcdefghijk' and result['videoDuration'] == 66
+        assert len(result['verifiedFacts']) == 4
+        assert all(f['verification']['verdict'] != 'error' for f in result['verifiedFacts'])
+        assert make_emulator_id_token('user-1').count('.') == 2
+    finally:
+        httpd.shutdown()
+
+
+def test_transcript_parsers():
+    """Caption parsers shared by the transcript tiers (and benchmarked in benchmarks/bench_parsers.py)"""
+    import server
+    import media_jobs
+
+    page = 'var x = {"captions": {"captionTracks": [{"baseUrl": "https://t/en", "languageCode": "en", ' \
+           '"name": {"runs": [1]}}], "audioTracks": []}};'
+    assert server.find_caption_tracks(page) == [{'baseUrl': 'https://t/en', 'languageCode': 'en', 'name': {'runs': [1]}}]
+    with pytest.raises(Exception):
+        server.find_caption_tracks('<html>no captions</html>')
+    details = server.find_video_details('{"videoDetails": {"title": "T", "lengthSeconds": "61"}, "x": 1}')
+    assert details == {'title': 'T', 'lengthSeconds': '61'}
+    assert server.find_video_details('<html></html>') == {}
+    assert server.find_playability_status('{"playabilityStatus": {"status": "LOGIN_REQUIRED"}}') == 'LOGIN_REQUIRED'
+    assert server.find_playability_status('<html></html>') is None
+
+    # Missing captions are only trusted from a playable page or yt-dlp
+    assert server.captions_absent({'captionsKnown': True, 'captionTracks': []})
+    assert not server.captions_absent({'captionsKnown': False, 'captionTracks': []})
+    assert not server.captions_absent({'captionTracks': []}) and not server.captions_absent(None)
+
+    tracks = [{'languageCode': 'de', 'generated': False}, {'languageCode': 'en', 'generated': True},
+              {'languageCode': 'en-GB', 'generated': False}]
+    assert server.pick_caption_track(tracks)['languageCode'] == 'en-GB'
+    assert server.pick_caption_track(tracks[:2])['languageCode'] == 'en'
+    assert server.pick_caption_track([]) is None
+
+    segments, text = server.parse_timedtext_xml(
+        '<transcript><text start="0.5" dur="2">Hello &amp; welcome</text><text start="3">  </text>'
+        '<text start="4" dur="1.5">again</text></transcript>'
+    )
+    assert text == 'Hello & welcome again'
+    assert segments[1] == {'text': 'again', 'start': 4.0, 'duration': 1.5}
+
+    segments, text = media_jobs.parse_json3_events({'events': [
+        {'tStartMs': 1000, 'dDurationMs': 2000, 'segs': [{'utf8': 'Hello'}, {'utf8': ' world'}]},
+        {'tStartMs': 3000, 'segs': [{'utf8': '\n'}]},
+        {'tStartMs': 3500}
+    ]})
+    assert text == 'Hello world'
+    assert segments == [{'text': 'Hello world', 'start': 1.0, 'duration': 2.0}]
+
+    srt = '1\n00:00:00,000 --> 00:00:02,000\nFirst line\n\n2\n00:00:02,000 --> 00:00:04,500\nSecond line\n'
+    assert server.srt_to_text(srt).split() == ['First', 'line', 'Second', 'line']
+
+
+def test_video_probe_overlaps_rapidapi(monkeypatch, isolated_caches):
+    """The metadata probe runs while RapidAPI is tried and still labels its transcript"""
+    import threading
+    import time
+    import server
+
+    rapidapi_started = threading.Event()
+
+    def slow_probe(video_id, deadline=None, abandoned=None):
+        # Only finishes once RapidAPI has started, which a probe run before RapidAPI never sees
+        title = 'Probed title' if rapidapi_started.wait(5) else 'Probed first'
+        return {'title': title, 'uploader': 'Channel', 'duration': 60, 'view_count': 1,
+                'captionTracks': [], 'source': 'yt-dlp'}
+
+    def fake_rapidapi(video_id, deadline=None):
+        rapidapi_started.set()
+        return {'full': 'transcript text', 'method': 'rapidapi'}
+
+    monkeypatch.setattr(server, 'RAPIDAPI_KEY', 'fake')
+    monkeypatch.setattr(server, 'probe_video', slow_probe)
+    monkeypatch.setattr(server, 'fetch_transcript_rapidapi', fake_rapidapi)
+
+    transcript, method = server.fetch_transcript_for_analysis('abc123')
+    assert method == 'rapidapi'
+    assert transcript['title'] == 'Probed title' and transcript['duration'] == 60
+
+    # A RapidAPI transcript doesn't wait for a stuck probe, which is told to skip yt-dlp
+    released, abandoned_events = threading.Event(), []
+
+    def stuck_probe(video_id, deadline=None, abandoned=None):
+        abandoned_events.append(abandoned)
+        released.wait(5)
+
+    monkeypatch.setattr(server, 'probe_video', stuck_probe)
+    started = time.monotonic()
+    transcript, method = server.fetch_transcript_for_analysis('def456')
+    assert time.monotonic() - started < 2 and 'title' not in transcript
+    assert abandoned_events[0].is_set()
+    released.set()
+
+
+def test_listed_transcript_track_choice(monkeypatch):
+    """youtube-transcript-api tier: one listing, best track picked in memory, one fetch with segments"""
+    from types import SimpleNamespace
+    import server
+    from youtube_transcript_api import YouTubeTranscriptApi
+
+    fetched = []
+
+    def track(language_code, is_generated, translatable=False):
+        def fetch(preserve_formatting=False):
+            fetched.append(language_code)
+            return [{'text': f'{language_code} words ', 'start': 1.0, 'duration': 2.0},
+                    {'text': ' ', 'start': 3.0, 'duration': 1.0}]
+        translation_languages = [{'language': 'English', 'language_code': 'en'}] if translatable else []
+        return SimpleNamespace(language_code=language_code, is_generated=is_generated, fetch=fetch,
+                               translation_languages=translation_languages,
+                               translate=lambda code: track(f'{language_code}>{code}', True))
+
+    pick = server.pick_transcript_track
+    assert pick([track('en', True), track('en-GB', False)])[0].language_code == 'en-GB'
+    german = track('de', False, translatable=True)
+    assert pick([track('fr', True), german]) == (german, 'en')
+    assert pick([track('fr', True), track('de', False)])[0].language_code == 'de'
+    with pytest.raises(Exception):
+        pick([])
+
+    listings = []
+    monkeypatch.setattr(YouTubeTranscriptApi, 'list_transcripts',
+                        lambda video_id: listings.append(video_id) or [track('es', False, translatable=True)])
+    transcript = server.fetch_transcript_listed('abc123')
+    assert listings == ['abc123'] and fetched == ['es>en']
+    assert transcript['full'] == 'es>en words'
+    assert transcript['segments'] == [{'text': 'es>en words', 'start': 1.0, 'duration': 2.0}]
+    assert transcript['method'] == 'youtube-transcript-api (es -> en)'
+
+
+def test_media_pool_limits_jobs():
+    """Media jobs run in pool processes with a time limit and a memory cap"""
+    import time
+    import server
+    import media_jobs
+
+    events = {'events': [{'tStartMs': 0, 'dDurationMs': 1000, 'segs': [{'utf8': 'Hello'}]}]}
+    assert server.run_media_job(media_jobs.parse_json3_events, events) == (
+        [{'text': 'Hello', 'start': 0.0, 'duration': 1.0}], 'Hello'
+    )
+
+    started = time.monotonic()
+    with pytest.raises(media_jobs.MediaJobTimeout):
+        server.run_media_job(time.sleep, 30, deadline=server.Deadline(1))
+    assert time.monotonic() - started < 10
+
+    with pytest.raises(MemoryError):
+        server.run_media_job(bytearray, 4 * 1024 ** 3)
+
+    # The pool is still usable after both failures
+    assert server.run_media_job(media_jobs.parse_json3_events, events)[1] == 'Hello'
+
+    # Local transcription has a pool of its own, so it can't hold up yt-dlp and ffmpeg jobs
+    assert server.run_media_job(media_jobs.parse_json3_events, events, pool_kind='stt')[1] == 'Hello'
+    assert server.get_media_pool('stt') is not server.get_media_pool()
+    assert server.get_media_pool('stt')._max_workers == server.LOCAL_WHISPER_WORKERS
+    assert server.get_media_pool('stt')._initargs == (server.LOCAL_WHISPER_MEMORY_MB,)
+
+
+def test_transcription_backend_policy(monkeypatch):
+    """'auto' falls back to local transcription for oversized audio or API errors; requests can pick a backend"""
+    from types import SimpleNamespace
+    import server
+    import media_jobs
+
+    api_calls = []
+
+    def fake_media_job(func, *args, deadline=None, timeout=None, pool_kind='media'):
+        if func is media_jobs.download_audio:
+            with open(os.path.join(args[1], 'audio.mp3'), 'wb') as audio_file:
+                audio_file.write(b'x' * 1024)
+            return {'path': os.path.join(args[1], 'audio.mp3'), 'title': 'A video'}
+        assert func is media_jobs.transcribe_local and pool_kind == 'stt'
+        return {'full': 'local text', 'segments': [], 'method': 'whisper-local (small)', 'language': 'en'}
+
+    def failing_api(audio_file_path, deadline=None):
+        api_calls.append(audio_file_path)
+        raise Exception('API unavailable')
+
+    monkeypatch.setattr(server, 'run_media_job', fake_media_job)
+    monkeypatch.setattr(server, 'probe_video', lambda video_id, deadline=None, abandoned=None: None)
+    monkeypatch.setattr(server, 'transcribe_whisper_api', failing_api)
+    monkeypatch.setattr(server, 'openai_client', SimpleNamespace())
+    monkeypatch.setattr(server, 'local_transcription_available', lambda: True)
+
+    with server.transcription_backend_override('auto'):
+        transcript = server.fetch_transcript_whisper('abc123')
+    assert transcript['method'] == 'whisper-local (small)' and transcript['title'] == 'A video'
+    assert len(api_calls) == 1
+
+    with server.transcription_backend_override('api'):
+        with pytest.raises(Exception, match='API unavailable'):
+            server.fetch_transcript_whisper('abc123')
+
+    with server.transcription_backend_override('local'):
+        assert server.fetch_transcript_whisper('abc123')['full'] == 'local text'
+    assert len(api_calls) == 2
+
+    monkeypatch.setattr(server, 'WHISPER_API_MAX_MB', 0)
+    with server.transcription_backend_override('auto'):
+        assert server.fetch_transcript_whisper('abc123')['full'] == 'local text'
+    assert len(api_calls) == 2
+
+    # A probed duration over the API limit fails before any download when local isn't allowed
+    monkeypatch.setattr(server, 'WHISPER_API_MAX_MB', 25)
+    monkeypatch.setattr(server, 'run_media_job', lambda *args, **kwargs: pytest.fail('downloaded'))
+    with server.transcription_backend_override('api'):
+        with pytest.raises(Exception, match='Audio too large'):
+            server.fetch_transcript_whisper('abc123', metadata={'duration': 3 * 3600, 'captionTracks': []})
+
+    assert server.requested_transcription_backend({}) is None
+    with pytest.raises(ValueError):
+        server.requested_transcription_backend({'transcriptionBackend': 'gpu'})
+
+    # /api/transcription runs under the analysis deadline
+    deadlines = []
+
+    def fake_ytdlp(video_id, deadline=None):
+        deadlines.append(deadline)
+        return {'full': 'captions', 'segments': [], 'method': 'yt-dlp'}
+
+    monkeypatch.setattr(server, 'fetch_transcript_ytdlp', fake_ytdlp)
+    response = server.app.test_client().post('/api/transcription', json={'youtubeUrl': 'https://youtu.be/abc123'})
+    assert response.status_code == 200
+    assert deadlines[0].remaining() <= server.ANALYSIS_DEADLINE_SECONDS
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
@@ -0,0 +1,177 @@
+"""
+Pre-compute transcripts, extracted facts and sample-mode analyses for videos that are
+expected to be popular, so the first real request hits warm caches.
+
+Video IDs (or YouTube URLs) are read one per line from a file or stdin; blank lines and
+lines starting with # are ignored. Progress is saved to a state file after every video,
+so an interrupted run picks up where it stopped (videos already done are skipped, failed
+ones are retried). Provider budgets stop new videos from starting once the OpenAI or
+Brave calls made by this run reach the limit; videos already in flight still finish.
+
+Usage:
+    python warm_cache.py trending.txt [--concurrency 2] [--max-openai-calls 500]
+    cat ids.txt | python warm_cache.py - --stages transcript,facts
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import server
+
+STAGES = ('transcript', 'facts', 'analysis')
+
+
+def read_video_ids(lines):
+    """Unique video IDs from lines of IDs or URLs, in order; unparseable lines are reported and skipped"""
+    video_ids = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        video_id = line if server.VIDEO_ID_PATTERN.match(line) else server.extract_video_id(line)
+        if not video_id:
+            print(f'Skipping unrecognized line: {line}', file=sys.stderr)
+        elif video_id not in video_ids:
+            video_ids.append(video_id)
+    return video_ids
+
+
+def load_state(path):
+    if path and os.path.exists(path):
+        with open(path) as state_file:
+            return json.load(state_file)
+    return {'videos': {}}
+
+
+def save_state(path, state):
+    if not path:
+        return
+    # Write to a temporary file first so an interrupted write never corrupts the state
+    with open(f'{path}.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def warm_video(video_id, stages, timeout):
+    """Warm the caches for one video; returns its status entry (one result per stage)"""
+    entry = {'status': 'done'}
+    deadline = server.Deadline(timeout)
+    try:
+        transcript = None
+        if 'transcript' in stages or 'facts' in stages:
+            cached = server.get_cached_transcript(video_id)
+            transcript, _ = cached or server.fetch_transcript_for_analysis(video_id, deadline)
+            entry['transcript'] = 'cached' if cached else 'fetched'
+
+        if 'facts' in stages:
+            key = server.facts_cache_key(server.facts_extraction_request(transcript.get('full', '')))
+            cached = server.get_cached_facts(key) is not None
+            facts = server.extract_facts_cached(transcript.get('full', ''), deadline)
+            entry['facts'] = f'{"cached" if cached else "extracted"} ({len(facts)})'
+
+        if 'analysis' in stages:
+            age = server.analysis_cache_age(video_id, 'sample')
+            if age is not None and age <= server.ANALYSIS_CACHE_FRESH_SECONDS:
+                entry['analysis'] = 'cached'
+            else:
+                result = server.store_analysis(video_id, 'sample', server.run_analysis(video_id, 'sample', deadline))
+                if result.get('degraded'):
+                    # Degraded results aren't cached; leave the video to be retried
+                    entry.update(status='failed', analysis='degraded (not cached)')
+                else:
+                    entry['analysis'] = f'computed ({result.get("grade", "-")})'
+    except server.AnalysisError as e:
+        entry.update(status='failed', error=e.payload.get('error'))
+    except Exception as e:
+        entry.update(status='failed', error=str(e))
+
+    entry['updatedAt'] = datetime.utcnow().isoformat() + 'Z'
+    return entry
+
+
+def provider_calls():
+    return {provider: server.metrics.total('truthquest_provider_request_seconds', provider=provider)
+            for provider in ('openai', 'brave')}
+
+
+def budget_exhausted(args):
+    calls = provider_calls()
+    return ((args.max_openai_calls is not None and calls['openai'] >= args.max_openai_calls)
+            or (args.max_search_calls is not None and calls['brave'] >= args.max_search_calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', nargs='?', default='-', help='file with one video ID or URL per line (- for stdin)')
+    parser.add_argument('--stages', default=','.join(STAGES), help=f'comma-separated subset of {", ".join(STAGES)}')
+    parser.add_argument('--concurrency', type=int, default=2, help='videos warmed at once')
+    parser.add_argument('--max-openai-calls', type=int, help='stop starting videos after this many OpenAI calls')
+    parser.add_argument('--max-search-calls', type=int, help='stop starting videos after this many Brave searches')
+    parser.add_argument('--timeout', type=int, default=server.ANALYSIS_DEADLINE_SECONDS, help='seconds per video')
+    parser.add_argument('--state', default='warm_cache_state.json', help='progress file used to resume ("" to disable)')
+    parser.add_argument('--force', action='store_true', help='warm videos the state file marks as done')
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))}')
+
+    if args.source == '-':
+        video_ids = read_video_ids(sys.stdin)
+    else:
+        with open(args.source) as source_file:
+            video_ids = read_video_ids(source_file)
+
+    state = load_state(args.state)
+    todo = [video_id for video_id in video_ids
+            if args.force or state['videos'].get(video_id, {}).get('status') != 'done']
+    print(f'{len(video_ids)} videos, {len(video_ids) - len(todo)} already done, warming {len(todo)} '
+          f'(stages: {", ".join(stages)})')
+
+    results = {}
+    stopped_by_budget = False
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = {}
+        queued = iter(todo)
+        try:
+            while True:
+                for video_id in queued:
+                    if budget_exhausted(args):
+                        stopped_by_budget = True
+                        break
+                    pending[executor.submit(warm_video, video_id, stages, args.timeout)] = video_id
+                    if len(pending) >= args.concurrency:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    video_id = pending.pop(future)
+                    entry = results[video_id] = future.result()
+                    state['videos'][video_id] = entry
+                    save_state(args.state, state)
+                    details = ', '.join(f'{stage}: {entry[stage]}' for stage in stages if stage in entry)
+                    error = f'  {entry["error"]}' if entry.get('error') else ''
+                    print(f'{video_id}  {entry["status"]:<6}  {details}{error}')
+        except KeyboardInterrupt:
+            print('Interrupted; finishing videos in flight (progress is saved)', file=sys.stderr)
+            for future in pending:
+                future.cancel()
+            raise
+
+    done_count = sum(1 for entry in results.values() if entry['status'] == 'done')
+    calls = provider_calls()
+    print(f'\nWarmed {done_count}, failed {len(results) - done_count}, not started {len(todo) - len(results)}'
+          f'{" (provider budget reached)" if stopped_by_budget else ""}')
+    print(f'Provider calls: {calls["openai"]} OpenAI, {calls["brave"]} Brave')
+    sys.exit(1 if len(results) > done_count else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -101,7 +101,7 @@ Type=simple
 User=azureuser
 WorkingDirectory=$APP_DIR/backend
 Environment="PATH=$APP_DIR/backend/venv/bin"
-ExecStart=$APP_DIR/backend/venv/bin/python server.py
+ExecStart=$APP_DIR/backend/venv/bin/python serve.py
 Restart=always
 RestartSec=10
 
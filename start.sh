@@ -77,7 +77,7 @@ echo ""
 # Start backend in background
 cd ../backend
 source venv/bin/activate
-python server.py &
+python serve.py &
 BACKEND_PID=$!
 
 # Start frontend in foreground